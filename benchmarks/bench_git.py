@@ -0,0 +1,104 @@
+"""Time getting a recipe repository with a long history ready to plan.
+
+    python benchmarks/bench_git.py --commits 20000 --recipes 500 --range 10
+
+Builds a bare repository with a long linear history (with git fast-import, so that making it
+is quick), then compares three ways of getting the history that planning a range of the last
+--range commits needs:
+
+* a full clone
+* a shallow clone, deepened by git_history.ensure_history
+* a shallow, blob-less partial clone, deepened by git_history.ensure_history
+
+It also compares checking the revisions planning needs with one batched git call
+(git_history.missing_revs) against one `git rev-parse` per revision.
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from conda_gitlab_ci import git_history
+
+
+def fast_import_stream(n_commits, n_recipes):
+    """A git fast-import stream of n_commits commits, each changing one of n_recipes recipes"""
+    lines = []
+    for i in range(n_commits):
+        recipe = 'recipe{0}'.format(i % n_recipes)
+        content = 'package:\n  name: {0}\n  version: {1}\n'.format(recipe, i)
+        # each commit follows the one before it on the branch, so no 'from' is needed
+        lines.extend(['commit refs/heads/master',
+                      'committer bench <bench@example.com> {0} +0000'.format(1500000000 + i),
+                      'data {0}'.format(len('commit {0}'.format(i))),
+                      'commit {0}'.format(i),
+                      'M 644 inline {0}/meta.yaml'.format(recipe),
+                      'data {0}'.format(len(content.encode('utf-8'))),
+                      content])
+    return "\n".join(lines) + "\n"
+
+
+def make_bare_repo(path, n_commits, n_recipes):
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+    git_history.run_git(['fast-import', '--quiet'], path,
+                        input=fast_import_stream(n_commits, n_recipes))
+    # let clones ask for commits by sha, as gitlab does
+    subprocess.check_call(['git', 'config', 'uploadpack.allowAnySHA1InWant', 'true'], cwd=path)
+    subprocess.check_call(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=path)
+
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def clone(url, destination, *options):
+    subprocess.check_call(['git', 'clone', '-q'] + list(options) + [url, destination])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commits', type=int, default=20000)
+    parser.add_argument('--recipes', type=int, default=500)
+    parser.add_argument('--range', type=int, default=10,
+                        help='plan the changes of this many of the latest commits')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cgci_bench_git_')
+    try:
+        bare = os.path.join(workdir, 'recipes.git')
+        print("Making a repository with {0} commits to {1} recipes: {2:.2f}s".format(
+            args.commits, args.recipes,
+            timed(make_bare_repo, bare, args.commits, args.recipes)))
+        url = 'file://' + bare
+        git_rev, stop_rev = 'HEAD~{0}'.format(args.range), 'HEAD'
+
+        full = os.path.join(workdir, 'full')
+        print("{0:<40} {1:.2f}s".format("full clone", timed(clone, url, full)))
+        for name, options in (("shallow clone + ensure_history", ['--depth', '1']),
+                              ("partial shallow clone + ensure_history",
+                               ['--depth', '1', '--filter=blob:none'])):
+            destination = os.path.join(workdir, name.split()[0])
+            seconds = timed(clone, url, destination, *options)
+            seconds += timed(git_history.ensure_history, destination, git_rev, stop_rev)
+            print("{0:<40} {1:.2f}s".format(name, seconds))
+
+        revs = ['HEAD~{0}'.format(i) for i in range(args.range + 1)]
+        batched = timed(git_history.missing_revs, full, revs)
+
+        def one_call_per_rev():
+            for rev in revs:
+                git_history.run_git(['rev-parse', '--verify', '-q', rev + '^{commit}'], full)
+
+        print("check {0} revisions, batched: {1:.3f}s; one call each: {2:.3f}s".format(
+            len(revs), batched, timed(one_call_per_rev)))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
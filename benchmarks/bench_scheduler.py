@@ -0,0 +1,112 @@
+"""Compare the dask and native dispatchers on a synthetic plan against a simulated CI server.
+
+    python benchmarks/bench_scheduler.py --jobs 1000 --threads 10 50 200 --runners 20
+
+The simulated server (backends.SimulatedBackend) queues jobs for a limited number of runners
+per worker label and runs each for a random time.  With the defaults - plenty of runners and a
+short, fixed duration - the numbers measure dispatcher overhead (startup, scheduling and
+polling), not build time.  With fewer runners and realistic durations, they show how
+dispatch settings affect the makespan and how busy the runners are kept.  With
+--interchangeable, every job can run on any of the --labels, and the native dispatcher routes
+each to the least busy (see routing); give the labels uneven --label-runners to see the
+difference routing makes.
+"""
+from __future__ import print_function, division
+import argparse
+import random
+import time
+
+import networkx as nx
+
+from conda_gitlab_ci import execute, scheduler
+from conda_gitlab_ci.backends import SimulatedBackend
+
+
+def synthetic_plan(n_jobs, width=50, max_deps=3, labels=1, seed=0, interchangeable=False):
+    """Layered random DAG: each job depends on up to max_deps jobs from earlier layers.  Jobs
+    are spread over this many worker labels.  If interchangeable, each can also run on any of
+    the other labels."""
+    rng = random.Random(seed)
+    jobs = nx.DiGraph()
+    for i in range(n_jobs):
+        key = 'build_pkg{0}_label'.format(i)
+        label = 'label{0}'.format(i % labels)
+        jobs.add_node(key, configuration={'variables': {'BUILD_RECIPE': 'pkg{0}'.format(i),
+                                                        'TARGET_PLATFORM': (label, )}},
+                      commit_sha='abc', worker_label=label)
+        if interchangeable:
+            jobs.node[key]['worker_labels'] = [label] + ['label{0}'.format(j)
+                                                         for j in range(labels) if j != i % labels]
+        if i >= width:
+            for dep in rng.sample(range(i - i % width), rng.randint(0, max_deps)):
+                jobs.add_edge(key, 'build_pkg{0}_label'.format(dep))
+    return jobs
+
+
+def run_dask(jobs, threads, backend, sleep_interval):
+    from distributed import LocalCluster, Client, wait
+    start = time.time()
+    # the simulated backend lives in this process, so the workers must too
+    cluster = LocalCluster(n_workers=1, threads_per_worker=threads, processes=False)
+    client = Client(cluster)
+    futures = client.persist(execute.delayed_jobs(jobs, backend=backend,
+                                                  sleep_interval=sleep_interval))
+    wait(futures)
+    elapsed = time.time() - start
+    client.close()
+    cluster.close()
+    return elapsed
+
+
+def run_native(jobs, threads, backend, sleep_interval):
+    start = time.time()
+    scheduler.run_job_graph(jobs, threads=threads, backend=backend,
+                            sleep_interval=sleep_interval)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[50],
+                        help='dispatch threads; give several to compare them')
+    parser.add_argument('--schedulers', nargs='+', default=['native', 'dask'],
+                        choices=('native', 'dask'))
+    parser.add_argument('--labels', type=int, default=1,
+                        help='number of worker labels to spread jobs over')
+    parser.add_argument('--runners', type=int, default=1000,
+                        help='runners per worker label')
+    parser.add_argument('--label-runners', type=int, nargs='+', default=[],
+                        help='runners of each worker label in turn, instead of --runners')
+    parser.add_argument('--interchangeable', action='store_true',
+                        help='let every job run on any worker label')
+    parser.add_argument('--duration', type=float, default=0.05,
+                        help='mean seconds each simulated job takes')
+    parser.add_argument('--duration-sigma', type=float, default=0.0,
+                        help='spread of job durations (lognormal sigma); 0 for fixed')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='probability that a simulated job fails')
+    parser.add_argument('--sleep-interval', type=float, default=0.01,
+                        help='seconds between status polls')
+    args = parser.parse_args()
+
+    jobs = synthetic_plan(args.jobs, labels=args.labels, interchangeable=args.interchangeable)
+    label_runners = {'label{0}'.format(i): n for i, n in enumerate(args.label_runners)}
+    print("{0} jobs, {1} edges, critical path of {2} jobs".format(
+        jobs.number_of_nodes(), jobs.number_of_edges(), len(nx.dag_longest_path(jobs))))
+    runners = {'native': run_native, 'dask': run_dask}
+    for threads in args.threads:
+        for name in args.schedulers:
+            backend = SimulatedBackend(runners=label_runners, default_runners=args.runners,
+                                       duration=args.duration,
+                                       duration_sigma=args.duration_sigma,
+                                       failure_rate=args.failure_rate, seed=0)
+            elapsed = runners[name](jobs, threads, backend, args.sleep_interval)
+            utilization = backend.utilization()
+            print("{0:>8}, {1:>4} threads: {2:.2f}s, {3} builds, runner utilization {4:.0%}"
+                  .format(name, threads, elapsed, len(backend.builds),
+                          sum(utilization.values()) / len(utilization) if utilization else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""CI backends: where jobs are submitted, checked on and canceled.
+
+A backend has three methods, mirroring trigger_gitlab:
+
+    submit(configuration, commit_sha, **kwargs) -> build id
+    status(build_id, commit_sha=None, **kwargs) -> 'success', 'failed', 'canceled' or
+                                                   'skipped' once done (see
+                                                   trigger_gitlab.FINISHED); anything else,
+                                                   such as 'pending' or 'running', until then
+    cancel(build_id, **kwargs)
+
+and optionally
+
+    trace(build_id, **kwargs) -> the build's log, for the results of fused jobs (see fusion)
+
+Pass one as backend= to execute._job (through run_job_graph, Dispatcher or delayed_jobs);
+without one, jobs go to gitlab.  SimulatedBackend stands in for a CI server, for load testing
+dispatch without one.  It keeps its state in memory, so with dask it only works with a threaded
+(processes=False) cluster.
+"""
+from __future__ import print_function, division
+import collections
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+import weakref
+
+from .metrics import job_label
+from .trigger_gitlab import submit_job, check_job_status, cancel_job, get_job_trace
+
+
+class GitlabBackend(object):
+    """The gitlab API, as used by default"""
+    def submit(self, configuration, commit_sha, **kwargs):
+        return submit_job(configuration, commit_sha, **kwargs)
+
+    def status(self, build_id, commit_sha=None, **kwargs):
+        return check_job_status(build_id, commit_sha=commit_sha, **kwargs)
+
+    def cancel(self, build_id, **kwargs):
+        return cancel_job(build_id, **kwargs)
+
+    def trace(self, build_id, **kwargs):
+        return get_job_trace(build_id, **kwargs)
+
+
+# simulated backends by id.  dask pickles task arguments even for threaded clusters; unpickling a
+#    backend in the same process gives back the same instance, and with it the same state.
+_simulated = weakref.WeakValueDictionary()
+_simulated_ids = itertools.count()
+
+
+def _simulated_backend(backend_id):
+    return _simulated[backend_id]
+
+
+class SimulatedBackend(object):
+    """An in-memory CI server with a limited number of runners per worker label.
+
+    Jobs queue (pending) first-come first-served per label until a runner is free, then run
+    for a random duration and succeed or fail at random.
+
+    runners: worker label -> number of runners.  Labels not listed get default_runners.
+    duration: mean seconds a job runs
+    duration_sigma: spread of run times; durations are lognormally distributed around the mean
+    failure_rate: probability that a job fails
+    seed: for repeatable runs
+    clock: function returning the current time in seconds
+    """
+    def __init__(self, runners=None, default_runners=4, duration=1.0, duration_sigma=0.5,
+                 failure_rate=0.0, seed=None, clock=time.time):
+        self.runners = runners or {}
+        self.default_runners = default_runners
+        self.duration = duration
+        self.duration_sigma = duration_sigma
+        self.failure_rate = failure_rate
+        self.clock = clock
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        # build id -> {'label', 'status', 'duration', 'fails', 'submitted', 'started',
+        #              'finished'}
+        self.builds = {}
+        # worker label -> build ids waiting for a runner, oldest first
+        self._queues = collections.defaultdict(collections.deque)
+        # worker label -> heap of (finish time, build id) for the builds running on it
+        self._running = collections.defaultdict(list)
+        self._id = next(_simulated_ids)
+        _simulated[self._id] = self
+
+    def __reduce__(self):
+        return _simulated_backend, (self._id, )
+
+    def _duration(self):
+        if not self.duration_sigma:
+            return self.duration
+        # mean of lognormvariate(mu, sigma) is exp(mu + sigma ** 2 / 2)
+        return (self._random.lognormvariate(0, self.duration_sigma) * self.duration /
+                math.exp(self.duration_sigma ** 2 / 2))
+
+    def _start(self, label, now):
+        """Start queued builds on free runners, as of time now"""
+        queue, running = self._queues[label], self._running[label]
+        while queue and len(running) < self.runners.get(label, self.default_runners):
+            build = self.builds[queue.popleft()]
+            build['status'] = 'running'
+            build['started'] = now
+            heapq.heappush(running, (now + build['duration'], build['id']))
+
+    def _advance(self, label, now):
+        """Play the queue of a label forward to time now, finishing builds as their time comes
+        and starting queued builds on the runners they free"""
+        running = self._running[label]
+        while running and running[0][0] <= now:
+            finished, build_id = heapq.heappop(running)
+            build = self.builds[build_id]
+            build['status'] = 'failed' if build['fails'] else 'success'
+            build['finished'] = finished
+            self._start(label, finished)
+        self._start(label, now)
+
+    def submit(self, configuration, commit_sha, **kwargs):
+        label = job_label(configuration)
+        with self._lock:
+            now = self.clock()
+            build_id = next(self._ids)
+            self.builds[build_id] = {'id': build_id, 'label': label, 'status': 'pending',
+                                     'duration': self._duration(),
+                                     'fails': self._random.random() < self.failure_rate,
+                                     'submitted': now, 'started': None, 'finished': None}
+            self._queues[label].append(build_id)
+            self._advance(label, now)
+        return build_id
+
+    def status(self, build_id, commit_sha=None, **kwargs):
+        with self._lock:
+            build = self.builds[build_id]
+            self._advance(build['label'], self.clock())
+            return build['status']
+
+    def cancel(self, build_id, **kwargs):
+        with self._lock:
+            build = self.builds[build_id]
+            now = self.clock()
+            self._advance(build['label'], now)
+            if build['status'] == 'pending':
+                self._queues[build['label']].remove(build_id)
+            elif build['status'] == 'running':
+                running = self._running[build['label']]
+                running[:] = [entry for entry in running if entry[1] != build_id]
+                heapq.heapify(running)
+            else:
+                return build['status']
+            build['status'] = 'canceled'
+            build['finished'] = now
+            # the runner it had is free for the next build
+            self._start(build['label'], now)
+            return build['status']
+
+    def utilization(self):
+        """worker label -> fraction of runner time used, from the first submission to the last
+        finished build"""
+        with self._lock:
+            builds = [build for build in self.builds.values() if build['finished'] is not None]
+        busy, start, end = {}, {}, {}
+        for build in builds:
+            label = build['label']
+            if build['started'] is not None:
+                busy[label] = busy.get(label, 0) + build['finished'] - build['started']
+            start[label] = min(start.get(label, build['submitted']), build['submitted'])
+            end[label] = max(end.get(label, build['finished']), build['finished'])
+        return {label: busy.get(label, 0) /
+                (self.runners.get(label, self.default_runners) * (end[label] - start[label]))
+                for label in start if end[label] > start[label]}
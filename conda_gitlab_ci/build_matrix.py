@@ -1,27 +1,49 @@
 from __future__ import print_function, division
 import contextlib
-from itertools import product
+import itertools
 import os
 
 from conda_build.api import render
 import six
-import yaml
+
+from .config import load_yaml
+
+# keys of versions.yml that hold rules rather than variables.  Each is a list:
+#    exclude: partial version sets to leave out, e.g. {CONDA_PY: "2.7", CONDA_NPY: "1.11"}.  A
+#             variable may be given a list of values, any of which matches.
+#    include: version sets to add, even where the matrix or exclusions don't have them
+#    zip: groups of variables that take their values in step instead of in every combination,
+#         e.g. [CONDA_PY, CONDA_NPY] pairs the first python with the first numpy, and so on
+#    A 'recipes' key maps recipe folder names to overrides of the variables and more rules.
+RULES = ('exclude', 'include', 'zip')
+
+# (recipe folder, matrix variables) -> (git tree hash, the variables that apply to the recipe).
+#    Like compute_build_graph._RENDERED, a long-running process (see daemon) only renders a
+#    recipe again to filter its matrix when new commits change it.
+_FILTERED = {}
 
 
 def load_platforms(platforms_dir):
-    platforms = []
-    for f in os.listdir(platforms_dir):
-        if f.endswith('.yml'):
-            with open(os.path.join(platforms_dir, f)) as buff:
-                platforms.append(yaml.load(buff))
-    return platforms
+    """Return the (frozen) platform dictionaries defined in a directory of .yml files"""
+    return [load_yaml(os.path.join(platforms_dir, f))
+            for f in sorted(os.listdir(platforms_dir)) if f.endswith('.yml')]
+
+
+def worker_labels(platform):
+    """The worker labels a platform's jobs can run on.  worker_label is one label, or a list of
+    interchangeable ones; the first of them is the platform's own, which its jobs are named
+    after."""
+    labels = platform['worker_label']
+    if isinstance(labels, (list, tuple)):
+        return list(labels)
+    return [labels]
 
 
 @contextlib.contextmanager
 def set_conda_env_vars(env_dict):
     backup_dict = os.environ.copy()
     for env_var, value in env_dict.items():
-        if isinstance(value, list):
+        if isinstance(value, (list, tuple)):
             value = value[0]
         if not value:
             value = ""
@@ -41,7 +63,19 @@ def set_conda_env_vars(env_dict):
             os.environ[env_var] = value
 
 
-def _filter_environment_with_metadata(build_recipe, version_dicts):
+def _filter_environment_with_metadata(build_recipe, version_dicts, key=None):
+    """The matrix variables that apply to a recipe: python, numpy, perl, lua and r-base are
+    dropped unless the recipe's run requirements use them without a version of their own.
+
+    key: the git tree hash of the recipe's folder, to re-use the earlier result for the same
+         variables instead of rendering the recipe again
+    """
+    cache_key = (build_recipe,
+                 tuple(sorted((name, str(value)) for name, value in version_dicts.items())))
+    cached = _FILTERED.get(cache_key)
+    if key is not None and cached is not None and cached[0] == key:
+        return dict(cached[1])
+
     def del_key(version_dicts, key):
         if key == 'python':
             key = 'py'
@@ -81,29 +115,161 @@ def _filter_environment_with_metadata(build_recipe, version_dicts):
         else:
             version_dicts = del_key(version_dicts, name)
 
+    if key is not None:
+        _FILTERED[cache_key] = (key, dict(version_dicts))
     return version_dicts
 
 
-def _get_versions_product(build_recipe, versions_file):
-    with open(versions_file) as f:
-        dicts = yaml.load(f)
+def _values(value):
+    """The values of a variable or rule, which may be given as one value or a list"""
+    return tuple(value) if isinstance(value, (list, tuple)) else (value, )
+
+
+def split_versions(data, recipe=None):
+    """Split the contents of versions.yml into its variables (name -> values) and its rules
+    (see RULES), with the overrides for recipe (a recipe folder name) applied.
+
+    An override's variables replace the lists of the same name, and its rules are added to the
+    ones for every recipe.
+    """
+    variables = {name: _values(values) for name, values in data.items()
+                 if name not in RULES + ('recipes', )}
+    rules = {rule: list(data.get(rule) or ()) for rule in RULES}
+    override = (data.get('recipes') or {}).get(recipe) or {}
+    for name, values in override.items():
+        if name in RULES:
+            rules[name].extend(values or ())
+        else:
+            variables[name] = _values(values)
+    return variables, rules
+
+
+def _axes(variables, zips):
+    """The (names, values) axes of a matrix: each zip group is one axis, whose values are the
+    tuples of its variables' values taken in step, and each other variable is an axis of its
+    own.  Groups only zip the variables that this recipe's matrix has."""
+    axes = []
+    zipped = set()
+    for group in zips:
+        names = [name for name in _values(group) if name in variables and name not in zipped]
+        if len(names) < 2:
+            continue
+        if len(set(len(variables[name]) for name in names)) > 1:
+            raise ValueError("Zipped variables must have the same number of values: "
+                             "{0}".format(", ".join(names)))
+        axes.append((names, list(six.moves.zip(*[variables[name] for name in names]))))
+        zipped.update(names)
+    axes.extend(([name], [(value, ) for value in variables[name]])
+                for name in sorted(variables) if name not in zipped)
+    return axes
+
+
+def _matches(rule, version_set):
+    """Whether a version set has one of a rule's values for each of its variables"""
+    return all(str(version_set[name]) in [str(value) for value in _values(values)]
+               for name, values in rule.items())
+
+
+def _product(variables, zips=(), excludes=()):
+    """The version sets of a matrix, one at a time.  Exclusions prune the matrix as soon as
+    their variables are set, so excluded parts are never enumerated."""
+    axes = _axes(variables, zips)
+    axis = {name: i for i, (names, _) in enumerate(axes) for name in names}
+    # exclusions to check once each axis is set: those whose last variable is on it
+    checks = [[] for _ in axes]
+    for rule in excludes:
+        checks[max(axis[name] for name in rule)].append(rule)
+
+    def expand(i, version_set):
+        if i == len(axes):
+            yield dict(version_set)
+            return
+        names, values = axes[i]
+        for value in values:
+            version_set.update(six.moves.zip(names, value))
+            if not any(_matches(rule, version_set) for rule in checks[i]):
+                for complete in expand(i + 1, version_set):
+                    yield complete
+        for name in names:
+            version_set.pop(name, None)
+
+    return expand(0, {})
+
+
+def matrix_size(variables):
+    """How many version sets the full product of variables has"""
+    size = 1
+    for values in variables.values():
+        size *= len(values)
+    return size
+
+
+def sparse_product(variables, rules):
+    """The version sets of a matrix with its rules applied, one at a time, without
+    enumerating what the rules leave out.
+
+    Rules only apply to a recipe's matrix when it has all of their variables: an exclusion of
+    numpy versions doesn't drop python versions of recipes that don't use numpy.  Inclusions
+    are version sets of their own; variables they don't give take every value (zipped as
+    usual), and exclusions don't apply to them.
+    """
+    def applies(rule):
+        return rule and all(name in variables for name in rule)
+
+    seen = set()
+    excludes = [rule for rule in rules['exclude'] if applies(rule)]
+    includes = [rule for rule in rules['include'] if applies(rule)]
+    products = [_product(variables, rules['zip'], excludes)]
+    for rule in includes:
+        included = dict(variables, **{name: _values(values) for name, values in rule.items()})
+        zips = [group for group in rules['zip'] if not set(_values(group)) & set(rule)]
+        products.append(_product(included, zips))
+    for version_set in itertools.chain(*products):
+        key = tuple(sorted((name, str(value)) for name, value in version_set.items()))
+        if key not in seen:
+            seen.add(key)
+            yield version_set
+
+
+def _get_versions_product(build_recipe, versions_file, key=None):
+    """The variables (before rules) and the version sets (after rules) of a recipe's
+    matrix.  key is the git tree hash of the recipe's folder, if known (see
+    _filter_environment_with_metadata)."""
+    variables, rules = split_versions(load_yaml(versions_file),
+                                      os.path.basename(build_recipe.rstrip(os.sep)))
     if os.path.isdir(build_recipe):
-        dicts = _filter_environment_with_metadata(build_recipe, dicts)
-    # http://stackoverflow.com/a/5228294/1170370
-    return (dict(six.moves.zip(dicts, x)) for x in product(*dicts.values()))
+        variables = _filter_environment_with_metadata(build_recipe, variables, key=key)
+    return variables, sparse_product(variables, rules)
+
 
+def expand_build_matrix(build_recipe, repo_base_dir, label, counts=None, key=None):
+    """The configurations to build a recipe with on a worker label: one for each version set
+    that versions.yml's matrix and rules give (see sparse_product).
 
-def expand_build_matrix(build_recipe, repo_base_dir, label):
+    counts: optional dictionary to add how many configurations the full matrix has ('matrix'),
+            how many are planned ('planned') and how many of the full matrix's are not
+            ('excluded') to.  Configurations that include rules add outside of the full matrix
+            are planned, but don't make up for ones excluded from it.
+    key: the git tree hash of the recipe's folder, so that the recipe is only rendered again
+         when it changes (see _filter_environment_with_metadata)
+    """
     configurations = []
     if not os.path.isabs(build_recipe):
         build_recipe = os.path.join(repo_base_dir, build_recipe)
-    version_sets = _get_versions_product(build_recipe,
-                                         os.path.join(repo_base_dir,
-                                                      'versions.yml'))
+    variables, version_sets = _get_versions_product(build_recipe,
+                                                    os.path.join(repo_base_dir,
+                                                                 'versions.yml'),
+                                                    key=key)
     for version_set in version_sets:
         version_set["TARGET_PLATFORM"] = label,
         if os.path.isdir(build_recipe):
             version_set["BUILD_RECIPE"] = build_recipe
         configurations.append({'variables': version_set})
 
+    if counts is not None:
+        counts['matrix'] = counts.get('matrix', 0) + matrix_size(variables)
+        counts['planned'] = counts.get('planned', 0) + len(configurations)
+        in_matrix = sum(1 for configuration in configurations
+                        if _matches(variables, configuration['variables']))
+        counts['excluded'] = counts.get('excluded', 0) + matrix_size(variables) - in_matrix
     return configurations
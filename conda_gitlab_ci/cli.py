@@ -1,9 +1,24 @@
+from __future__ import print_function, division
 import argparse
+import contextlib
 
 from dask import visualize
 from distributed import LocalCluster, Client, progress
+import networkx as nx
 
-from .execute import get_dask_outputs
+from .daemon import serve
+from .execute import (get_dask_outputs, compute_job_graph, delayed_jobs, stream_job_graph,
+                      summarize_plan)
+from .fusion import fuse_jobs
+from .history import DurationHistory
+from .journal import Journal
+from .result_cache import ResultCache
+from . import metrics
+from .metrics import MetricsWriter
+from .pipeline import dispatch_pipeline
+from .sharding import parse_shard, plan_shard, write_shard, read_shard, merge_shards
+from .status import StatusBoard
+from .scheduler import Dispatcher, summarize, FAILED
 
 
 def parse_args(parse_this=None):
@@ -36,31 +51,281 @@ def parse_args(parse_this=None):
                         default=None,
                         help=('stop revision to examine.  When provided,'
                               'changes are git_rev..stop_rev'))
+    parser.add_argument('--semantic-changes', action='store_true',
+                        help=('Only build changed recipes whose build inputs changed: ignore '
+                              'documentation, and compare the rendered recipes of both '
+                              'revisions when only meta.yaml changed.'))
+    parser.add_argument('--impact', action='store_true',
+                        help=('With --steps, only follow downstream packages whose requirement '
+                              'on a changed package matches the version its recipe makes, '
+                              'skipping packages that pin another version.'))
+    parser.add_argument('--condense-cycles', action='store_true',
+                        help=('Plan packages whose requirements form a cycle one after the '
+                              'other, as one unit, instead of failing on the cycle.  The rest '
+                              'of the graph is still built in parallel.'))
+    parser.add_argument('--budget',
+                        type=float,
+                        help=('With --steps, spend this many runner-minutes on downstream '
+                              'packages instead of a --max-downstream count, picking the ones '
+                              'most depended on for their past duration (see --history) first.'))
     parser.add_argument('--threads',
                         default=50,
+                        type=int,
                         help=('dask scheduling threads.  Effectively number of parallel builds, '
                               'though not all builds run on one host.'))
+    parser.add_argument('--scheduler',
+                        default='dask',
+                        choices=('dask', 'native'),
+                        help=('How to dispatch jobs.  "dask" uses a local distributed cluster; '
+                              '"native" uses a lightweight built-in scheduler that skips jobs '
+                              'depending on failed jobs.'))
+    parser.add_argument('--fail-fast', action='store_true',
+                        help=('With the native scheduler, stop at the first failed job: submit '
+                              'nothing new and cancel builds already running on gitlab.'))
+    parser.add_argument('--journal',
+                        default='.cgci_journal',
+                        help=('With the native scheduler, file where submitted builds and their '
+                              'results are recorded as they happen.'))
+    parser.add_argument('--resume', action='store_true',
+                        help=('With the native scheduler, pick up a dispatch that was '
+                              'interrupted: skip jobs the journal says succeeded, and wait on '
+                              'builds that were still running instead of submitting them again.'))
+    parser.add_argument('--pipelined', action='store_true',
+                        help=('With the native scheduler, start dispatching the jobs of each '
+                              'platform as soon as it is planned, while the rest are still '
+                              'being planned.'))
+    parser.add_argument('--fuse-tests',
+                        type=float,
+                        metavar='SECONDS',
+                        help=('With the native scheduler, run test jobs that nothing depends on '
+                              'and that took less than SECONDS before (see --history) several '
+                              'to a runner job, in jobs of up to about SECONDS.  See the README '
+                              'for the .gitlab-ci.yml this needs.'))
+    parser.add_argument('--batch-pipeline', action='store_true',
+                        help=('Submit every job in one triggered pipeline, generated from the '
+                              'job graph, and wait on that pipeline instead of on each job.  '
+                              'See the README for the .gitlab-ci.yml this needs.'))
+    parser.add_argument('--pipeline-file',
+                        default='cgci_pipeline.yml',
+                        help='File where --batch-pipeline also writes the generated pipeline')
+    parser.add_argument('--planning-processes',
+                        default=1,
+                        type=int,
+                        help=('Plan each platform in its own worker process, using up to this '
+                              'many processes.  Bounds memory to one platform per process.'))
+    parser.add_argument('--low-memory',
+                        action='store_true',
+                        help=('Plan one platform at a time, letting go of its package index and '
+                              'rendered recipes before the next, for very large recipe '
+                              'repositories.  With --pipelined, dispatch then starts once '
+                              'planning is done.'))
+    distributed_planning = parser.add_mutually_exclusive_group()
+    distributed_planning.add_argument('--plan-shard',
+                        help=('Worker mode for planning across several hosts: plan only shard '
+                              'INDEX/COUNT of the platforms, write it to --plan-output, and '
+                              'quit.'))
+    distributed_planning.add_argument('--merge-plans',
+                        nargs="+",
+                        default=[],
+                        help=('Coordinator mode for planning across several hosts: dispatch '
+                              'the jobs planned by workers with --plan-shard, given as their '
+                              'output files, instead of planning here.'))
+    parser.add_argument('--plan-output',
+                        default='cgci_plan.json',
+                        help='File where --plan-shard writes its plan')
+    parser.add_argument('--status-file',
+                        help=('With the native scheduler, periodically rewrite this JSON file '
+                              'with the state of every job, counts per worker label and an '
+                              'ETA.'))
+    parser.add_argument('--status-interval',
+                        default=30,
+                        type=float,
+                        help=('Seconds between status updates (printed, and written to '
+                              '--status-file)'))
+    parser.add_argument('--history',
+                        default='.cgci_history.json',
+                        help=('File of how long jobs took in the past.  Used for ETAs, and '
+                              'updated after each native dispatch.'))
+    parser.add_argument('--result-cache',
+                        help=('With the native scheduler, file of the input hashes of jobs that '
+                              'succeeded.  Jobs whose recipe, configuration and dependencies '
+                              'are unchanged since they last succeeded are not submitted again, '
+                              'even for another commit.'))
+    parser.add_argument('--metrics-file',
+                        help=('Periodically write dispatch metrics (throughput, queue latency, '
+                              'API errors) to this file: JSON, or the Prometheus text format '
+                              'if the name ends in .prom'))
+    parser.add_argument('--metrics-interval',
+                        default=10,
+                        type=float,
+                        help='Seconds between writes of --metrics-file')
+    parser.add_argument('--daemon', action='store_true',
+                        help=('Keep running, and plan and dispatch on request over HTTP, with '
+                              'recipes, rendered metadata and package indexes kept in memory '
+                              'between requests.  See conda_gitlab_ci/daemon.py for the API.'))
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address the --daemon listens on')
+    parser.add_argument('--port',
+                        default=8765,
+                        type=int,
+                        help='Port the --daemon listens on')
+    parser.add_argument('--index-ttl',
+                        default=600,
+                        type=float,
+                        help=('Seconds the --daemon keeps package indexes before loading them '
+                              'again'))
+    parser.add_argument('--fetch',
+                        help='Git remote the --daemon fetches from before planning each request')
     parser.add_argument('--visualize',
                         help=('Output a PDF visualization of the package build graph, and quit.  '
                               'Argument is output file name (pdf)'),
                         default="")
     parser.add_argument('--test', action='store_true',
                         help='test packages (instead of building them)')
+    parser.add_argument('--plan', action='store_true',
+                        help=('Plan, print how many jobs there are per run and worker label and '
+                              'how many configurations versions.yml rules left out, and quit '
+                              'without submitting anything.'))
 
     return parser.parse_args(parse_this)
 
 
+@contextlib.contextmanager
+def _writing_metrics(path, interval):
+    if not path:
+        yield
+        return
+    with MetricsWriter(path, interval=interval):
+        yield
+
+
+def _result_cache(path):
+    return ResultCache(path) if path else None
+
+
+def _package_costs(args):
+    """Mean seconds by package from the duration history, when --budget needs them"""
+    return DurationHistory(args.history).package_means() if args.budget is not None else None
+
+
 def build_cli(args=None):
     if not args:
         args = parse_args()
     else:
         args = parse_args(args)
     filter_dirty = any(args.packages) or not args._all
+    if ((args.fail_fast or args.resume or args.pipelined or args.result_cache or
+         args.fuse_tests) and args.scheduler != 'native'):
+        raise ValueError("--fail-fast, --resume, --pipelined, --result-cache and --fuse-tests "
+                         "require --scheduler native")
+    if args.batch_pipeline and (args.fail_fast or args.resume or args.pipelined or
+                                args.result_cache or args.fuse_tests):
+        raise ValueError("--fail-fast, --resume, --pipelined, --result-cache and --fuse-tests "
+                         "can't be used with --batch-pipeline")
+    if args.pipelined and args.fuse_tests:
+        # jobs are dispatched as they are planned, before there is anything to fuse them with
+        raise ValueError("--fuse-tests can't be used with --pipelined")
 
-    outputs = get_dask_outputs(args.path, packages=args.packages, filter_dirty=filter_dirty,
-                               git_rev=args.git_rev, stop_rev=args.stop_rev,
-                               steps=args.steps, max_downstream=args.max_downstream,
-                               visualize=args.visualize, test=args.test)
+    if args.daemon:
+        metrics.registry.reset()
+        with _writing_metrics(args.metrics_file, args.metrics_interval):
+            return serve(args.path, host=args.host, port=args.port, index_ttl=args.index_ttl,
+                         fetch=args.fetch, threads=args.threads,
+                         history=DurationHistory(args.history),
+                         result_cache=_result_cache(args.result_cache))
+
+    if args.plan_shard:
+        shard, n_shards = parse_shard(args.plan_shard)
+        partial = plan_shard(args.path, shard, n_shards, packages=args.packages,
+                             filter_dirty=filter_dirty, git_rev=args.git_rev,
+                             stop_rev=args.stop_rev, steps=args.steps,
+                             max_downstream=args.max_downstream, test=args.test,
+                             semantic_changes=args.semantic_changes, impact=args.impact,
+                             budget=args.budget, costs=_package_costs(args),
+                             condense_cycles=args.condense_cycles)
+        write_shard(partial, args.plan_output)
+        return 0
+
+    metrics.registry.reset()
+    with _writing_metrics(args.metrics_file, args.metrics_interval):
+        return _dispatch(args, filter_dirty)
+
+
+def _dispatch(args, filter_dirty):
+    jobs = None
+    if args.merge_plans:
+        jobs = merge_shards([read_shard(filename) for filename in args.merge_plans])
+
+    more_jobs = ()
+    if args.pipelined and not args.visualize and not args.plan and jobs is None:
+        # start from nothing; jobs are added as platforms are planned
+        jobs = nx.DiGraph()
+        more_jobs = stream_job_graph(args.path, packages=args.packages,
+                                     filter_dirty=filter_dirty, git_rev=args.git_rev,
+                                     stop_rev=args.stop_rev, steps=args.steps,
+                                     max_downstream=args.max_downstream, test=args.test,
+                                     processes=args.planning_processes,
+                                     semantic_changes=args.semantic_changes, impact=args.impact,
+                                     budget=args.budget, costs=_package_costs(args),
+                                     low_memory=args.low_memory,
+                                     condense_cycles=args.condense_cycles)
+
+    native = args.scheduler == 'native' or args.batch_pipeline or args.plan
+    if native and not args.visualize and jobs is None:
+        jobs = compute_job_graph(args.path, packages=args.packages,
+                                 filter_dirty=filter_dirty, git_rev=args.git_rev,
+                                 stop_rev=args.stop_rev, steps=args.steps,
+                                 max_downstream=args.max_downstream, test=args.test,
+                                 processes=args.planning_processes,
+                                 semantic_changes=args.semantic_changes, impact=args.impact,
+                                 budget=args.budget, costs=_package_costs(args),
+                                 low_memory=args.low_memory,
+                                 condense_cycles=args.condense_cycles)
+
+    if args.plan and not args.visualize:
+        print(summarize_plan(jobs))
+        return 0
+
+    if args.batch_pipeline and not args.visualize:
+        status = dispatch_pipeline(jobs, path=args.pipeline_file)
+        return 0 if status == 'success' else 1
+
+    if args.scheduler == 'native' and not args.visualize:
+        history = DurationHistory(args.history)
+        if args.fuse_tests:
+            fuse_jobs(jobs, history, target=args.fuse_tests)
+        board = StatusBoard(jobs, path=args.status_file, interval=args.status_interval,
+                            history=history)
+        dispatcher = Dispatcher(jobs, threads=args.threads, fail_fast=args.fail_fast,
+                                journal=Journal(args.journal), resume=args.resume,
+                                listeners=[board], history=history,
+                                result_cache=_result_cache(args.result_cache))
+        with board:
+            statuses = dispatcher.run(more_jobs=more_jobs)
+        print(summarize(statuses))
+        first_trigger = metrics.registry.snapshot()['time_to_first_trigger_seconds']
+        if first_trigger is not None:
+            print("First job triggered {0:.1f}s after start".format(first_trigger))
+        hours_saved = dispatcher.runner_hours_saved()
+        if hours_saved:
+            print("Skipping and canceling jobs saved an estimated {0:.1f} runner-hours"
+                  .format(hours_saved))
+        return 1 if FAILED in statuses.values() else 0
+
+    if jobs is not None:
+        outputs = delayed_jobs(jobs, passthrough=args.visualize)
+    else:
+        outputs = get_dask_outputs(args.path, packages=args.packages,
+                                   filter_dirty=filter_dirty, git_rev=args.git_rev,
+                                   stop_rev=args.stop_rev, steps=args.steps,
+                                   max_downstream=args.max_downstream,
+                                   visualize=args.visualize, test=args.test,
+                                   processes=args.planning_processes,
+                                   semantic_changes=args.semantic_changes, impact=args.impact,
+                                   budget=args.budget, costs=_package_costs(args),
+                                   low_memory=args.low_memory,
+                                   condense_cycles=args.condense_cycles)
 
     if args.visualize:
         # setattr(nx.drawing, 'graphviz_layout', nx.nx_pydot.graphviz_layout)
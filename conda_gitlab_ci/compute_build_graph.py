@@ -1,16 +1,50 @@
 #!/usr/bin/env python
 from __future__ import print_function, division
 
+import fnmatch
+import hashlib
+import io
 import os
+import shutil
 import subprocess
+import tarfile
+import tempfile
 
 import networkx as nx
 from conda_build import api, conda_interface
 from conda_build.metadata import find_recipe
 
+from .build_matrix import set_conda_env_vars
+from .git_history import run_git
+from .recipe_index import recipe_index
+
 
 CONDA_BUILD_CACHE = os.environ.get("CONDA_BUILD_CACHE")
 
+try:
+    intern
+except NameError:  # pragma: no cover
+    from sys import intern
+
+# seconds a downstream package is expected to take when there is no history of it, or of
+#    anything else (see expand_run's budget)
+DEFAULT_COST = 600
+
+# requirement string -> (name, constraint), shared by every recipe that has the requirement
+_REQUIREMENTS = {}
+# (name, constraint) -> MatchSpec
+_MATCH_SPECS = {}
+
+# (recipe folder, platform, bits, matrix variables) -> (git tree hash, rendered metadata).  Only
+#    the rendering of the latest contents of each folder is kept, so a long-running process
+#    (see daemon) only renders recipes again as new commits change them.
+_RENDERED = {}
+
+# files in a recipe folder that say things about the package, but don't go into building it
+_DOCUMENTATION_FILES = ('readme*', 'changelog*', '*.md', '*.rst')
+# sections of rendered metadata that don't change what gets built
+_NON_BUILD_SECTIONS = ('about', 'extra')
+
 
 def _git_changed_files(git_rev, stop_rev=None, git_root=''):
     if not git_root:
@@ -38,7 +72,8 @@ def _get_base_folders(base_dir, changed_files):
     return recipe_dirs
 
 
-def git_changed_recipes(git_rev, stop_rev=None, git_root=''):
+def git_changed_recipes(git_rev, stop_rev=None, git_root='', semantic=False, platform=None,
+                        bits=None):
     """
     Get the list of files changed in a git revision and return a list of
     package directories that have been modified.
@@ -55,12 +90,112 @@ def git_changed_recipes(git_rev, stop_rev=None, git_root=''):
              git_rev=SOME_REV@{1} and stop_rev=SOME_REV   => only SOME_REV
              git_rev=SOME_REV@{2} and stop_rev=SOME_REV   => two commits, SOME_REV and the
                                                              one before it
+
+    semantic: only return recipes whose build inputs changed.  Changes to documentation
+              (READMEs and such) are ignored, and a recipe whose only other change is to
+              meta.yaml is rendered as of both revisions (for platform and bits): if nothing
+              but comments, formatting or the about/extra sections changed, it is not
+              returned.  Any other file in the folder (build scripts, patches, sources) counts
+              as a build input.
     """
     changed_files = _git_changed_files(git_rev, stop_rev=stop_rev, git_root=git_root)
     recipe_dirs = _get_base_folders(git_root, changed_files)
+    if semantic:
+        old_rev, new_rev = (git_rev, stop_rev) if stop_rev else (git_rev + '^', git_rev)
+        folder_files = {}
+        for f in changed_files:
+            folder_files.setdefault(f.split('/')[0], []).append(f)
+        recipe_dirs = _unique(recipe_dirs)
+        changes = {rd: _change_kind(rd, folder_files[rd]) for rd in recipe_dirs}
+        rendered_changes = _rendered_recipes_changed(
+            git_root or os.getcwd(), [rd for rd in recipe_dirs if changes[rd] == 'recipe'],
+            old_rev, new_rev, platform, bits)
+        recipe_dirs = [rd for rd in recipe_dirs
+                       if changes[rd] == 'build' or rd in rendered_changes]
     return recipe_dirs
 
 
+def _unique(items):
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+def _is_documentation(filename):
+    name = os.path.basename(filename).lower()
+    return any(fnmatch.fnmatch(name, pattern) for pattern in _DOCUMENTATION_FILES)
+
+
+def _extract_at_rev(git_root, rev, folders, destination):
+    """Extract folders as of a revision into destination, with one git call unless some of them
+    don't exist at that revision.  Returns the folders that were extracted."""
+    if not folders:
+        return set()
+    try:
+        data = run_git(['archive', '--format=tar', rev, '--'] + list(folders), git_root,
+                       decode=False)
+    except subprocess.CalledProcessError:
+        if len(folders) == 1:
+            return set()
+        # at least one of them is missing; find out which
+        return set().union(*[_extract_at_rev(git_root, rev, [folder], destination)
+                             for folder in folders])
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        tar.extractall(destination)
+    return set(folders)
+
+
+def _rendered_build_inputs(recipe_dir, platform, bits):
+    """The parts of a recipe's rendered metadata that affect its build"""
+    pkg, _, _ = api.render(recipe_dir, platform=platform, bits=bits)
+    return {section: value for section, value in pkg.meta.items()
+            if section not in _NON_BUILD_SECTIONS}
+
+
+def _change_kind(folder, files):
+    """What changed in a recipe folder: 'build' inputs other than the recipe, only the
+    'recipe' (meta.yaml), or only 'documentation'.  See git_changed_recipes."""
+    files = [f for f in files if not _is_documentation(f)]
+    if any(os.path.basename(f) != 'meta.yaml' for f in files):
+        return 'build'
+    if files:
+        return 'recipe'
+    print("{0}: only documentation changed; not building it".format(folder))
+    return 'documentation'
+
+
+def _rendered_recipes_changed(git_root, folders, old_rev, new_rev, platform=None, bits=None):
+    """The folders whose recipe renders differently at the two revisions.  Each revision is
+    extracted with one git call."""
+    if not folders:
+        return set()
+    changed = set()
+    workdir = tempfile.mkdtemp(prefix='cgci_')
+    try:
+        old_dir, new_dir = os.path.join(workdir, 'old'), os.path.join(workdir, 'new')
+        extracted = (_extract_at_rev(git_root, old_rev, folders, old_dir) &
+                     _extract_at_rev(git_root, new_rev, folders, new_dir))
+        for folder in folders:
+            if folder not in extracted:
+                # new or removed: nothing to compare with
+                changed.add(folder)
+                continue
+            try:
+                old, new = [_rendered_build_inputs(os.path.join(base, folder), platform, bits)
+                            for base in (old_dir, new_dir)]
+            except Exception as e:
+                # can't tell what changed; assume that something did
+                print("{0}: could not compare rendered recipes ({1})".format(folder, e))
+                changed.add(folder)
+                continue
+            if old == new:
+                print("{0}: rendered recipe is unchanged; not building it".format(folder))
+            else:
+                changed.add(folder)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return changed
+
+
 def describe_meta(meta):
     """Return a dictionary that describes build info of meta.yaml"""
 
@@ -78,15 +213,32 @@ def describe_meta(meta):
     return d
 
 
+def parse_requirement(requirement):
+    """Split a requirement string into its package name and constraint.
+
+    The constraint is everything after the name - version and, if given, build string - so
+    'numpy 1.11 py27_0' gives ('numpy', '1.11 py27_0').  Results are cached and their strings
+    interned, since the same few requirements appear in many recipes.
+    """
+    parsed = _REQUIREMENTS.get(requirement)
+    if parsed is None:
+        parts = requirement.split()
+        parsed = (intern(str(parts[0])), intern(str(" ".join(parts[1:]))))
+        _REQUIREMENTS[requirement] = parsed
+    return parsed
+
+
+def _match_spec(package, version=""):
+    """MatchSpec for a package and constraint, built once per unique pair"""
+    ms = _MATCH_SPECS.get((package, version))
+    if ms is None:
+        ms = conda_interface.MatchSpec(" ".join([package, version]).strip())
+        _MATCH_SPECS[(package, version)] = ms
+    return ms
+
+
 def _deps_to_version_dict(deps):
-    d = {}
-    for x in deps:
-        x = x.strip().split()
-        if len(x) == 2:
-            d[x[0]] = x[1]
-        else:
-            d[x[0]] = ''
-    return d
+    return dict(parse_requirement(x) for x in deps)
 
 
 def get_build_deps(meta):
@@ -106,48 +258,93 @@ def get_run_test_deps(meta):
     return _deps_to_version_dict(run_reqs + test_reqs)
 
 
+def _render(recipe_dir, platform, bits, key=None, variables=None):
+    """api.render, re-using the last rendering of the recipe when key, the git tree hash of its
+    folder, is unchanged.  Without a key, the recipe is always rendered.
+
+    variables: matrix variables to render with (see variant_requirements)
+    """
+    variables = variables or {}
+    cache_key = (recipe_dir, platform, bits,
+                 tuple(sorted((name, str(value)) for name, value in variables.items())))
+    cached = _RENDERED.get(cache_key)
+    if key is not None and cached is not None and cached[0] == key:
+        return cached[1]
+    if variables:
+        with set_conda_env_vars(variables):
+            pkg, _, _ = api.render(recipe_dir, platform=platform, bits=bits)
+    else:
+        pkg, _, _ = api.render(recipe_dir, platform=platform, bits=bits)
+    if key is not None:
+        _RENDERED[cache_key] = (key, pkg)
+    return pkg
+
+
+def forget_renderings(platform=None, bits=None):
+    """Drop the kept renderings of recipes for platform and bits, or of every recipe"""
+    for cache_key in list(_RENDERED):
+        if platform is None or cache_key[1:3] == (platform, bits):
+            del _RENDERED[cache_key]
+
+
+def variant_requirements(recipe_dir, platform, bits, variables, deps_type='build', key=None):
+    """Names of the packages a recipe requires when rendered with one configuration's matrix
+    variables (e.g. CONDA_PY).  Selectors and jinja in the recipe can make these differ from
+    the requirements construct_graph sees with the default variables.
+
+    key: the git tree hash of the recipe's folder, to re-use its earlier renderings with the
+         same variables (see _render)
+    """
+    pkg = _render(recipe_dir, platform, bits, key=key, variables=variables)
+    deps = get_build_deps(pkg) if deps_type == 'build' else get_run_test_deps(pkg)
+    return set(deps)
+
+
 def construct_graph(directory, platform, bits, folders=(), deps_type='build',
-                    git_rev=None, stop_rev=None):
+                    git_rev=None, stop_rev=None, semantic_changes=False):
     '''
     Construct a directed graph of dependencies from a directory of recipes
 
     deps_type: whether to use build or run/test requirements for the graph.  Avoids cycles.
           values: 'build' or 'test'.  Actually, only 'build' matters - otherwise, it's
                    run/test for any other value.
+    semantic_changes: when finding changed recipes from git, only count those whose build
+          inputs changed (see git_changed_recipes)
     '''
     g = nx.DiGraph()
     if not os.path.isabs(directory):
         directory = os.path.normpath(os.path.join(os.getcwd(), directory))
     assert os.path.isdir(directory)
 
-    # get all immediate subdirectories
-    other_top_dirs = [d for d in os.listdir(directory)
-                      if os.path.isdir(os.path.join(directory, d)) and
-                      not d.startswith('.')]
-    recipe_dirs = []
-    for recipe_dir in other_top_dirs:
-        try:
-            find_recipe(os.path.join(directory, recipe_dir))
-            recipe_dirs.append(recipe_dir)
-        except IOError:
-            pass
+    index = recipe_index(directory)
+    recipe_dirs = index.recipe_dirs()
+    # for looking up recipes by package name later, without bringing the index up to date
+    #    again (see _buildable)
+    g.graph['recipe_index'] = index
 
     if not folders:
         if not git_rev:
             git_rev = 'HEAD'
         folders = git_changed_recipes(git_rev, stop_rev=stop_rev,
-                                      git_root=directory)
+                                      git_root=directory, semantic=semantic_changes,
+                                      platform=platform, bits=bits)
+    else:
+        # folders given by package name, whose folder the index already knows
+        folders = _unique(list(folders) + [index.folder_of(name) for name in folders
+                                           if index.folder_of(name)])
 
     for rd in recipe_dirs:
         recipe_dir = os.path.join(directory, rd)
-        pkg, _, _ = api.render(recipe_dir, platform=platform, bits=bits)
+        pkg = _render(recipe_dir, platform, bits, key=index.key(rd))
         name = pkg.name()
+        index.record_name(rd, name)
 
         run_dict = {'build': False,  # will be built and tested
                     'test': False,  # must be installable; will be tested
                     'install': False,  # must be installable, but is not necessarily tested
                     }
-        if rd in folders:
+        # folders may also be given by package name
+        if rd in folders or name in folders:
             run_dict[deps_type] = True
         if not pkg.skip():
             # since we have no dependency ordering without a graph, it is conceivable that we add
@@ -157,10 +354,11 @@ def construct_graph(directory, platform, bits, folders=(), deps_type='build',
             #    dependency that can (presumably) be downloaded.
             if name not in g.nodes():
                 g.add_node(name, meta=describe_meta(pkg), recipe=recipe_dir,
-                        **run_dict)
+                        content_key=index.key(rd), **run_dict)
             else:
                 g.node[name]['meta'] = describe_meta(pkg)
                 g.node[name]['recipe'] = recipe_dir
+                g.node[name]['content_key'] = index.key(rd)
                 g.node[name].update(run_dict)
         deps = get_build_deps(pkg) if deps_type == 'build' else get_run_test_deps(pkg)
         for dep, version in deps.items():
@@ -172,36 +370,102 @@ def construct_graph(directory, platform, bits, folders=(), deps_type='build',
                                       'version': version})
             g.node[dep]['install'] = True
             g.add_edge(name, dep)
+    index.save()
     return g
 
 
-def _installable(package, version, conda_resolve):
-    """Can Conda install the package we need?"""
-    return conda_resolve.valid(conda_interface.MatchSpec(" ".join([package, version])),
-                               filter=conda_resolve.default_filter())
+def input_hashes(graph):
+    """package -> Merkle-style hash of everything that goes into a package: the contents of its
+    recipe (the git tree hash of its folder, see construct_graph) and the hashes of the
+    packages it depends on in the graph.  Packages without a recipe, which come from the
+    package index, count as their name and version constraint.
 
+    The hash is None for packages whose inputs can't be told apart this way: recipes with
+    uncommitted changes or outside of git, and everything that depends on them.
+
+    The packages of a dependency cycle all go into each other, so each of their hashes covers
+    the contents of every package in the cycle.
+    """
+    hashes = {}
+    components = nx.condensation(graph)
+    # dependencies first
+    for component in nx.topological_sort(components, reverse=True):
+        members = sorted(components.node[component]['members'])
+        contents = [_content(graph, node) for node in members]
+        dependencies = [hashes[dependency] for dependency in
+                        sorted(set(dependency for node in members
+                                   for dependency in graph.successors(node)) - set(members))]
+        for node, content in zip(members, contents):
+            if None in contents or None in dependencies:
+                hashes[node] = None
+                continue
+            if len(members) > 1:
+                content = "\n".join("{0} {1}".format(member, member_content)
+                                    for member, member_content in zip(members, contents))
+            hashes[node] = hashlib.sha1("\n".join([node, content] + dependencies)
+                                        .encode('utf-8')).hexdigest()
+    return hashes
+
+
+def _content(graph, node):
+    """What a package's recipe contains, for input_hashes"""
+    data = graph.node[node]
+    if data.get('recipe'):
+        return data.get('content_key')
+    return "{0} {1}".format(node, data.get('meta', {}).get('version', ""))
+
+
+def _installable(package, version, conda_resolve, filter=None):
+    """Can Conda install the package we need?
+
+    filter: conda_resolve.default_filter(), when checking many packages.  Building it walks the
+            whole index, and Resolve.valid also keeps its results in it, so checks that share
+            one filter are much cheaper.
+    """
+    if filter is None:
+        filter = conda_resolve.default_filter()
+    return conda_resolve.valid(_match_spec(package, version), filter=filter)
 
-def _buildable(package, version=""):
-    """Does the recipe that we have available produce the package we need?"""
+
+def _buildable(package, version="", recipe=None, index=None):
+    """Does the recipe that we have available produce the package we need?
+
+    recipe: the recipe folder for the package (see construct_graph).  Defaults to the folder
+            that makes the package in index, a recipe_index.RecipeIndex, if given, or else a
+            folder named after the package.
+    """
     available = False
-    if os.path.isdir(package):
-        metadata, _, _ = api.render(package)
+    if recipe is None and index is not None:
+        folder = index.folder_of(package)
+        if folder is None:
+            return False
+        recipe = os.path.join(index.directory, folder)
+    recipe = recipe or package
+    if os.path.isdir(recipe):
+        metadata, _, _ = api.render(recipe)
         match_dict = {'name': metadata.name(),
                       'version': metadata.version(),
                       'build': metadata.build_number(), }
-        ms = conda_interface.MatchSpec(" ".join([package, version]))
-        available = ms.match(match_dict)
+        available = _match_spec(package, version).match(match_dict)
     return available
 
 
 def upstream_dependencies_needing_build(graph, conda_resolve):
     dirty_nodes = [node for node, value in graph.node.items() if any([
         value.get('build'), value.get('install'), value.get('test')])]
+    # many nodes share dependencies: check each (package, version) against the index once,
+    #    all with one filter
+    filter = conda_resolve.default_filter()
+    installable = {}
     for node in dirty_nodes:
         for successor in graph.successors_iter(node):
             version = graph.node[successor].get('meta', {}).get('version', "")
-            if not _installable(successor, version, conda_resolve):
-                if _buildable(successor, version):
+            if (successor, version) not in installable:
+                installable[(successor, version)] = _installable(successor, version,
+                                                                 conda_resolve, filter=filter)
+            if not installable[(successor, version)]:
+                if _buildable(successor, version, recipe=graph.node[successor].get('recipe'),
+                              index=graph.graph.get('recipe_index')):
                     graph.node[successor]['build'] = True
                     dirty_nodes.append(successor)
                 else:
@@ -210,15 +474,108 @@ def upstream_dependencies_needing_build(graph, conda_resolve):
     return set(dirty_nodes)
 
 
-def expand_run(graph, conda_resolve, run, steps=0, max_downstream=5):
+def _affected(graph, dependent, package, run='build'):
+    """Would dependent get the version of package that its recipe makes?  Not if it pins
+    another version (e.g. an older one), so that a change to package can't affect it.
+    Dependencies without a recipe, and so without a version of their own, affect everything
+    that depends on them.
+
+    run: the run being planned.  Its pin is looked for in the build requirements for 'build',
+         and in the run and test requirements otherwise (as for construct_graph's deps_type).
+    """
+    meta = graph.node[package].get('meta', {})
+    if not graph.node[package].get('recipe') or not meta.get('version'):
+        return True
+    dependent_meta = graph.node[dependent].get('meta', {})
+    requirements = 'build_depends' if run == 'build' else 'run_test_depends'
+    constraint = dependent_meta.get(requirements, {}).get(package, "")
+    if not constraint:
+        return True
+    match_dict = {'name': package, 'version': str(meta['version']),
+                  'build': meta.get('build', 0)}
+    return _match_spec(package, constraint).match(match_dict)
+
+
+def _downstream(graph, nodes, steps=-1, impact=False, run='build'):
+    """Packages that depend on any of nodes, up to steps dependencies away (-1 for any
+    distance), and are not among nodes themselves.  With impact, the chain stops at packages
+    that a change can't affect in the given run (see _affected)."""
+    found = set()
+    frontier = set(nodes)
+    step = 0
+    while frontier and (steps < 0 or step < steps):
+        frontier = set(predecessor for node in frontier
+                       for predecessor in graph.predecessors(node)
+                       if predecessor not in found and predecessor not in nodes and
+                       not (impact and not _affected(graph, predecessor, node, run)))
+        found.update(frontier)
+        step += 1
+    return found
+
+
+def coverage(graph, package):
+    """How much of the graph building or testing package exercises: the package itself and
+    every package that depends on it, directly or not"""
+    return 1 + len(nx.ancestors(graph, package))
+
+
+def select_within_budget(graph, candidates, budget, costs=None, job_counts=None):
+    """The candidates to run within budget runner-minutes, best value for time first.
+
+    Candidates are ranked by coverage per expected second, where the expected seconds of a
+    package are its mean job duration in costs (package name -> seconds, see
+    history.DurationHistory.package_means) times how many jobs it runs (job_counts: package
+    name -> number of matrix configurations; 1 if not given).  Packages without history are
+    expected to take the mean of those with it.  Cheap, widely used packages go first; a
+    package that doesn't fit in what is left of the budget is passed over for cheaper ones
+    after it.
+    """
+    costs = costs or {}
+    job_counts = job_counts or {}
+    default = sum(costs.values()) / len(costs) if costs else DEFAULT_COST
+    expected = {package: max(costs.get(package, default), 1) * job_counts.get(package, 1)
+                for package in candidates}
+    ranked = sorted(candidates, key=lambda package: (-coverage(graph, package) /
+                                                     expected[package], package))
+    selected = []
+    remaining = budget * 60
+    for package in ranked:
+        if expected[package] <= remaining:
+            selected.append(package)
+            remaining -= expected[package]
+    return selected
+
+
+def expand_run(graph, conda_resolve, run, steps=0, max_downstream=5, impact=False,
+               budget=None, costs=None, job_count=None):
     """Apply the build label to any nodes that need (re)building.  "need rebuilding" means
     both packages that our target package depends on, but are not yet built, as well as
     packages that depend on our target package.  For the latter, you can specify how many
     dependencies deep (steps) to follow that chain, since it can be quite large.
 
     If steps is -1, all downstream dependencies are rebuilt or retested
+
+    impact: only follow the chain to packages whose requirement on a dirty package matches the
+            version that its recipe makes (see _affected), in the requirements of this run.
+            Packages that pin another version are left alone, and so are the packages beyond
+            them.
+    budget: runner-minutes to spend on downstream packages, instead of a max_downstream count.
+            Of the packages within steps, those with the most coverage for their historical
+            cost (costs: package name -> mean seconds) are picked until the budget is spent (see
+            select_within_budget).  The changed packages and the upstream packages they need
+            are always run, and don't count against it.
+    job_count: with budget, a function of a package name that gives how many jobs (matrix
+               configurations) the package runs, to charge its cost for each
     """
     upstream_dependencies_needing_build(graph, conda_resolve)
+    if budget is not None:
+        candidates = _downstream(graph, dirty(graph), steps=steps, impact=impact, run=run)
+        job_counts = ({package: job_count(package) for package in candidates}
+                      if job_count else None)
+        for package in select_within_budget(graph, candidates, budget, costs=costs,
+                                            job_counts=job_counts):
+            graph.node[package][run] = True
+        return dirty(graph)
     downstream = 0
 
     initial_dirty = len(dirty(graph))
@@ -226,6 +583,8 @@ def expand_run(graph, conda_resolve, run, steps=0, max_downstream=5):
     def expand_step(dirty_nodes, downstream):
         for node in dirty_nodes:
             for predecessor in graph.predecessors(node):
+                if impact and not _affected(graph, predecessor, node, run):
+                    continue
                 if max_downstream < 0 or (downstream - initial_dirty) < max_downstream:
                     graph.node[predecessor][run] = True
                     downstream += 1
@@ -258,7 +617,54 @@ def dirty(graph):
     return {n: v for n, v in graph.node.items() if v.get('build') or v.get('test')}
 
 
-def order_build(graph, packages=None, level=0, filter_dirty=True):
+def _cycle_order(graph, members):
+    """The members of a dependency cycle in the order to do them: those that require the fewest
+    of the others first"""
+    return sorted(members, key=lambda node: (len(set(graph.successors(node)) & set(members)),
+                                             node))
+
+
+def condensed_order(graph):
+    """A build order of graph, even if it has dependency cycles.  The packages of each cycle
+    (strongly connected component) are one unit in the order, and come one after the other.
+
+    Returns the order and a dictionary of each package in a cycle -> the packages of its cycle,
+    in the order they come.
+    """
+    components = nx.condensation(graph)
+    order = []
+    cycles = {}
+    for component in nx.topological_sort(components, reverse=True):
+        members = _cycle_order(graph, components.node[component]['members'])
+        if len(members) > 1:
+            print("Building dependency cycle together: {0}".format(", ".join(members)))
+            cycles.update((node, members) for node in members)
+        order.extend(members)
+    return order, cycles
+
+
+def acyclic_requirements(graph, node, requirements):
+    """A package's requirements, without the packages of its cycle (see condensed_order) that
+    come after it, and with the one right before it.  Jobs that follow these requirements do
+    a cycle's packages one at a time.  A requirement on a package of another cycle also
+    requires the last package of that cycle, so that the whole cycle is done first.
+
+    graph: a graph from order_build
+    """
+    cycles = graph.graph.get('cycles', {})
+    if not cycles:
+        return requirements
+    members = cycles.get(node, [])
+    if members:
+        position = members.index(node)
+        later = set(members[position:])
+        previous = members[max(position - 1, 0):position]
+        requirements = [n for n in requirements if n not in later] + previous
+    ends = [cycles[n][-1] for n in requirements if n in cycles and n not in members]
+    return _unique(list(requirements) + ends)
+
+
+def order_build(graph, packages=None, level=0, filter_dirty=True, condense_cycles=False):
     '''
     Assumes that packages are in graph.
     Builds a temporary graph of relevant nodes and returns it topological sort.
@@ -270,6 +676,10 @@ def order_build(graph, packages=None, level=0, filter_dirty=True):
        None: build the whole graph
        empty sequence: build nodes marked dirty
        non-empty sequence: build nodes in sequence
+
+    condense_cycles: order a graph with dependency cycles by its cycles (see condensed_order)
+                     instead of raising ValueError.  The returned graph's 'cycles' attribute
+                     says which packages are in which cycle (see acyclic_requirements).
     '''
 
     if not packages:
@@ -282,6 +692,12 @@ def order_build(graph, packages=None, level=0, filter_dirty=True):
     for n in tmp_global.nodes_iter():
         tmp_global.node[n] = graph.node[n]
 
+    if condense_cycles:
+        order, cycles = condensed_order(tmp_global)
+        # the subgraph shares graph's attributes
+        tmp_global.graph = dict(tmp_global.graph, cycles=cycles)
+        return tmp_global, order
+
     try:
         order = nx.topological_sort(tmp_global, reverse=True)
     except nx.exception.NetworkXUnfeasible:
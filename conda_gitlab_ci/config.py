@@ -0,0 +1,70 @@
+"""Load the YAML configuration of a recipe repository (versions.yml, platform files) once.
+
+Every platform and every recipe in a plan reads the same few files, so load_yaml keeps what it
+parsed for the life of the process.  A cached file is re-used while its mtime and size are
+unchanged; when they change, the contents are hashed, and only parsed again if they really
+differ.  Parsed data is frozen (FrozenDict, tuples), so it can be shared between threads, and
+pickled to worker processes, without anybody changing it under everybody else.
+"""
+from __future__ import print_function, division
+import hashlib
+import io
+import os
+import threading
+
+import yaml
+
+# libyaml's loader is many times faster than the pure python one, where it is available
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_lock = threading.Lock()
+# absolute path -> (mtime, size, sha256 of the contents, frozen data)
+_cache = {}
+
+
+class FrozenDict(dict):
+    """A dict that can't be changed after it is created"""
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("{0} is immutable".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.items())))
+
+    def __reduce__(self):
+        return type(self), (dict(self), )
+
+
+def freeze(data):
+    """Recursively turn dicts into FrozenDicts and lists into tuples"""
+    if isinstance(data, dict):
+        return FrozenDict((key, freeze(value)) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(value) for value in data)
+    return data
+
+
+def load_yaml(path):
+    """Parsed and frozen contents of a YAML file, cached until the file changes"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _lock:
+        cached = _cache.get(path)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[3]
+    with io.open(path, 'rb') as f:
+        contents = f.read()
+    digest = hashlib.sha256(contents).hexdigest()
+    if cached and cached[2] == digest:
+        data = cached[3]
+    else:
+        data = freeze(yaml.load(contents, Loader=Loader))
+    with _lock:
+        _cache[path] = (stat.st_mtime, stat.st_size, digest, data)
+    return data
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
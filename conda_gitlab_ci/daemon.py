@@ -0,0 +1,250 @@
+"""A long-running cgci that plans and dispatches on request, with its caches kept warm.
+
+Each cgci run pays again for python startup, finding recipes, rendering them, downloading
+package indexes and building Resolve objects.  The daemon pays once: the recipe index and
+rendered recipes (see recipe_index, compute_build_graph._render and
+build_matrix._filter_environment_with_metadata) are kept in memory and only brought up to date
+for recipes that new commits change, and the Resolve of each platform is kept for index_ttl
+seconds.  Indexes that are too old are loaded again before planning a request, outside the
+planning lock; requests planned meanwhile use the old ones.
+
+Requests come in over a small HTTP API, by default on localhost only:
+
+    POST /dispatches        plan and start dispatching.  The JSON body has any of git_rev,
+                            stop_rev, packages, all, steps, max_downstream, test,
+                            semantic_changes, impact, budget, condense_cycles, fuse_tests
+                            and fail_fast, as on the command line.
+                            Answers 202 with the dispatch's status, including its id.
+    GET /dispatches         status of every dispatch
+    GET /dispatches/<id>    status of one dispatch: its state (running, done or error), job
+                            statuses and how long planning took
+    GET /metrics            dispatch metrics in the Prometheus text format
+
+Dispatches run concurrently, each in its own thread.  Planning checks out the requested
+revision in the one working copy, so requests are planned one at a time.
+"""
+from __future__ import print_function, division
+import itertools
+import json
+import os
+import subprocess
+import threading
+import time
+
+from conda_build.conda_interface import Resolve, get_index
+from six.moves import BaseHTTPServer, socketserver
+
+from .execute import compute_job_graph
+from .fusion import fuse_jobs
+from .git_history import missing_revs
+from . import metrics
+from .routing import LabelRouter
+from .scheduler import Dispatcher, summarize
+
+# request field -> default.  Fields match the command line options of the same name.
+REQUEST_FIELDS = {'git_rev': 'HEAD', 'stop_rev': None, 'packages': [], 'all': False,
+                  'steps': 0, 'max_downstream': 5, 'test': False, 'semantic_changes': False,
+                  'impact': False, 'budget': None, 'condense_cycles': False, 'fuse_tests': None,
+                  'fail_fast': False}
+
+
+class PlanningService(object):
+    """Plans and dispatches job graphs for one repository of recipes.
+
+    index_ttl: seconds to keep package indexes before downloading them again
+    fetch: git remote to fetch from before planning each request, so that new commits can be
+           planned without anyone updating the working copy.  Requested revisions that name
+           a branch of the remote are then planned as the remote has it: fetching doesn't
+           move local branches.  None to not fetch.
+    Other keyword arguments (threads, history, backend...) go to each scheduler.Dispatcher.
+    """
+    def __init__(self, path, index_ttl=600, fetch=None, **dispatch_kwargs):
+        self.path = os.path.abspath(path)
+        self.index_ttl = index_ttl
+        self.fetch = fetch
+        # dispatches share runners, so they share what is known of their queues
+        dispatch_kwargs.setdefault('router', LabelRouter())
+        self.dispatch_kwargs = dispatch_kwargs
+        # platform-arch -> Resolve, shared by every request and loaded again once it is
+        #    index_ttl old
+        self.indexes = {}
+        # platform-arch -> when its Resolve was loaded
+        self._indexes_loaded = {}
+        self._refresh_lock = threading.Lock()
+        # planning checks out revisions of the one working copy
+        self._plan_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # dispatch id -> {'id', 'request', 'state', 'planning_seconds', 'dispatcher', 'error'}
+        self.dispatches = {}
+        self._ids = itertools.count(1)
+
+    def _refresh_indexes(self):
+        """Load again the package indexes that are index_ttl old.  The old Resolve is replaced
+        only once the new one is loaded, so this doesn't need the planning lock."""
+        if not self._refresh_lock.acquire(False):
+            # another request is loading them already
+            return
+        try:
+            for index_key, loaded in list(self._indexes_loaded.items()):
+                if time.time() - loaded > self.index_ttl:
+                    self.indexes[index_key] = Resolve(get_index(platform=index_key))
+                    self._indexes_loaded[index_key] = time.time()
+        finally:
+            self._refresh_lock.release()
+
+    def _remote_revs(self, *revs):
+        """revs, with those that name a branch of the fetch remote (e.g. master or master~2)
+        given as the remote's (origin/master).  HEAD stays the working copy's, and SHAs and
+        tags stay as they are."""
+        candidates = dict((rev, '{0}/{1}'.format(self.fetch, rev)) for rev in revs
+                          if rev and not rev.startswith('HEAD'))
+        missing = set(missing_revs(self.path, list(candidates.values()))) if candidates else ()
+        return [candidates[rev] if rev in candidates and candidates[rev] not in missing else rev
+                for rev in revs]
+
+    def plan(self, request):
+        """Plan a request (see REQUEST_FIELDS) and return its job graph"""
+        self._refresh_indexes()
+        with self._plan_lock:
+            history = self.dispatch_kwargs.get('history')
+            costs = history.package_means() if request['budget'] is not None and history else None
+            git_rev, stop_rev = request['git_rev'], request['stop_rev']
+            if self.fetch:
+                subprocess.check_call(['git', 'fetch', '--quiet', self.fetch], cwd=self.path)
+                git_rev, stop_rev = self._remote_revs(git_rev, stop_rev)
+            jobs = compute_job_graph(self.path, packages=request['packages'],
+                                     filter_dirty=any(request['packages']) or not request['all'],
+                                     git_rev=git_rev, stop_rev=stop_rev,
+                                     steps=request['steps'],
+                                     max_downstream=request['max_downstream'],
+                                     test=request['test'],
+                                     semantic_changes=request['semantic_changes'],
+                                     impact=request['impact'],
+                                     budget=request['budget'], costs=costs,
+                                     condense_cycles=request['condense_cycles'],
+                                     indexes=self.indexes)
+            for index_key in self.indexes:
+                self._indexes_loaded.setdefault(index_key, time.time())
+            return jobs
+
+    def dispatch(self, request):
+        """Plan a request and start dispatching it in the background.  Returns the dispatch's
+        status (see status)."""
+        unknown = set(request) - set(REQUEST_FIELDS)
+        if unknown:
+            raise ValueError("Unknown request fields: {0}".format(", ".join(sorted(unknown))))
+        request = dict(REQUEST_FIELDS, **request)
+        start = time.time()
+        jobs = self.plan(request)
+        if request['fuse_tests'] and self.dispatch_kwargs.get('history'):
+            fuse_jobs(jobs, self.dispatch_kwargs['history'], target=request['fuse_tests'])
+        dispatcher = Dispatcher(jobs, fail_fast=request['fail_fast'], **self.dispatch_kwargs)
+        with self._lock:
+            dispatch_id = str(next(self._ids))
+            self.dispatches[dispatch_id] = {'id': dispatch_id, 'request': request,
+                                            'state': 'running',
+                                            'planning_seconds': time.time() - start,
+                                            'dispatcher': dispatcher, 'error': None}
+        print("Dispatch {0}: planned {1} jobs in {2:.2f}s".format(
+            dispatch_id, len(jobs), self.dispatches[dispatch_id]['planning_seconds']))
+        thread = threading.Thread(target=self._run, args=(dispatch_id, ))
+        thread.daemon = True
+        thread.start()
+        return self.status(dispatch_id)
+
+    def _run(self, dispatch_id):
+        dispatch = self.dispatches[dispatch_id]
+        try:
+            statuses = dispatch['dispatcher'].run()
+        except Exception as e:
+            dispatch['error'] = str(e)
+            dispatch['state'] = 'error'
+        else:
+            dispatch['state'] = 'done'
+            print("Dispatch {0}: {1}".format(dispatch_id, summarize(statuses)))
+
+    def status(self, dispatch_id):
+        """The state of a dispatch and of its jobs, or None for an unknown id"""
+        with self._lock:
+            dispatch = self.dispatches.get(dispatch_id)
+        if dispatch is None:
+            return None
+        dispatcher = dispatch['dispatcher']
+        statuses = dict(dispatcher.statuses)
+        return {'id': dispatch_id, 'request': dispatch['request'], 'state': dispatch['state'],
+                'error': dispatch['error'], 'planning_seconds': dispatch['planning_seconds'],
+                'jobs': len(dispatcher.jobs), 'statuses': statuses,
+                'summary': summarize(statuses)}
+
+    def statuses(self):
+        with self._lock:
+            dispatch_ids = sorted(self.dispatches, key=int)
+        return [self.status(dispatch_id) for dispatch_id in dispatch_ids]
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def _reply(self, code, data, content_type='application/json'):
+        body = (json.dumps(data, sort_keys=True) if content_type == 'application/json'
+                else data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip('/').split('/')
+        if parts == ['metrics']:
+            self._reply(200, metrics.registry.prometheus(), content_type='text/plain')
+        elif parts == ['dispatches']:
+            self._reply(200, service.statuses())
+        elif len(parts) == 2 and parts[0] == 'dispatches' and service.status(parts[1]):
+            self._reply(200, service.status(parts[1]))
+        else:
+            self._reply(404, {'error': 'Not found: {0}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path.strip('/') != 'dispatches':
+            self._reply(404, {'error': 'Not found: {0}'.format(self.path)})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            if not isinstance(request, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+        try:
+            status = self.server.service.dispatch(request)
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+        else:
+            self._reply(202, status)
+
+
+class DaemonServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server for a PlanningService, answering each request in its own thread"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+        self.service = service
+
+
+def serve(path, host='127.0.0.1', port=8765, **kwargs):
+    """Run the daemon for the recipes at path until interrupted (see PlanningService)"""
+    server = DaemonServer((host, port), PlanningService(path, **kwargs))
+    print("cgci daemon for {0} listening on http://{1}:{2}".format(path, host,
+                                                                   server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
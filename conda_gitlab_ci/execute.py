@@ -1,108 +1,582 @@
 from __future__ import print_function, division
+from concurrent.futures import ProcessPoolExecutor
 import contextlib
+import hashlib
+import json
 import os
 import subprocess
-from time import sleep
+from time import sleep, time as now
 
 from conda_build.conda_interface import Resolve, get_index
 from dask import delayed
+import networkx as nx
 
-from .compute_build_graph import construct_graph, expand_run, order_build
-from .trigger_gitlab import submit_job, check_job_status
-from .build_matrix import load_platforms, expand_build_matrix
+from .compute_build_graph import (construct_graph, expand_run, order_build, variant_requirements,
+                                  input_hashes, forget_renderings, acyclic_requirements)
+from .git_history import ensure_history, resolve_rev
+from .trigger_gitlab import FINISHED, submit_job, check_job_status
+from .build_matrix import load_platforms, expand_build_matrix, worker_labels
+from . import metrics
+
+try:
+    intern
+except NameError:  # pragma: no cover
+    from sys import intern
+
+# variables in a configuration that do not come from the versions.yml matrix
+_NON_MATRIX_VARIABLES = ('BUILD_RECIPE', 'TARGET_PLATFORM', 'TEST_MODE')
 
 
 def _job(configuration, dependencies, commit_sha=None, passthrough=False,
-           sleep_interval=5, run_timeout=86400, **kwargs):
+           sleep_interval=5, run_timeout=86400, notify=None, build_id=None, ready_time=None,
+           backend=None, **kwargs):
+    """Submit one configuration and wait for it to finish.
+
+    notify: optional callable, called as notify(status, build_id) once the job is submitted
+            (with status 'submitted') and again each time its status changes.
+    build_id: when given, the configuration was already submitted as this build; wait on it
+              instead of submitting it again.
+    ready_time: when the job's dependencies finished, for the ready-to-trigger latency metric.
+    backend: where to submit the job (see backends); gitlab by default.
+    """
     if passthrough:
         return configuration
+    submit, check_status = ((backend.submit, backend.status) if backend
+                            else (submit_job, check_job_status))
+    label = metrics.job_label(configuration)
     # configuration is the dictionary defined in expand_build_matrix; includes the package to build
-    build_id = submit_job(configuration, commit_sha, **kwargs)
-    time = 0
+    if build_id is None:
+        build_id = submit(configuration, commit_sha, **kwargs)
+        metrics.registry.job_submitted(label, ready_time=ready_time)
+    if notify:
+        notify('submitted', build_id)
+    waited = 0
+    last_status = None
+    status_since = now()
     while True:
-        status = check_job_status(build_id, commit_sha=commit_sha, **kwargs)
-        if status in ('pending', 'running'):
+        status = check_status(build_id, commit_sha=commit_sha, **kwargs)
+        if status != last_status:
+            if last_status in ('pending', 'running'):
+                metrics.registry.job_state(label, last_status, now() - status_since)
+            status_since = now()
+            if notify:
+                notify(status, build_id)
+        last_status = status
+        if status not in FINISHED:
             sleep(sleep_interval)
-            if status == 'pending' or time < run_timeout:
-                time += sleep_interval
+            # only time spent running counts towards run_timeout; a job waits to run for as
+            #    long as it takes
+            if status != 'running':
                 continue
+            if waited < run_timeout:
+                waited += sleep_interval
+                continue
+            metrics.registry.job_finished(label, 'timeout')
             raise Exception("Job timed out", (configuration, commit_sha))
         if status == 'success':
+            metrics.registry.job_finished(label, status)
             break
         if status == 'failed':
+            metrics.registry.job_finished(label, status)
             raise Exception("Build failed", (configuration, commit_sha))
+        if status in ('canceled', 'skipped'):
+            metrics.registry.job_finished(label, status)
+            raise Exception("Build canceled", (configuration, commit_sha))
 
     return commit_sha
 
 
+def _index_key(platform):
+    """The platform-arch name of a platform's package index"""
+    return '-'.join([platform['platform'], str(platform['arch'])])
+
+
 def _platform_package_key(run, name, platform_dict):
     return "{run}_{node}_{label}".format(run=run, node=name,
-                                         label=platform_dict['worker_label'])
+                                         label=worker_labels(platform_dict)[0])
 
 
 @contextlib.contextmanager
-def checkout_git_rev(checkout_rev, path):
+def checkout_git_rev(checkout_rev, path, git_rev=None, stop_rev=None):
+    """Check out checkout_rev for the duration of the context, which gives the sha of the
+    commit it names.  A shallow or partial clone first fetches what it is missing to plan
+    git_rev (to stop_rev), or checkout_rev if not given (see git_history)."""
+    ensure_history(path, git_rev or checkout_rev, stop_rev)
+    # a revision like HEAD names another commit once there are new ones, so jobs and the
+    #    journal need the sha
+    commit_sha = resolve_rev(path, checkout_rev)
     git_current_rev = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
                                               cwd=path).rstrip()
     subprocess.check_call(['git', 'checkout', checkout_rev], cwd=path)
     try:
-        yield
+        yield commit_sha
     except:    # pragma: no cover
         raise  # pragma: no cover
     finally:
         subprocess.check_call(['git', 'checkout', git_current_rev], cwd=path)
 
 
-def get_dask_outputs(path, packages=(), filter_dirty=True, git_rev='HEAD', stop_rev=None, steps=0,
-                     visualize="", test=False, max_downstream=5, **kwargs):
-    checkout_rev = stop_rev or git_rev
-    results = {}
-    conda_build_test = '--{}test'.format("" if test else "no-")
+def _matrix_variables(configuration):
+    """The variables of a configuration that come from the versions.yml matrix"""
+    return {name: value for name, value in configuration['variables'].items()
+            if name not in _NON_MATRIX_VARIABLES}
+
+
+def _configuration_key(package_key, configuration):
+    """Extend a package key with the matrix variables of one configuration, so that every
+    configuration of a package gets its own job."""
+    variables = _matrix_variables(configuration)
+    variant = "_".join("{0}-{1}".format(name, variables[name]) for name in sorted(variables))
+    return "_".join([package_key, variant]) if variant else package_key
+
+
+def _input_hash(package_hash, run, worker_label, configuration, path=None):
+    """Hash of everything that goes into one job: its package's inputs (see
+    compute_build_graph.input_hashes), the run, the worker label and all of the configuration's
+    variables.  None if the package's inputs are unknown.
+
+    path: the repository root.  BUILD_RECIPE is hashed relative to it, so that clones in other
+          places give the same hashes.
+    """
+    if package_hash is None:
+        return None
+    variables = dict(configuration['variables'])
+    if path and os.path.isabs(str(variables.get('BUILD_RECIPE', ''))):
+        variables['BUILD_RECIPE'] = os.path.relpath(variables['BUILD_RECIPE'],
+                                                    os.path.abspath(path))
+    variables = sorted((name, str(value)) for name, value in variables.items())
+    return hashlib.sha1(json.dumps([package_hash, run, str(worker_label), variables])
+                        .encode('utf-8')).hexdigest()
+
+
+def _matching_jobs(candidates, variables):
+    """Keys of the candidate jobs, given as (key, matrix variables), whose variables agree with
+    these on every variable both have.  A py27 job depends on the py27 build of its dependency,
+    not the py35 one.  If no candidate agrees, all of them are returned, since the dependency
+    still has to be done first.
+    """
+    matching = [key for key, candidate_variables in candidates
+                if all(str(value) == str(variables[name])
+                       for name, value in candidate_variables.items() if name in variables)]
+    return matching or [key for key, _ in candidates]
+
+
+def _plan_platform(path, run, platform, packages=(), filter_dirty=True, git_rev='HEAD',
+                   stop_rev=None, steps=0, max_downstream=5, conda_build_test='--no-test',
+                   indexes=None, semantic_changes=False, impact=False, budget=None,
+                   costs=None, condense_cycles=False):
+    """Plan the jobs of one run on one platform.
 
+    This is the expensive part of planning: rendering recipes, loading the package index and
+    expanding the build matrix.  It only returns compact job descriptions, so that it can run
+    in a worker process and let go of the graph and index when it finishes.  Dependencies of
+    each job are given as package keys (see _platform_package_key); _merge_plans narrows them
+    to the configurations of each dependency that share the job's matrix variables.  A package
+    that versions.yml's rules leave configurations out of also gets an entry that is not a job,
+    with only its package_key and the number left out (matrix_eliminated).
+
+    Recipes are rendered again for each configuration with matrix variables, so that a
+    dependency that only some variants have (e.g. through a # [py27] selector) only holds up
+    those variants.  This only narrows the dependencies that the graph has from the default
+    rendering: a package that no default rendering requires is not planned for the variants
+    that do.  If the repository has a recipe for it, that is printed.
+
+    indexes: optional dictionary of platform-arch -> Resolve, to share indexes across calls
+    budget, costs: runner-minutes for this unit's downstream packages, and mean seconds by
+                   package (see compute_build_graph.expand_run)
+    condense_cycles: plan the packages of each dependency cycle one after the other, instead of
+                     failing (see compute_build_graph.order_build)
+    """
+    if indexes is None:
+        indexes = {}
+    index_key = _index_key(platform)
+    if index_key not in indexes:
+        indexes[index_key] = Resolve(get_index(platform=index_key))
+    g = construct_graph(path, platform=platform['platform'], bits=platform['arch'],
+                        folders=packages, git_rev=git_rev, stop_rev=stop_rev,
+                        deps_type=run, semantic_changes=semantic_changes)
+    labels = worker_labels(platform)
+    # note that the graph is changed in place here.  A package's cost counts once for each of
+    #    its configurations on this platform; each platform spends its own share of the budget.
+    expand_run(g, conda_resolve=indexes[index_key], run=run, steps=steps,
+               max_downstream=max_downstream, impact=impact, budget=budget, costs=costs,
+               job_count=lambda package: len(expand_build_matrix(
+                   package, path, label=labels[0], key=g.node[package].get('content_key'))))
+    # sort build order, and also filter so that we have solely dirty nodes in subgraph
+    subgraph, order = order_build(g, filter_dirty=filter_dirty, condense_cycles=condense_cycles)
+    package_hashes = input_hashes(g)
+
+    plan = []
+    for node in order:
+        package_key = _platform_package_key(run, node, platform)
+        recipe = subgraph.node[node].get('recipe')
+        counts = {}
+        configurations = expand_build_matrix(node, path, label=labels[0], counts=counts,
+                                             key=subgraph.node[node].get('content_key'))
+        eliminated = counts.get('excluded', 0)
+        if eliminated:
+            # not a job: the configurations of this package that versions.yml's rules left
+            #    out, counted even when none are left
+            plan.append({'package_key': package_key, 'matrix_eliminated': eliminated})
+        for configuration in configurations:
+            configuration['variables']['TEST_MODE'] = conda_build_test
+            requirements = subgraph[node].keys()
+            variables = _matrix_variables(configuration)
+            if recipe and variables:
+                requirements = variant_requirements(
+                    recipe, platform['platform'], platform['arch'], variables, deps_type=run,
+                    key=subgraph.node[node].get('content_key'))
+                _report_unplanned(g, node, requirements, variables)
+            requirements = acyclic_requirements(subgraph, node, requirements)
+            dependencies = [_platform_package_key(run, n, platform)
+                            for n in requirements if n in subgraph and n != node]
+            if run != 'build':
+                # make the test run depend on the build run's completion
+                dependencies.append(_platform_package_key("build", node, platform))
+            plan.append({'key': _configuration_key(package_key, configuration),
+                         'package_key': package_key,
+                         'configuration': configuration,
+                         'dependencies': dependencies,
+                         'run': run,
+                         'package': node,
+                         'worker_label': labels[0],
+                         'worker_labels': labels,
+                         'input_hash': _input_hash(package_hashes.get(node), run, labels[0],
+                                                   configuration, path)})
+    return plan
+
+
+def _report_unplanned(graph, node, requirements, variables):
+    """Print the requirements of a variant that the repository has recipes for, but that are
+    not in the graph, and so are not planned (see _plan_platform)"""
+    index = graph.graph.get('recipe_index')
+    unplanned = sorted(n for n in requirements
+                       if n not in graph and index is not None and index.folder_of(n))
+    if unplanned:
+        print("{0}: {1} only needed with {2}; not planned, but recipes for them are here".format(
+            node, ", ".join(unplanned),
+            ", ".join("{0}={1}".format(name, value) for name, value in sorted(variables.items()))))
+
+
+def _plan_platform_star(args):
+    path, run, platform, kwargs = args
+    return _plan_platform(path, run, platform, **kwargs)
+
+
+def planning_units(path, test=False):
+    """Return the (run, platform) pairs to plan, build runs before the test runs that depend on
+    them.  The order is stable, so that separate processes or hosts agree on it."""
     runs = ['test']
     # not testing means build and test
     if not test:
         runs.insert(0, 'build')
+    # loop over platforms here because each platform may have different dependencies
+    # each platform will be submitted with a different label
+    return [(run, platform) for run in runs
+            for platform in load_platforms(os.path.join(path, '{}_platforms.d'.format(run)))]
+
+
+def _plan_kwargs(packages=(), filter_dirty=True, git_rev='HEAD', stop_rev=None, steps=0,
+                 test=False, max_downstream=5, semantic_changes=False, impact=False,
+                 budget=None, costs=None, condense_cycles=False, n_units=1):
+    """Keyword arguments for _plan_platform.  A budget is shared evenly by the n_units units
+    being planned, since each is planned on its own."""
+    return dict(packages=packages, filter_dirty=filter_dirty, git_rev=git_rev,
+                stop_rev=stop_rev, steps=steps, max_downstream=max_downstream,
+                semantic_changes=semantic_changes, impact=impact,
+                budget=budget / max(n_units, 1) if budget is not None else None, costs=costs,
+                condense_cycles=condense_cycles,
+                conda_build_test='--{}test'.format("" if test else "no-"))
+
+
+def _plans(units, processes=1, indexes=None, low_memory=False):
+    """Plan each unit, yielding the plans in the order of units as soon as each is done
+
+    low_memory: let go of each platform's index and rendered recipes once the last unit on
+                that platform is planned.  Indexes passed in are the caller's, and are kept.
+    """
+    owned = indexes is None
+    if indexes is None:
+        indexes = {}
+    if processes > 1 and len(units) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(units))) as pool:
+            for plan in pool.map(_plan_platform_star, units):
+                yield plan
+    else:
+        last_unit = {_index_key(platform): position
+                     for position, (_, _, platform, _) in enumerate(units)} if low_memory else {}
+        for position, (path, run, platform, kwargs) in enumerate(units):
+            plan = _plan_platform(path, run, platform, indexes=indexes, **kwargs)
+            if low_memory and last_unit[_index_key(platform)] == position:
+                forget_renderings(platform['platform'], platform['arch'])
+                if owned:
+                    indexes.pop(_index_key(platform), None)
+            yield plan
+
+
+def _low_memory_order(units):
+    """Positions of units, with the units of each platform together, in the order platforms
+    first appear.  Planned in this order, only one platform's index is needed at a time."""
+    first = {}
+    for position, (_, _, platform, _) in enumerate(units):
+        first.setdefault(_index_key(platform), position)
+    return sorted(range(len(units)),
+                  key=lambda position: first[_index_key(units[position][2])])
 
-    output = []
-    indexes = {}
-    with checkout_git_rev(checkout_rev, path):
-        for run in runs:
-            platform_folder = '{}_platforms.d'.format(run)
-            # loop over platforms here because each platform may have different dependencies
-            # each platform will be submitted with a different label
-            for platform in load_platforms(os.path.join(path, platform_folder)):
-                index_key = '-'.join([platform['platform'], str(platform['arch'])])
-                if index_key not in indexes:
-                    indexes[index_key] = Resolve(get_index(platform=index_key))
-                g = construct_graph(path, platform=platform['platform'], bits=platform['arch'],
-                                    folders=packages, git_rev=git_rev, stop_rev=stop_rev,
-                                    deps_type=run)
-                # note that the graph is changed in place here.
-                expand_run(g, conda_resolve=indexes[index_key], run=run, steps=steps,
-                           max_downstream=max_downstream)
-                # sort build order, and also filter so that we have solely dirty nodes in subgraph
-                subgraph, order = order_build(g, filter_dirty=filter_dirty)
-
-                for node in order:
-                    for configuration in expand_build_matrix(node, path,
-                                                            label=platform['worker_label']):
-                        configuration['variables']['TEST_MODE'] = conda_build_test
-                        commit_sha = stop_rev or git_rev
-                        dependencies = [results[_platform_package_key(run, n, platform)]
-                                            for n in subgraph[node].keys() if n in subgraph]
-                        key_name = _platform_package_key(run, node, platform)
-                        # make the test run depend on the build run's completion
-                        build_key_name = _platform_package_key("build", node, platform)
-                        if build_key_name in results:
-                            dependencies.append(results[build_key_name])
-
-                        results[key_name] = delayed(_job, pure=True)(configuration=configuration,
-                                                                     dependencies=dependencies,
-                                                                     commit_sha=commit_sha,
-                                                                     dask_key_name=key_name,
-                                                                     passthrough=visualize,
-                                                                     **kwargs)
-
-                    output.append(results[key_name])
-    return output
+
+def compute_job_graph(path, packages=(), filter_dirty=True, git_rev='HEAD', stop_rev=None,
+                      steps=0, test=False, max_downstream=5, processes=1,
+                      semantic_changes=False, impact=False, budget=None, costs=None,
+                      indexes=None, low_memory=False, condense_cycles=False):
+    """Plan every job for the given revision(s) as a directed graph of configurations.
+
+    Nodes are keyed by job name and carry the configuration to submit, the commit sha to build
+    it against, the run, package and worker label it came from and its input hash (see
+    result_cache).  Edges point from a job to the jobs it depends on, the same direction as
+    the package graph.
+
+    processes: number of worker processes to plan platforms in.  Each run on each platform is
+               planned in its own process, and only the resulting jobs come back.  1 plans
+               everything in this process.
+    budget: runner-minutes to spend on downstream packages, shared by every run and platform.
+            Packages are picked by coverage for their cost in costs (package name -> mean
+            seconds; see compute_build_graph.expand_run) instead of by max_downstream.
+    indexes: optional dictionary of platform-arch -> Resolve to plan with, and to add the
+             indexes it loads to.  Only used when planning in this process.
+    condense_cycles: plan the packages of each dependency cycle one after the other, so that
+                     the rest of the graph can still be planned (see
+                     compute_build_graph.order_build)
+    low_memory: plan one platform at a time, and let go of its index and rendered recipes
+                before planning the next, so that only the compact job descriptions of the
+                platforms already planned are kept.  Recipes are rendered again by later
+                plans instead of being re-used.
+    """
+    graph = None
+    for graph in stream_job_graph(path, packages=packages, filter_dirty=filter_dirty,
+                                  git_rev=git_rev, stop_rev=stop_rev, steps=steps, test=test,
+                                  max_downstream=max_downstream, processes=processes,
+                                  semantic_changes=semantic_changes, impact=impact,
+                                  budget=budget, costs=costs, indexes=indexes,
+                                  low_memory=low_memory, condense_cycles=condense_cycles,
+                                  partial=False):
+        pass
+    return graph
+
+
+def stream_job_graph(path, packages=(), filter_dirty=True, git_rev='HEAD', stop_rev=None,
+                     steps=0, test=False, max_downstream=5, processes=1,
+                     semantic_changes=False, impact=False, budget=None, costs=None,
+                     indexes=None, low_memory=False, condense_cycles=False, partial=True):
+    """Plan the job graph one (run, platform) unit at a time, yielding the graph of every unit
+    planned so far after each one (see compute_job_graph).
+
+    Build units are planned before test units, so the jobs that others depend on come first.
+    Each graph holds the one before it, so a dispatcher can start on the jobs of the first units
+    while the rest are planned (see scheduler.Dispatcher.run).
+
+    partial: yield the graph after each unit.  If False, only the complete graph is yielded.
+    low_memory: see compute_job_graph.  Units are then planned out of order, platform by
+                platform, so only the complete graph is yielded: a partial graph could have
+                test jobs without the build jobs they wait on.
+    """
+    with checkout_git_rev(stop_rev or git_rev, path, git_rev=git_rev,
+                          stop_rev=stop_rev) as commit_sha:
+        run_platforms = planning_units(path, test=test)
+        plan_kwargs = _plan_kwargs(packages=packages, filter_dirty=filter_dirty,
+                                   git_rev=git_rev, stop_rev=stop_rev, steps=steps, test=test,
+                                   max_downstream=max_downstream,
+                                   semantic_changes=semantic_changes, impact=impact,
+                                   budget=budget, costs=costs,
+                                   condense_cycles=condense_cycles, n_units=len(run_platforms))
+        units = [(path, run, platform, plan_kwargs) for run, platform in run_platforms]
+        order = _low_memory_order(units) if low_memory else list(range(len(units)))
+        plans = [None] * len(units)
+        planned = _plans([units[position] for position in order], processes=processes,
+                         indexes=indexes, low_memory=low_memory)
+        for done, plan in enumerate(planned, 1):
+            plans[order[done - 1]] = plan
+            if partial and not low_memory and done < len(units):
+                yield jobs_from_plans(plans[:done], commit_sha, report=False)
+    yield jobs_from_plans(plans, commit_sha)
+
+
+def jobs_from_plans(plans, commit_sha, report=True):
+    """Build the job graph from per-platform plans, given in the order of planning_units, and
+    coalesce redundant jobs.
+
+    report: print how many redundant jobs were coalesced
+    """
+    jobs, duplicates = _merge_plans(plans, commit_sha)
+    if not nx.is_directed_acyclic_graph(jobs):
+        raise ValueError("Cycles detected in job graph: {0}".format(nx.find_cycle(jobs)))
+    coalesced = coalesce_jobs(jobs)
+    if report and (duplicates or coalesced):
+        print("Coalesced {0} redundant job triggers ({1} duplicated across platforms, "
+              "{2} already covered by another job)".format(duplicates + coalesced, duplicates,
+                                                          coalesced))
+    jobs.graph['coalesced'] = duplicates + coalesced
+    return jobs
+
+
+def _shared(value):
+    """value, or the one copy of it shared by every job if it is a string.  Plans that come
+    from other processes or hosts repeat the same names and versions in every job."""
+    if isinstance(value, (str, type(u""))):
+        try:
+            return intern(str(value))
+        except UnicodeEncodeError:  # pragma: no cover
+            return value
+    return value
+
+
+def _compact_configuration(configuration):
+    """configuration, changed in place to share the strings of its variables"""
+    configuration['variables'] = {_shared(name): _shared(value) for name, value
+                                  in configuration['variables'].items()}
+    return configuration
+
+
+def _merge_plans(plans, commit_sha):
+    """Combine per-platform plans into one job graph.
+
+    Each job depends on the configurations of its dependency packages that share its matrix
+    variables (see _matching_jobs).  Platforms sharing a worker label produce jobs with the
+    same keys; these are only added once, depending on what any of them depends on.  Returns
+    the graph and how many such duplicates there were.  The graph's 'eliminated' attribute is
+    how many configurations versions.yml's rules left out of the planned jobs.  Strings the
+    jobs repeat are only kept once.
+    """
+    jobs = nx.DiGraph()
+    # package key -> (key, matrix variables) of the jobs for each of that package's
+    #    configurations
+    package_jobs = {}
+    added = []
+    # key -> package keys the jobs of that key depend on, across every plan that has it
+    dependencies = {}
+    duplicates = 0
+    eliminated = 0
+    # package keys whose left-out configurations are counted.  Platforms sharing a worker label
+    #    leave out the same ones.
+    counted = set()
+    for plan in plans:
+        for job in plan:
+            if 'matrix_eliminated' in job and job['package_key'] not in counted:
+                counted.add(job['package_key'])
+                eliminated += job['matrix_eliminated']
+            if 'key' not in job:
+                # only a count of left-out configurations (see _plan_platform)
+                continue
+            key_name = job['key']
+            if key_name in jobs:
+                duplicates += 1
+                dependencies[key_name].extend(dependency for dependency in job['dependencies']
+                                              if dependency not in dependencies[key_name])
+                continue
+            labels = job.get('worker_labels', [job['worker_label']])
+            jobs.add_node(key_name, configuration=_compact_configuration(job['configuration']),
+                          commit_sha=commit_sha, run=_shared(job['run']),
+                          package=_shared(job['package']),
+                          worker_label=_shared(job['worker_label']),
+                          worker_labels=[_shared(label) for label in labels],
+                          input_hash=job.get('input_hash'))
+            package_jobs.setdefault(job['package_key'], []).append(
+                (key_name, _matrix_variables(job['configuration'])))
+            added.append(job)
+            dependencies[key_name] = list(job['dependencies'])
+    jobs.graph['eliminated'] = eliminated
+    # every job is known now, so a job can depend on one that was planned after it
+    for job in added:
+        variables = _matrix_variables(job['configuration'])
+        for dependency in dependencies[job['key']]:
+            for dependency_key in _matching_jobs(package_jobs.get(dependency, ()), variables):
+                jobs.add_edge(job['key'], dependency_key)
+    return jobs, duplicates
+
+
+def _coalesce_key(data):
+    variables = data['configuration']['variables']
+    return (tuple(sorted((name, str(value)) for name, value in variables.items()
+                         if name != 'TEST_MODE')),
+            str(data['worker_label']), data['commit_sha'])
+
+
+def coalesce_jobs(jobs):
+    """Remove jobs whose work another job already does, and return how many were removed.
+
+    Two jobs are the same work when they have the same variables, worker label and commit.
+    If they differ in TEST_MODE, the one that does not test is only covered by the one that
+    does.  Jobs that depended on a removed job depend on the job that covers it instead, and
+    that job also waits for what the removed job depended on, unless that would make a cycle.
+    """
+    survivors = {}
+    removed = 0
+    # build runs first, so that test runs are the ones found redundant
+    for key in sorted(jobs.nodes(), key=lambda k: (jobs.node[k]['run'] != 'build', k)):
+        data = jobs.node[key]
+        coalesce_key = _coalesce_key(data)
+        survivor = survivors.get(coalesce_key)
+        if survivor is None:
+            survivors[coalesce_key] = key
+            continue
+        test_mode = data['configuration']['variables'].get('TEST_MODE')
+        survivor_test_mode = jobs.node[survivor]['configuration']['variables'].get('TEST_MODE')
+        if test_mode != survivor_test_mode and survivor_test_mode != '--test':
+            continue
+        dependents = jobs.predecessors(key)
+        # redirecting a dependent onto a job that depends on it would make a cycle
+        if any(nx.has_path(jobs, survivor, dependent) for dependent in dependents):
+            continue
+        for dependent in dependents:
+            jobs.add_edge(dependent, survivor)
+        for dependency in jobs.successors(key):
+            if dependency != survivor and not nx.has_path(jobs, dependency, survivor):
+                jobs.add_edge(survivor, dependency)
+        jobs.remove_node(key)
+        removed += 1
+    return removed
+
+
+def summarize_plan(jobs):
+    """A few lines on what a job graph holds: jobs per run and per worker label, and how many
+    were saved by versions.yml's rules and by coalescing"""
+    runs, labels = {}, {}
+    for key in jobs.nodes():
+        data = jobs.node[key]
+        runs[data['run']] = runs.get(data['run'], 0) + 1
+        labels[str(data['worker_label'])] = labels.get(str(data['worker_label']), 0) + 1
+    return "\n".join([
+        "{0} jobs".format(len(jobs)),
+        "  by run: " + ", ".join("{0} {1}".format(runs[run], run) for run in sorted(runs)),
+        "  by worker label: " + ", ".join("{0} {1}".format(labels[label], label)
+                                          for label in sorted(labels)),
+        "{0} configurations left out by versions.yml rules, {1} redundant jobs coalesced"
+        .format(jobs.graph.get('eliminated', 0), jobs.graph.get('coalesced', 0))])
+
+
+def delayed_jobs(jobs, passthrough=False, **kwargs):
+    """Turn a job graph from compute_job_graph into dask delayed objects, one per job"""
+    results = {}
+    order = nx.topological_sort(jobs, reverse=True)
+    for key_name in order:
+        data = jobs.node[key_name]
+        dependencies = [results[n] for n in jobs.successors(key_name)]
+        results[key_name] = delayed(_job, pure=True)(configuration=data['configuration'],
+                                                     dependencies=dependencies,
+                                                     commit_sha=data['commit_sha'],
+                                                     dask_key_name=key_name,
+                                                     passthrough=passthrough,
+                                                     **kwargs)
+    return [results[key_name] for key_name in order]
+
+
+def get_dask_outputs(path, packages=(), filter_dirty=True, git_rev='HEAD', stop_rev=None, steps=0,
+                     visualize="", test=False, max_downstream=5, processes=1,
+                     semantic_changes=False, impact=False, budget=None, costs=None,
+                     low_memory=False, condense_cycles=False, **kwargs):
+    jobs = compute_job_graph(path, packages=packages, filter_dirty=filter_dirty, git_rev=git_rev,
+                             stop_rev=stop_rev, steps=steps, test=test,
+                             max_downstream=max_downstream, processes=processes,
+                             semantic_changes=semantic_changes, impact=impact, budget=budget,
+                             costs=costs, low_memory=low_memory,
+                             condense_cycles=condense_cycles)
+    return delayed_jobs(jobs, passthrough=visualize, **kwargs)
@@ -0,0 +1,154 @@
+"""Run several cheap test configurations in one CI job, instead of one job each.
+
+Many test configurations finish in well under a minute, so as separate jobs most of their time
+goes to runner spin-up.  fuse_jobs bin-packs the cheap ones - test jobs that nothing else
+waits on, whose historical duration (see history.DurationHistory) is known and short - into
+shared jobs of about a target length per worker label.  A fused job carries the variables of
+each of its configurations in the CGCI_FUSED trigger variable.  On the runner,
+
+    python -m conda_gitlab_ci.fusion
+
+runs the configurations one after another and prints a result line for each.  When a fused job
+fails, the dispatcher reads those lines back from the job's trace, so results are still
+reported per configuration (see scheduler.Dispatcher).
+"""
+from __future__ import print_function, division
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+from .pipeline import BUILD_SCRIPT, _variable_value
+
+# the trigger variable that carries the configurations of a fused job
+FUSED_VARIABLE = 'CGCI_FUSED'
+# the variable naming each configuration's job in FUSED_VARIABLE
+JOB_VARIABLE = 'CGCI_JOB'
+# fused jobs print one "CGCI_RESULT <job key> <status>" line per configuration
+_RESULT = re.compile(r'^CGCI_RESULT (\S+) (success|failed)\s*$', re.MULTILINE)
+
+
+def fused_key(keys):
+    """The job key of a fused job, the same for the same configurations, so that the journal
+    can resume it"""
+    digest = hashlib.sha1("\n".join(sorted(keys)).encode('utf-8')).hexdigest()
+    return 'fused_{0}'.format(digest[:12])
+
+
+def _fusible(jobs, key, history, target):
+    """The expected seconds of a job that may be fused, or None if it may not"""
+    data = jobs.node[key]
+    if data['run'] != 'test' or data.get('fused') or jobs.predecessors(key):
+        return None
+    estimate = history.estimate(key, data.get('package'))
+    if estimate is None or estimate >= target:
+        return None
+    return estimate
+
+
+def _pack(candidates, target):
+    """First-fit decreasing: lists of keys whose estimates add up to no more than target"""
+    bins = []
+    for estimate, key in sorted(candidates, key=lambda candidate: (-candidate[0],
+                                                                   candidate[1])):
+        for remaining_keys in bins:
+            if estimate <= remaining_keys[0]:
+                remaining_keys[0] -= estimate
+                remaining_keys[1].append(key)
+                break
+        else:
+            bins.append([target - estimate, [key]])
+    return [keys for _, keys in bins]
+
+
+def _fuse(jobs, keys):
+    """Replace the jobs with keys by one job that runs all of their configurations"""
+    members = []
+    dependencies = set()
+    input_hashes = []
+    for key in sorted(keys):
+        data = jobs.node[key]
+        members.append({'key': key, 'package': data.get('package'),
+                        'configuration': data['configuration'],
+                        'input_hash': data.get('input_hash')})
+        input_hashes.append(data.get('input_hash'))
+        dependencies.update(jobs.successors(key))
+    first = jobs.node[members[0]['key']]
+    configurations = [dict(member['configuration']['variables'], **{JOB_VARIABLE: member['key']})
+                      for member in members]
+    variables = {FUSED_VARIABLE: json.dumps(configurations, sort_keys=True)}
+    if 'TARGET_PLATFORM' in first['configuration']['variables']:
+        variables['TARGET_PLATFORM'] = first['configuration']['variables']['TARGET_PLATFORM']
+    input_hash = None
+    if all(input_hashes):
+        input_hash = hashlib.sha1("\n".join(input_hashes).encode('utf-8')).hexdigest()
+    key = fused_key(keys)
+    jobs.add_node(key, configuration={'variables': variables}, commit_sha=first['commit_sha'],
+                  run='test', package=None, worker_label=first['worker_label'],
+                  worker_labels=first.get('worker_labels'),
+                  input_hash=input_hash, fused=members)
+    for dependency in dependencies:
+        jobs.add_edge(key, dependency)
+    jobs.remove_nodes_from(keys)
+    return key
+
+
+def fuse_jobs(jobs, history, target=600):
+    """Fuse cheap test jobs into shared jobs of about target seconds, in place, and return how
+    many jobs were fused.
+
+    Only test jobs that no other job depends on are fused, so a fused job can't hold up anything,
+    nor make a cycle.  Each is packed with others for the same worker label and commit.  Jobs
+    without history are left alone, since there is no telling whether they are cheap.
+    """
+    groups = {}
+    for key in sorted(jobs.nodes()):
+        estimate = _fusible(jobs, key, history, target)
+        if estimate is not None:
+            data = jobs.node[key]
+            groups.setdefault((str(data['worker_label']), data['commit_sha']), []).append(
+                (estimate, key))
+    fused = 0
+    for group in sorted(groups):
+        for keys in _pack(groups[group], target):
+            if len(keys) > 1:
+                _fuse(jobs, keys)
+                fused += len(keys)
+    if fused:
+        print("Fused {0} short test jobs into shared jobs of up to {1:.0f}s".format(fused,
+                                                                                  target))
+    return fused
+
+
+def parse_results(trace):
+    """Job key -> 'success' or 'failed' for each configuration a fused job's trace reports"""
+    return {key: status for key, status in _RESULT.findall(trace or "")}
+
+
+def run_fused(configurations=None, script=BUILD_SCRIPT, environ=None):
+    """Run each configuration of a fused job in turn, printing a result line for each.
+    Returns 0 if all of them succeeded, otherwise 1.
+
+    configurations: the list of variables of each configuration; by default read from the
+                    CGCI_FUSED environment variable.
+    """
+    environ = dict(os.environ if environ is None else environ)
+    if configurations is None:
+        configurations = json.loads(environ.get(FUSED_VARIABLE) or '[]')
+    failed = 0
+    for variables in configurations:
+        env = dict(environ)
+        env.update({str(name): _variable_value(value) for name, value in variables.items()})
+        print("Running {0}".format(variables.get(JOB_VARIABLE)))
+        sys.stdout.flush()
+        status = 'success' if subprocess.call(script, shell=True, env=env) == 0 else 'failed'
+        failed += status == 'failed'
+        print("CGCI_RESULT {0} {1}".format(variables.get(JOB_VARIABLE), status))
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(run_fused())
@@ -0,0 +1,106 @@
+"""Make sure a clone has the history a plan needs, without cloning all of it.
+
+CI runners often have shallow (`git clone --depth N`) or partial (`--filter=blob:none`) clones
+of the recipe repository, since full clones of a long history are slow.  Planning needs little
+of that history: the commits that git_rev and stop_rev name, and for a single revision its
+parent, to diff against.  ensure_history checks for all of them with one git call and, only
+if some are missing, fetches them: commits given by sha are fetched directly, and a shallow
+clone is deepened, a step at a time, until every revision resolves.  Fetches from a partial
+clone stay partial.
+"""
+from __future__ import print_function, division
+import os
+import re
+import subprocess
+
+# first --deepen step for shallow clones; each further step doubles it
+DEEPEN_STEP = 50
+# deepening past this many commits fetches the whole history instead
+MAX_DEEPEN = 6400
+
+_SHA = re.compile(r'^[0-9a-f]{40}$')
+
+
+def run_git(args, cwd, input=None, decode=True):
+    """Output of a git command, with its errors hidden.  input, if given, is written to
+    git's stdin.  decode=False returns the output as bytes."""
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(['git'] + args, cwd=cwd, stdout=subprocess.PIPE,
+                                   stderr=devnull,
+                                   stdin=subprocess.PIPE if input is not None else None)
+        output, _ = process.communicate(input.encode('utf-8') if input is not None else None)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, ['git'] + args)
+    return output.decode() if decode else output
+
+
+def required_revs(git_rev, stop_rev=None):
+    """The revisions that planning git_rev (to stop_rev) reads: both ends of a range, or a
+    revision and its parent (see compute_build_graph.git_changed_recipes)"""
+    return [git_rev, stop_rev] if stop_rev else [git_rev, git_rev + '^']
+
+
+def resolve_rev(path, rev):
+    """The sha of the commit that rev names in the clone at path"""
+    return run_git(['rev-parse', '--verify', '-q', rev + '^{commit}'], path).strip()
+
+
+def missing_revs(path, revs):
+    """The revisions that don't resolve to a commit in the clone, checked in one git call"""
+    output = run_git(['cat-file', '--batch-check'], path,
+                     input="".join("{0}^{{commit}}\n".format(rev) for rev in revs))
+    # found commits are listed as "<sha> commit <size>", anything else as "<rev> missing"
+    return [rev for rev, line in zip(revs, output.splitlines())
+            if line.split()[1:2] != ['commit']]
+
+
+def clone_state(path):
+    """(shallow, partial) for the clone at path"""
+    git_dir = os.path.join(path, run_git(['rev-parse', '--git-dir'], path).strip())
+    shallow = os.path.isfile(os.path.join(git_dir, 'shallow'))
+    try:
+        partial = bool(run_git(['config', '--get-regexp',
+                                r'^(extensions\.partialclone|remote\..*\.promisor)$'],
+                               path).strip())
+    except subprocess.CalledProcessError:
+        # no such settings
+        partial = False
+    return shallow, partial
+
+
+def ensure_history(path, git_rev, stop_rev=None, remote='origin'):
+    """Fetch whatever the clone at path is missing to plan git_rev (to stop_rev).
+
+    Raises ValueError if a revision still can't be found.
+    """
+    revs = required_revs(git_rev, stop_rev)
+    missing = missing_revs(path, revs)
+    if not missing:
+        return
+    shallow, partial = clone_state(path)
+    fetch = ['fetch', '--quiet'] + (['--filter=blob:none'] if partial else [])
+    shas = [rev for rev in missing if _SHA.match(rev)]
+    if shas:
+        print("Fetching {0} from {1}".format(", ".join(shas), remote))
+        try:
+            run_git(fetch + [remote] + shas, path)
+        except subprocess.CalledProcessError:
+            # the server may not serve commits by sha; deepening may still find them
+            pass
+        missing = missing_revs(path, revs)
+    depth = DEEPEN_STEP
+    while missing and shallow:
+        if depth > MAX_DEEPEN:
+            print("Fetching the whole history from {0}".format(remote))
+            run_git(fetch + ['--unshallow', remote], path)
+        else:
+            print("Deepening shallow clone by {0} commits".format(depth))
+            run_git(fetch + ['--deepen={0}'.format(depth), remote], path)
+            depth *= 2
+        missing = missing_revs(path, revs)
+        shallow = clone_state(path)[0]
+    # with the whole history here, a missing parent means git_rev is the first commit, which
+    #    has nothing to diff against
+    missing = [rev for rev in missing if rev in (git_rev, stop_rev)]
+    if missing:
+        raise ValueError("Revisions not found in {0}: {1}".format(path, ", ".join(missing)))
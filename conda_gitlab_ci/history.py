@@ -0,0 +1,69 @@
+"""How long jobs have taken in the past, for estimates of how long they will take.
+
+Durations are kept per job key (run, package, worker label and matrix variables) and per
+package, as a running mean, in a small JSON file that is rewritten after each dispatch.
+"""
+from __future__ import print_function, division
+import io
+import json
+import os
+import threading
+
+from .metrics import atomic_write
+
+
+class DurationHistory(object):
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        # job key -> [count, mean seconds]
+        self.jobs = {}
+        # package name -> [count, mean seconds]
+        self.packages = {}
+        if path and os.path.isfile(path):
+            with io.open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.jobs = data.get('jobs', {})
+            self.packages = data.get('packages', {})
+
+    def record(self, key, package, seconds):
+        with self._lock:
+            for table, name in ((self.jobs, key), (self.packages, package)):
+                count, mean = table.get(name, (0, 0.0))
+                table[name] = [count + 1, mean + (seconds - mean) / (count + 1)]
+
+    def job(self, key, default=None):
+        """Mean duration of this job in seconds, or default if it has never run"""
+        return self.jobs.get(key, (0, default))[1]
+
+    def package(self, package, default=None):
+        """Mean duration of any job of this package in seconds, or default if none has run"""
+        return self.packages.get(package, (0, default))[1]
+
+    def package_means(self):
+        """Mean duration in seconds of each package that has run, by package name"""
+        with self._lock:
+            return {package: mean for package, (count, mean) in self.packages.items()}
+
+    def estimate(self, key, package, default=None):
+        """Best guess of a job's duration: its own history, else its package's, else default"""
+        estimate = self.job(key)
+        if estimate is None:
+            estimate = self.package(package, default)
+        return estimate
+
+    def mean(self, default=None):
+        """Mean duration over all jobs that have run"""
+        with self._lock:
+            counts = [(count, mean) for count, mean in self.jobs.values()]
+        total = sum(count for count, _ in counts)
+        if not total:
+            return default
+        return sum(count * mean for count, mean in counts) / total
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            text = json.dumps({'jobs': self.jobs, 'packages': self.packages}, sort_keys=True)
+        atomic_write(self.path, text)
@@ -0,0 +1,58 @@
+"""Append-only record of what the dispatcher has submitted, so that a dispatch can be resumed.
+
+Each line of the journal is a JSON object with the job key, the commit sha it was built
+against, its gitlab build id and its status.  Lines are appended while dispatching, and the
+last line for a job wins when the journal is read back.  Once a dispatch is done, the journal
+is pruned down to the latest line of each of its jobs (see prune), so it does not grow with
+every dispatch.
+"""
+from __future__ import print_function, division
+import io
+import json
+import os
+import threading
+
+from .metrics import atomic_write
+
+# statuses that mean a build is still going on gitlab, and can be reattached to
+IN_FLIGHT = ('submitted', 'pending', 'running')
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, key, commit_sha, build_id, status):
+        line = json.dumps({'key': key, 'commit_sha': commit_sha, 'build_id': build_id,
+                           'status': status}, sort_keys=True)
+        with self._lock:
+            with io.open(self.path, 'a', encoding='utf-8') as f:
+                f.write(u"{0}\n".format(line))
+                f.flush()
+                # the point of the journal is to survive the process dying
+                os.fsync(f.fileno())
+
+    def load(self):
+        """Return a dictionary of (key, commit_sha) -> latest entry for that job"""
+        entries = {}
+        if not os.path.isfile(self.path):
+            return entries
+        with io.open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a partial line, written as the process died
+                    continue
+                entries[(entry['key'], entry['commit_sha'])] = entry
+        return entries
+
+    def prune(self, commit_shas):
+        """Keep only the latest entry of each job built against one of commit_shas"""
+        with self._lock:
+            entries = self.load()
+            lines = [json.dumps(entry, sort_keys=True) for (_, commit_sha), entry
+                     in sorted(entries.items()) if commit_sha in commit_shas]
+            if os.path.isfile(self.path):
+                atomic_write(self.path, "".join("{0}\n".format(line) for line in lines))
@@ -0,0 +1,194 @@
+"""Dispatch metrics: job throughput, queue latency and gitlab API errors.
+
+_job, submit_job and check_job_status feed the module-level `registry`.  MetricsWriter
+periodically writes it to a file, either as a JSON snapshot or, for files ending in .prom, in
+the Prometheus text format (e.g. for node_exporter's textfile collector).
+"""
+from __future__ import print_function, division
+import io
+import json
+import os
+import threading
+import time
+
+
+def job_label(configuration):
+    """The worker label a configuration is submitted to"""
+    if not isinstance(configuration, dict):
+        return ''
+    label = configuration.get('variables', {}).get('TARGET_PLATFORM', '')
+    if isinstance(label, (list, tuple)):
+        label = label[0] if label else ''
+    return str(label)
+
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            # worker label -> number of jobs submitted
+            self.submitted = {}
+            # when the first job was submitted
+            self.first_submitted = None
+            # (worker label, final status) -> number of jobs
+            self.finished = {}
+            # [count, total seconds] from dependencies being done to the job being triggered
+            self.ready_to_trigger = [0, 0.0]
+            # (worker label, state) -> [count, total seconds] spent pending or running
+            self.state_seconds = {}
+            # endpoint -> [requests, errors]
+            self.api = {}
+
+    def job_submitted(self, label, ready_time=None):
+        now = time.time()
+        with self._lock:
+            self.submitted[label] = self.submitted.get(label, 0) + 1
+            if self.first_submitted is None:
+                self.first_submitted = now
+            if ready_time is not None:
+                self.ready_to_trigger[0] += 1
+                self.ready_to_trigger[1] += max(now - ready_time, 0.0)
+
+    def job_state(self, label, state, seconds):
+        """Record that a job spent this long in a state (pending, running)"""
+        with self._lock:
+            totals = self.state_seconds.setdefault((label, state), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def job_finished(self, label, status):
+        with self._lock:
+            self.finished[(label, status)] = self.finished.get((label, status), 0) + 1
+
+    def api_call(self, endpoint, ok=True):
+        with self._lock:
+            counts = self.api.setdefault(endpoint, [0, 0])
+            counts[0] += 1
+            if not ok:
+                counts[1] += 1
+
+    def snapshot(self):
+        """Return the current metrics as a JSON-compatible dictionary"""
+        with self._lock:
+            now = time.time()
+            uptime = now - self.start_time
+            submitted = sum(self.submitted.values())
+            count, total = self.ready_to_trigger
+            first = self.first_submitted
+            return {
+                'time': now,
+                'uptime_seconds': uptime,
+                'jobs_submitted': submitted,
+                'jobs_submitted_per_second': submitted / uptime if uptime else 0.0,
+                'jobs_submitted_by_label': dict(self.submitted),
+                # from the start of the dispatch (including planning) to the first submission
+                'time_to_first_trigger_seconds': (first - self.start_time
+                                                  if first is not None else None),
+                'jobs_finished': [{'worker_label': label, 'status': status, 'count': n}
+                                  for (label, status), n in sorted(self.finished.items())],
+                'ready_to_trigger_seconds': {'count': count, 'sum': total,
+                                             'mean': total / count if count else None},
+                'state_seconds': [{'worker_label': label, 'state': state, 'count': n,
+                                   'sum': seconds, 'mean': seconds / n}
+                                  for (label, state), (n, seconds)
+                                  in sorted(self.state_seconds.items())],
+                'api': {endpoint: {'requests': requests, 'errors': errors,
+                                   'error_rate': errors / requests}
+                        for endpoint, (requests, errors) in self.api.items()},
+            }
+
+    def prometheus(self):
+        """Return the current metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def sample(name, labels, value):
+            label_text = ",".join('{0}="{1}"'.format(k, v) for k, v in sorted(labels.items()))
+            lines.append("cgci_{0}{1} {2}".format(name, "{" + label_text + "}"
+                                                  if label_text else "", value))
+
+        def counter(name, samples):
+            lines.append("# TYPE cgci_{0} counter".format(name))
+            for labels, value in samples:
+                sample(name, labels, value)
+
+        def summary(name, samples):
+            lines.append("# TYPE cgci_{0} summary".format(name))
+            for labels, count, total in samples:
+                sample(name + '_sum', labels, total)
+                sample(name + '_count', labels, count)
+
+        counter('jobs_submitted_total',
+                [({'worker_label': label}, n)
+                 for label, n in sorted(snapshot['jobs_submitted_by_label'].items())])
+        counter('jobs_finished_total',
+                [({'worker_label': x['worker_label'], 'status': x['status']}, x['count'])
+                 for x in snapshot['jobs_finished']])
+        if snapshot['time_to_first_trigger_seconds'] is not None:
+            lines.append("# TYPE cgci_time_to_first_trigger_seconds gauge")
+            sample('time_to_first_trigger_seconds', {},
+                   snapshot['time_to_first_trigger_seconds'])
+        ready = snapshot['ready_to_trigger_seconds']
+        summary('ready_to_trigger_seconds', [({}, ready['count'], ready['sum'])])
+        summary('job_state_seconds',
+                [({'worker_label': x['worker_label'], 'state': x['state']}, x['count'], x['sum'])
+                 for x in snapshot['state_seconds']])
+        counter('api_requests_total',
+                [({'endpoint': endpoint}, x['requests'])
+                 for endpoint, x in sorted(snapshot['api'].items())])
+        counter('api_errors_total',
+                [({'endpoint': endpoint}, x['errors'])
+                 for endpoint, x in sorted(snapshot['api'].items())])
+        return "\n".join(lines) + "\n"
+
+
+registry = Metrics()
+
+
+def atomic_write(path, text):
+    """Replace the contents of path, without readers ever seeing a partial file"""
+    # several processes (see recipe_index), or threads (see daemon), may write the same file
+    tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+    with io.open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(u"{0}".format(text))
+    try:
+        os.replace(tmp_path, path)
+    except AttributeError:  # pragma: no cover
+        # python 2 has no os.replace; rename only replaces existing files on posix
+        os.rename(tmp_path, path)
+
+
+class MetricsWriter(object):
+    """Write a metrics registry to a file every interval seconds, in a background thread"""
+    def __init__(self, path, interval=10, metrics=registry):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def write(self):
+        if self.path.endswith('.prom'):
+            text = self.metrics.prometheus()
+        else:
+            text = json.dumps(self.metrics.snapshot(), sort_keys=True)
+        atomic_write(self.path, text)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        # final numbers
+        self.write()
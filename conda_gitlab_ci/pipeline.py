@@ -0,0 +1,105 @@
+"""Submit a whole job graph as one gitlab pipeline, instead of one trigger per configuration.
+
+The job graph is written out as a pipeline definition with a CI job per configuration: the
+job's variables are the configuration's, it runs on runners tagged with its worker label and
+it `needs` the jobs it depends on.  The definition is sent, compressed, in one trigger; the
+triggered pipeline unpacks it and runs it as a child pipeline (see the README), so gitlab does
+the scheduling and cgci only polls the one pipeline it triggered.
+"""
+from __future__ import print_function, division
+import base64
+import io
+import time
+import zlib
+
+import networkx as nx
+import yaml
+
+from .trigger_gitlab import FINISHED, submit_pipeline, check_pipeline_status
+
+# what the build_recipe job in the README runs for each configuration
+BUILD_SCRIPT = "conda build --token $ANACONDA_TOKEN $TEST_MODE $BUILD_RECIPE -c conda_gitlab"
+# gitlab refuses jobs that need more jobs than this; those rely on stage order alone
+MAX_NEEDS = 50
+# the trigger variable that carries the compressed pipeline definition
+PIPELINE_VARIABLE = 'CGCI_PIPELINE'
+
+
+def _variable_value(value):
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else ""
+    return "" if value is None else str(value)
+
+
+def child_pipeline(jobs, script=BUILD_SCRIPT):
+    """Return a gitlab pipeline definition (as a dictionary) with one job per node of a job
+    graph from execute.compute_job_graph.
+
+    Jobs are put in stages by their depth in the graph, so that the pipeline runs in order even
+    where `needs` can't be used, and `needs` lets each job start as soon as its own
+    dependencies are done.
+    """
+    depths = {}
+    pipeline = {}
+    for key in nx.topological_sort(jobs, reverse=True):
+        dependencies = sorted(jobs.successors(key))
+        depths[key] = 1 + max([depths[dependency] for dependency in dependencies] or [-1])
+        data = jobs.node[key]
+        job = {'stage': 'level-{0}'.format(depths[key]),
+               'script': [script],
+               'variables': {name: _variable_value(value)
+                             for name, value in data['configuration']['variables'].items()}}
+        if data.get('worker_label'):
+            job['tags'] = [str(data['worker_label'])]
+        if dependencies and len(dependencies) <= MAX_NEEDS:
+            job['needs'] = dependencies
+        pipeline[key] = job
+    pipeline['stages'] = ['level-{0}'.format(depth)
+                          for depth in range(max(depths.values() or [-1]) + 1)]
+    return pipeline
+
+
+def pipeline_yaml(jobs, script=BUILD_SCRIPT):
+    return yaml.safe_dump(child_pipeline(jobs, script=script), default_flow_style=False)
+
+
+def encode_pipeline(text):
+    """Compress a pipeline definition to fit in a trigger variable.  Decode it in the
+    triggered pipeline with `echo "$CGCI_PIPELINE" | base64 -d | zcat`"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format
+    data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_pipeline(value):
+    return zlib.decompress(base64.b64decode(value), 16 + zlib.MAX_WBITS).decode('utf-8')
+
+
+def dispatch_pipeline(jobs, path=None, sleep_interval=5, **kwargs):
+    """Trigger one pipeline that runs every job in the graph, and wait for it to finish.
+
+    path: optional file to also write the generated pipeline definition to.
+
+    Returns the final status of the pipeline.
+    """
+    if not len(jobs):
+        print("No jobs to run")
+        return 'success'
+    # every job in a graph is for the same commit
+    commit_sha = jobs.node[jobs.nodes()[0]]['commit_sha']
+    text = pipeline_yaml(jobs)
+    if path:
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(u"{0}".format(text))
+    pipeline_id = submit_pipeline({PIPELINE_VARIABLE: encode_pipeline(text)}, commit_sha,
+                                  **kwargs)
+    print("Triggered pipeline {0} with {1} jobs".format(pipeline_id, len(jobs)))
+    last_status = None
+    while True:
+        status = check_pipeline_status(pipeline_id, **kwargs)
+        if status != last_status:
+            print("Pipeline {0}: {1}".format(pipeline_id, status))
+            last_status = status
+        if status in FINISHED:
+            return status
+        time.sleep(sleep_interval)
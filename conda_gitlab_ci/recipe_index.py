@@ -0,0 +1,175 @@
+"""A persistent index of the recipes in a repository.
+
+For each top-level folder, the index keeps the folder's git tree hash, the recipe file in it
+(if any) and the name of the package it makes, once that is known.  Updating it takes a few git
+calls, not a walk of the tree: folders whose tree hash is unchanged are not looked at again, so
+only new and changed folders are searched for recipes.  Folders that differ from HEAD in the
+working copy are always looked at again.
+
+The index lives in the repository's git directory, so it never shows up as a change.  Outside
+of git, every folder is looked at each time and nothing is saved.
+"""
+from __future__ import print_function, division
+import hashlib
+import io
+import json
+import os
+import subprocess
+
+from conda_build.metadata import find_recipe
+
+from .git_history import run_git
+from .metrics import atomic_write
+
+# bump when the layout of the index file changes, to start over from an empty index
+INDEX_FORMAT = 1
+
+# directory -> RecipeIndex, so that planning several platforms in one process shares one
+_indexes = {}
+
+
+def _git_info(directory):
+    """Return the git directory and this directory's path within the repository, or None
+    outside of git"""
+    try:
+        git_dir, prefix = (run_git(['rev-parse', '--git-dir', '--show-prefix'], directory)
+                           .splitlines() + [''])[:2]
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return os.path.join(directory, git_dir), prefix
+
+
+def _status_folders(directory, prefix):
+    """Top-level folders with changes in the working copy that aren't in HEAD"""
+    folders = set()
+    status = run_git(['status', '--porcelain', '--untracked-files=all', '--', '.'], directory)
+    for line in status.splitlines():
+        for path in line[3:].split(' -> '):
+            path = path.strip('"')
+            if path.startswith(prefix) and '/' in path[len(prefix):]:
+                folders.add(path[len(prefix):].split('/')[0])
+    return folders
+
+
+def folder_keys(directory):
+    """folder -> git tree hash of each top-level folder of directory.
+
+    The hash is None for folders with uncommitted changes, and for every folder outside of git,
+    since there is nothing to tell whether they changed.
+    """
+    info = _git_info(directory)
+    try:
+        tree = run_git(['ls-tree', 'HEAD'], directory) if info else None
+    except subprocess.CalledProcessError:
+        # no commits yet
+        tree = None
+    if tree is None:
+        return {d: None for d in os.listdir(directory)
+                if os.path.isdir(os.path.join(directory, d)) and not d.startswith('.')}
+    keys = {}
+    for line in tree.splitlines():
+        meta, folder = line.split('\t', 1)
+        _, object_type, sha = meta.split()
+        # commits are submodules
+        if object_type in ('tree', 'commit') and not folder.startswith('.'):
+            keys[folder] = sha
+    for folder in _status_folders(directory, info[1]):
+        if not folder.startswith('.'):
+            keys[folder] = None
+    return {folder: key for folder, key in keys.items()
+            if os.path.isdir(os.path.join(directory, folder))}
+
+
+class RecipeIndex(object):
+    """folder -> recipe file, git tree hash and package name, for one repository of recipes.
+
+    path: file to keep the index in between runs.  By default, a file in the git directory
+          named after the repository directory; outside of git, the index is not kept.
+    """
+    def __init__(self, directory, path=None):
+        self.directory = os.path.abspath(directory)
+        if path is None:
+            info = _git_info(self.directory)
+            if info:
+                digest = hashlib.sha1(self.directory.encode('utf-8')).hexdigest()[:12]
+                path = os.path.join(info[0], 'cgci_recipe_index_{0}.json'.format(digest))
+        self.path = path
+        # folder -> {'key': tree hash, 'recipe': recipe file relative to directory or None,
+        #            'name': package name or None}
+        self.folders = {}
+        # package name -> folder, built from folders when first needed after they change
+        self._by_name = None
+        self._changed = False
+        if path and os.path.isfile(path):
+            with io.open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == INDEX_FORMAT:
+                self.folders = data['folders']
+
+    def update(self):
+        """Bring the index up to date with the directory, and save it if anything changed"""
+        keys = folder_keys(self.directory)
+        for folder in set(self.folders) - set(keys):
+            self._forget(folder)
+        for folder, key in keys.items():
+            entry = self.folders.get(folder)
+            if entry is not None and key is not None and entry['key'] == key:
+                continue
+            self._forget(folder)
+            try:
+                recipe = os.path.relpath(find_recipe(os.path.join(self.directory, folder)),
+                                         self.directory)
+            except IOError:
+                recipe = None
+            self.folders[folder] = {'key': key, 'recipe': recipe, 'name': None}
+            self._by_name = None
+            self._changed = True
+        self.save()
+        return self
+
+    def _forget(self, folder):
+        if self.folders.pop(folder, None) is not None:
+            self._by_name = None
+            self._changed = True
+
+    def recipe_dirs(self):
+        """Folders that hold a recipe"""
+        return sorted(folder for folder, entry in self.folders.items() if entry['recipe'])
+
+    def key(self, folder):
+        """The git tree hash of a folder, or None if its contents can't be told apart that way"""
+        return self.folders.get(folder, {}).get('key')
+
+    def folder_of(self, name):
+        """The folder whose recipe makes the package name, as last recorded (see record_name),
+        or None.  Looking it up this way renders nothing.  Where several folders make the
+        package, the first of them is given."""
+        if self._by_name is None:
+            self._by_name = {}
+            for folder, entry in sorted(self.folders.items(), reverse=True):
+                if entry['recipe'] and entry['name']:
+                    self._by_name[entry['name']] = folder
+        return self._by_name.get(name)
+
+    def record_name(self, folder, name):
+        """Remember the name of the package that a folder's recipe makes"""
+        entry = self.folders.get(folder)
+        if entry is not None and entry['name'] != name:
+            entry['name'] = name
+            self._by_name = None
+            self._changed = True
+
+    def save(self):
+        if not (self.path and self._changed):
+            return
+        atomic_write(self.path, json.dumps({'format': INDEX_FORMAT, 'folders': self.folders},
+                                           sort_keys=True))
+        self._changed = False
+
+
+def recipe_index(directory):
+    """The up-to-date recipe index of a directory, shared within this process"""
+    directory = os.path.abspath(directory)
+    if directory not in _indexes:
+        _indexes[directory] = RecipeIndex(directory)
+    return _indexes[directory].update()
@@ -0,0 +1,59 @@
+"""Which job inputs have already been built and tested successfully, across commits.
+
+Each job gets an input hash (see compute_build_graph.input_hashes and
+execute._plan_platform): a Merkle-style hash over its recipe's contents, the hashes of
+everything it depends on in the package graph, and its configuration.  When a job with the
+same input hash has already succeeded - in an earlier dispatch, for another commit - there is
+nothing new for it to find, so the dispatcher does not submit it again.
+
+The cache is a small JSON file of input hash -> the job that succeeded with it, rewritten after
+each dispatch.
+"""
+from __future__ import print_function, division
+import io
+import json
+import os
+import threading
+import time
+
+from .metrics import atomic_write
+
+
+class ResultCache(object):
+    """Input hashes of jobs that succeeded.
+
+    max_entries: how many hashes to keep.  The oldest are dropped first.
+    """
+    def __init__(self, path=None, max_entries=20000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # input hash -> {'key': job key, 'commit_sha': first commit it succeeded for,
+        #                'time': when it last succeeded or was found here}
+        self.results = {}
+        if path and os.path.isfile(path):
+            with io.open(path, encoding='utf-8') as f:
+                self.results = json.load(f).get('results', {})
+
+    def __contains__(self, input_hash):
+        return input_hash is not None and input_hash in self.results
+
+    def get(self, input_hash):
+        return self.results.get(input_hash)
+
+    def record(self, input_hash, key, commit_sha):
+        if input_hash is None:
+            return
+        with self._lock:
+            entry = self.results.setdefault(input_hash, {'key': key, 'commit_sha': commit_sha})
+            entry['time'] = time.time()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            newest = sorted(self.results.items(), key=lambda item: item[1]['time'],
+                            reverse=True)[:self.max_entries]
+            self.results = dict(newest)
+            text = json.dumps({'results': self.results}, sort_keys=True)
+        atomic_write(self.path, text)
@@ -0,0 +1,60 @@
+"""Route jobs among interchangeable worker labels by how busy each one's queue is.
+
+A platform can list several worker labels whose runners can all do its jobs (see
+build_matrix.worker_labels).  Rather than always using the first, the dispatcher asks a
+LabelRouter for the label each job should go to when it submits the job.  The router only
+knows what the dispatcher sees of its own jobs through check_job_status: how many of them are
+still pending on each label, and how long jobs have recently pended there before a runner
+picked them up.  It picks the label with the least expected wait, its pending jobs times its
+typical wait, so a saturated pool gets fewer new jobs until it catches up.
+"""
+from __future__ import print_function, division
+import threading
+
+
+class LabelRouter(object):
+    """Pick a worker label for each job from what is queued where.
+
+    smoothing: weight of the latest wait in each label's moving average of pending time.
+    """
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        # label -> jobs submitted there that have not started running
+        self.pending = {}
+        # label -> moving average of seconds jobs pended there
+        self.waits = {}
+
+    def _expected_wait(self, label, default):
+        # at least a second per pending job, so that labels with no wait yet still balance
+        return (self.pending.get(label, 0) + 1) * max(self.waits.get(label, default), 1.0)
+
+    def choose(self, labels):
+        """The label with the least expected wait, which is then counted as one job busier.
+        Ties go to the label listed first."""
+        with self._lock:
+            # labels without a wait seen yet are assumed to be as busy as the others
+            default = (sum(self.waits.values()) / len(self.waits)) if self.waits else 0.0
+            label = min(labels, key=lambda label: (self._expected_wait(label, default),
+                                                   labels.index(label)))
+            self.pending[label] = self.pending.get(label, 0) + 1
+        return label
+
+    def submitted(self, label):
+        """Count a job that went to label without being routed here"""
+        with self._lock:
+            self.pending[label] = self.pending.get(label, 0) + 1
+
+    def started(self, label, waited=None):
+        """A job on label stopped pending after waited seconds.  waited is None when the job
+        ended without running, which says nothing about the queue."""
+        with self._lock:
+            self.pending[label] = max(self.pending.get(label, 0) - 1, 0)
+            if waited is not None:
+                average = self.waits.get(label)
+                self.waits[label] = (waited if average is None else
+                                     average + self.smoothing * (waited - average))
+
+    def snapshot(self):
+        with self._lock:
+            return {'pending': dict(self.pending), 'waits': dict(self.waits)}
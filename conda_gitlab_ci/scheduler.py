@@ -0,0 +1,499 @@
+"""A lightweight dispatcher for job graphs that does not need a dask scheduler.
+
+Dispatching only waits on HTTP calls, so a thread pool that walks the job graph from
+compute_job_graph and releases each job once all of its dependencies have succeeded is all we
+need.  When a job fails, every job that depends on it (directly or not) is skipped instead of
+being submitted.  With fail_fast, everything else is stopped too: nothing new is submitted and
+builds already running on gitlab are canceled.
+"""
+from __future__ import print_function, division
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import functools
+import threading
+import time
+
+import networkx as nx
+from six.moves import queue
+
+from .execute import _job
+from .fusion import parse_results
+from .journal import IN_FLIGHT
+from .metrics import job_label
+from .routing import LabelRouter
+from .trigger_gitlab import cancel_job, get_job_trace
+
+SUCCESS = 'success'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+CANCELLED = 'cancelled'
+
+
+class Dispatcher(object):
+    """Run every job in a job graph, respecting dependencies.
+
+    jobs: graph from compute_job_graph.  Edges point from a job to its dependencies.
+    threads: maximum number of jobs in flight at once.
+    job_function: called with the configuration and commit sha of each job, plus a notify
+                  callback (see execute._job); raising means the job failed.
+    fail_fast: on the first failure, skip everything not yet submitted and cancel builds that
+               are in flight.
+    cancel_function: called with the build id of each in-flight build to cancel.  Defaults to
+                     the cancel method of the backend given in kwargs, if any, or
+                     trigger_gitlab.cancel_job.
+    journal: optional journal.Journal, where submissions and results are recorded.
+    resume: read the journal first.  Jobs that it says succeeded for the same commit are not
+            submitted again, and jobs that were still in flight are waited on rather than
+            submitted again.
+    listeners: objects with a job_event(key, state) method, told when jobs are submitted to
+               gitlab, start pending or running there, and when they are resolved
+               (see status.StatusBoard).
+    history: optional history.DurationHistory, updated with how long successful jobs ran.
+    result_cache: optional result_cache.ResultCache.  Jobs whose input hash it has seen succeed
+                  before are not submitted again, and the input hashes of jobs that succeed
+                  are added to it.
+    trace_function: called with the build id of a fused job that failed (see fusion), to read
+                    the result of each of its configurations from its log.  Defaults to the
+                    trace method of the backend given in kwargs, if it has one, or
+                    trigger_gitlab.get_job_trace.
+    router: routing.LabelRouter that picks the worker label of jobs that can run on several
+            (see build_matrix.worker_labels), from how many of this dispatch's jobs are pending
+            on each and how long they have been pending there.  A new one by default.
+
+    Fused jobs are resolved per configuration: statuses has a status for each configuration a
+    fused job ran, under the configuration's own job key, rather than one for the fused job.
+
+    Extra kwargs are passed through to job_function and cancel_function.
+    """
+    def __init__(self, jobs, threads=50, job_function=_job, fail_fast=False,
+                 cancel_function=None, journal=None, resume=False, listeners=(),
+                 history=None, result_cache=None, trace_function=None, router=None, **kwargs):
+        self.jobs = jobs
+        self.threads = threads
+        self.job_function = job_function
+        self.fail_fast = fail_fast
+        if cancel_function is None:
+            cancel_function = kwargs['backend'].cancel if kwargs.get('backend') else cancel_job
+        self.cancel_function = cancel_function
+        if trace_function is None:
+            backend = kwargs.get('backend')
+            trace_function = getattr(backend, 'trace', None) if backend else get_job_trace
+        self.trace_function = trace_function
+        self.router = router or LabelRouter()
+        self.journal = journal
+        self.listeners = listeners
+        self.history = history
+        self.result_cache = result_cache
+        self.kwargs = kwargs
+        # (job key, commit sha) -> latest journal entry, from the dispatch we are resuming
+        self.previous = journal.load() if journal and resume else {}
+
+        # job key -> one of SUCCESS, FAILED, SKIPPED or CANCELLED, once the job is resolved
+        self.statuses = {}
+        # fused job key -> its own status; its configurations' statuses are in statuses
+        self.fused_statuses = {}
+        # job key -> gitlab build id, for jobs that have been submitted
+        self.build_ids = {}
+        # job key -> the worker label it was submitted to
+        self.labels = {}
+        # job key -> [worker label, when it was submitted], for jobs not yet picked up by a
+        #    runner
+        self._queued = {}
+        # job key -> {event: timestamp}, for the 'submitted', 'running' and 'finished' events
+        self.times = {}
+        # job key -> when all of its dependencies had succeeded
+        self.ready_times = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._planning_error = None
+
+    def run(self, more_jobs=()):
+        """Dispatch the whole graph and return the statuses of all jobs.
+
+        more_jobs: optional iterable of job graphs, each holding the one before it, such as
+                   execute.stream_job_graph gives while planning.  It is read in a background
+                   thread, and the jobs it adds are dispatched as they arrive, along with the
+                   jobs already in the graph.
+        """
+        # job key -> keys of dependencies that have not succeeded yet
+        waiting = {}
+        ready = []
+        running = {}
+        # every job that is in the dispatch
+        self._known = set()
+        self._stopped = False
+        self._add_jobs(self.jobs, waiting, ready)
+
+        incoming = queue.Queue()
+        planning = bool(more_jobs)
+        if planning:
+            feeder = threading.Thread(target=self._feed, args=(more_jobs, incoming))
+            feeder.daemon = True
+            feeder.start()
+
+        pool = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            while ready or running or planning:
+                while planning:
+                    try:
+                        # only wait for more jobs if there is nothing else to wait for
+                        graph = incoming.get(block=not (ready or running))
+                    except queue.Empty:
+                        break
+                    if graph is None:
+                        planning = False
+                    else:
+                        self._add_jobs(graph, waiting, ready)
+
+                while ready:
+                    key = ready.pop()
+                    del waiting[key]
+                    running[self._submit(pool, key)] = key
+                if not running:
+                    continue
+
+                # while planning, look for new jobs every so often
+                done, _ = wait(list(running), timeout=1 if planning else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    self._record(key, 'finished')
+                    self._dequeue(key)
+                    if future.exception() is None:
+                        self._resolve(key, SUCCESS)
+                        self._release_dependents(key, waiting, ready)
+                    elif key in self._cancelled:
+                        # the failure is our own doing
+                        self._resolve(key, CANCELLED)
+                    else:
+                        self._resolve(key, FAILED)
+                        print("{0} failed: {1}".format(key, future.exception()))
+                        if self.fail_fast:
+                            self._stopped = True
+                            skipped = list(waiting)
+                            waiting.clear()
+                            del ready[:]
+                            self._cancel(list(running.values()))
+                        else:
+                            skipped = _skip_dependents(self.jobs, key, waiting)
+                        for dependent in skipped:
+                            self._resolve(dependent, SKIPPED)
+                    self._journal(key, self.status(key))
+        finally:
+            pool.shutdown(wait=True)
+            if self.history:
+                self.history.save()
+            if self.result_cache:
+                self.result_cache.save()
+        if self._planning_error is not None:
+            raise self._planning_error
+        if self.journal:
+            # a finished dispatch only needs resuming for its own commits
+            self.journal.prune(set(self.jobs.node[key]['commit_sha'] for key in self.jobs))
+        return self.statuses
+
+    def _feed(self, more_jobs, incoming):
+        """Pass the graphs of more_jobs on to run, then None when there are no more"""
+        try:
+            for graph in more_jobs:
+                incoming.put(graph)
+        except Exception as e:
+            print("Planning failed: {0}".format(e))
+            self._planning_error = e
+        finally:
+            incoming.put(None)
+
+    def _add_jobs(self, graph, waiting, ready):
+        """Add the jobs of graph that are new to the dispatch, releasing those whose
+        dependencies have all succeeded"""
+        # dependencies first, so that a resumed chain of successes is released all at once
+        new = [key for key in nx.topological_sort(graph, reverse=True)
+               if key not in self._known]
+        # job key -> dependencies that jobs already in the dispatch have gained, e.g. when a
+        #    job planned later was coalesced onto them (see execute.coalesce_jobs)
+        gained = {}
+        if graph is not self.jobs:
+            for key in new:
+                self.jobs.add_node(key, **graph.node[key])
+            for key in new:
+                for dependency in graph.successors(key):
+                    self.jobs.add_edge(key, dependency)
+            for key in graph.nodes():
+                if key in self._known:
+                    dependencies = [dependency for dependency in graph.successors(key)
+                                    if not self.jobs.has_edge(key, dependency)]
+                    if dependencies:
+                        gained[key] = dependencies
+        self._known.update(new)
+        for listener in self.listeners:
+            if hasattr(listener, 'jobs_added'):
+                listener.jobs_added(self.jobs, new)
+
+        now = time.time()
+        for key in new:
+            dependencies = self.jobs.successors(key)
+            if self._stopped or any(self.statuses.get(dependency) in (FAILED, SKIPPED,
+                                                                      CANCELLED)
+                                    for dependency in dependencies):
+                self._resolve(key, SKIPPED)
+                continue
+            waiting[key] = set(dependency for dependency in dependencies
+                               if self.statuses.get(dependency) != SUCCESS)
+            if waiting[key]:
+                continue
+            if self.previous and self._previous_status(key) == SUCCESS:
+                print("{0} already succeeded; not submitting it again".format(key))
+                del waiting[key]
+                self._resolve(key, SUCCESS)
+            elif self._cached(key):
+                print("{0} already succeeded with the same inputs for {1}; not submitting it "
+                      "again".format(key, self._cached(key)['commit_sha']))
+                del waiting[key]
+                self._resolve(key, SUCCESS)
+            else:
+                ready.append(key)
+                self.ready_times[key] = now
+        for key, dependencies in sorted(gained.items()):
+            self._add_dependencies(key, dependencies, waiting, ready)
+
+    def _add_dependencies(self, key, dependencies, waiting, ready):
+        """Make a job that is already in the dispatch also wait for dependencies.  A job that
+        was submitted already can't wait any more, and is only reported."""
+        for dependency in dependencies:
+            self.jobs.add_edge(key, dependency)
+        if key not in waiting:
+            print("{0} was dispatched before it was planned to wait for {1}".format(
+                key, ", ".join(sorted(dependencies))))
+            return
+        if any(self.statuses.get(dependency) in (FAILED, SKIPPED, CANCELLED)
+               for dependency in dependencies):
+            if key in ready:
+                ready.remove(key)
+            del waiting[key]
+            self._resolve(key, SKIPPED)
+            for dependent in _skip_dependents(self.jobs, key, waiting):
+                self._resolve(dependent, SKIPPED)
+            return
+        pending = set(dependency for dependency in dependencies
+                      if self.statuses.get(dependency) != SUCCESS)
+        if pending:
+            waiting[key].update(pending)
+            if key in ready:
+                ready.remove(key)
+
+    def _cached(self, key):
+        """The result cache's entry for a job's inputs, if they have succeeded before"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(self.jobs.node[key].get('input_hash'))
+
+    def status(self, key):
+        """The status of a resolved job, fused or not"""
+        return self.fused_statuses.get(key, self.statuses.get(key))
+
+    def _resolve(self, key, status):
+        members = self.jobs.node[key].get('fused')
+        if members:
+            self._resolve_fused(key, status, members)
+            return
+        self.statuses[key] = status
+        if status == SUCCESS and self.history:
+            run_time = self.run_time(key)
+            if run_time is not None:
+                self.history.record(key, self.jobs.node[key].get('package'), run_time)
+        if status == SUCCESS and self.result_cache is not None:
+            data = self.jobs.node[key]
+            self.result_cache.record(data.get('input_hash'), key, data['commit_sha'])
+        self._event(key, status)
+
+    def _resolve_fused(self, key, status, members):
+        """Resolve each configuration of a fused job.  When the job failed, the configurations
+        that its log says succeeded still count as successes."""
+        self.fused_statuses[key] = status
+        results = {}
+        if status == FAILED:
+            results = self._fused_results(key)
+        data = self.jobs.node[key]
+        run_time = self.run_time(key)
+        estimates = [self.history.estimate(member['key'], member['package'], 0.0)
+                     if self.history else 0.0 for member in members]
+        for member, estimate in zip(members, estimates):
+            member_status = results.get(member['key'], status)
+            self.statuses[member['key']] = member_status
+            if member_status != SUCCESS:
+                continue
+            if self.history and run_time is not None:
+                # the job's run time, shared out as the configurations were expected to take
+                share = (estimate / sum(estimates) if sum(estimates)
+                         else 1 / len(members))
+                self.history.record(member['key'], member['package'], run_time * share)
+            if self.result_cache is not None:
+                self.result_cache.record(member['input_hash'], member['key'],
+                                         data['commit_sha'])
+        if status == SUCCESS and self.result_cache is not None:
+            self.result_cache.record(data.get('input_hash'), key, data['commit_sha'])
+        self._event(key, status)
+
+    def _fused_results(self, key):
+        """Job key -> status of each configuration of a failed fused job, from its log"""
+        with self._lock:
+            build_id = self.build_ids.get(key)
+        if build_id is None or self.trace_function is None:
+            return {}
+        try:
+            return parse_results(self.trace_function(build_id, **self.kwargs))
+        except Exception as e:
+            print("Could not read the results of {0} (build {1}): {2}".format(key, build_id, e))
+            return {}
+
+    def _event(self, key, state):
+        for listener in self.listeners:
+            listener.job_event(key, state)
+
+    def _release_dependents(self, key, waiting, ready):
+        for dependent in self.jobs.predecessors(key):
+            if dependent in waiting:
+                waiting[dependent].discard(key)
+                if not waiting[dependent]:
+                    ready.append(dependent)
+                    self.ready_times[dependent] = time.time()
+
+    def _previous_status(self, key):
+        entry = self.previous.get((key, self.jobs.node[key]['commit_sha']), {})
+        return entry.get('status')
+
+    def _submit(self, pool, key):
+        data = self.jobs.node[key]
+        build_id = None
+        if self._previous_status(key) in IN_FLIGHT:
+            build_id = self.previous[(key, data['commit_sha'])]['build_id']
+            print("Reattaching to {0} (build {1})".format(key, build_id))
+        self._record(key, 'submitted')
+        configuration = data['configuration'] if build_id is not None else self._route(key)
+        return pool.submit(self.job_function, configuration=configuration,
+                           dependencies=None, commit_sha=data['commit_sha'],
+                           notify=functools.partial(self._notify, key), build_id=build_id,
+                           ready_time=self.ready_times.get(key), **self.kwargs)
+
+    def _route(self, key):
+        """The configuration to submit a job with, sent to the least busy of its worker
+        labels"""
+        data = self.jobs.node[key]
+        configuration = data['configuration']
+        labels = data.get('worker_labels') or ()
+        if len(labels) > 1:
+            label = self.router.choose(list(labels))
+            variables = dict(configuration['variables'], TARGET_PLATFORM=(label, ))
+            configuration = dict(configuration, variables=variables)
+        else:
+            label = job_label(configuration)
+            self.router.submitted(label)
+        with self._lock:
+            self.labels[key] = label
+            self._queued[key] = [label, None]
+        for listener in self.listeners:
+            if hasattr(listener, 'job_routed'):
+                listener.job_routed(key, label)
+        return configuration
+
+    def _dequeue(self, key, started=False):
+        """Tell the router that a job is no longer pending: a runner picked it up (started),
+        or it ended without one"""
+        with self._lock:
+            label, submitted = self._queued.pop(key, (None, None))
+        if label is None:
+            return
+        waited = time.time() - submitted if started and submitted is not None else None
+        self.router.started(label, waited)
+
+    def _journal(self, key, status):
+        if self.journal:
+            with self._lock:
+                build_id = self.build_ids.get(key)
+            self.journal.record(key, self.jobs.node[key]['commit_sha'], build_id, status)
+
+    def _notify(self, key, status, build_id):
+        """Called from the job threads as the jobs' statuses change"""
+        with self._lock:
+            self.build_ids[key] = build_id
+            cancelled = key in self._cancelled
+        if status == 'submitted':
+            with self._lock:
+                if key in self._queued:
+                    self._queued[key][1] = time.time()
+            self._journal(key, status)
+        elif status == 'running':
+            self._dequeue(key, started=True)
+        if status in ('submitted', 'pending', 'running'):
+            self._event(key, status)
+        if status == 'submitted' and cancelled:
+            # fail_fast kicked in between submitting this job and learning its build id
+            self._cancel_build(key, build_id)
+        if status == 'running':
+            self._record(key, 'running')
+
+    def _record(self, key, event):
+        with self._lock:
+            self.times.setdefault(key, {}).setdefault(event, time.time())
+
+    def _cancel(self, keys):
+        for key in keys:
+            with self._lock:
+                self._cancelled.add(key)
+                build_id = self.build_ids.get(key)
+            if build_id is not None:
+                self._cancel_build(key, build_id)
+
+    def _cancel_build(self, key, build_id):
+        try:
+            self.cancel_function(build_id, **self.kwargs)
+        except Exception as e:
+            print("Could not cancel {0} (build {1}): {2}".format(key, build_id, e))
+
+    def run_time(self, key):
+        """Seconds a job spent running on gitlab, if we saw it start and finish"""
+        times = self.times.get(key, {})
+        if 'running' not in times or 'finished' not in times:
+            return None
+        return times['finished'] - times['running']
+
+    def runner_hours_saved(self):
+        """Estimate the runner time that skipping and canceling jobs saved.
+
+        Jobs are assumed to run as long as the successful jobs of this dispatch did on average.
+        Returns None when no job has succeeded yet, because there is nothing to estimate from.
+        """
+        run_time = self.run_time
+        durations = [run_time(key) for key, status in self.statuses.items()
+                     if status == SUCCESS and run_time(key) is not None]
+        if not durations:
+            return None
+        mean = sum(durations) / len(durations)
+        saved = 0.0
+        for key, status in self.statuses.items():
+            if status == SKIPPED:
+                saved += mean
+            elif status == CANCELLED:
+                saved += max(mean - (run_time(key) or 0.0), 0.0)
+        return saved / 3600
+
+
+def run_job_graph(jobs, threads=50, job_function=_job, fail_fast=False, **kwargs):
+    """Dispatch a job graph, returning a dictionary of job key -> status"""
+    return Dispatcher(jobs, threads=threads, job_function=job_function, fail_fast=fail_fast,
+                      **kwargs).run()
+
+
+def _skip_dependents(jobs, key, waiting):
+    """Remove everything that depends on key from the waiting jobs, and return it"""
+    skipped = [dependent for dependent in nx.ancestors(jobs, key) if dependent in waiting]
+    for dependent in skipped:
+        del waiting[dependent]
+    return skipped
+
+
+def summarize(statuses):
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    return ", ".join("{0} {1}".format(counts.get(status, 0), status)
+                     for status in (SUCCESS, FAILED, SKIPPED, CANCELLED))
@@ -0,0 +1,118 @@
+"""Split planning across several cgci hosts, and merge their plans into one job graph.
+
+Planning is split by (run, platform) unit - see execute.planning_units.  Each worker host plans
+every unit whose index modulo the number of shards is its shard number, and writes the
+resulting jobs to a JSON file.  The coordinator reads all of the files, checks that every unit
+was planned once for the same commit, and merges them into one job graph to dispatch.
+"""
+from __future__ import print_function, division
+from concurrent.futures import ProcessPoolExecutor
+import io
+import json
+
+from .execute import (checkout_git_rev, planning_units, _plan_kwargs, _plan_platform,
+                      jobs_from_plans)
+from .git_history import resolve_rev
+
+
+def parse_shard(value):
+    """Parse a shard given as INDEX/COUNT, e.g. 0/4 for the first of four shards"""
+    try:
+        shard, n_shards = [int(x) for x in value.split('/')]
+    except ValueError:
+        raise ValueError("Shard must be given as INDEX/COUNT, for example 0/4.  "
+                         "Got {0}".format(value))
+    if not 0 <= shard < n_shards:
+        raise ValueError("Shard index must be between 0 and {0}.  Got {1}".format(n_shards - 1,
+                                                                                  shard))
+    return shard, n_shards
+
+
+def plan_shard(path, shard, n_shards, packages=(), filter_dirty=True, git_rev='HEAD',
+               stop_rev=None, steps=0, test=False, max_downstream=5, checkout=True,
+               semantic_changes=False, impact=False, budget=None, costs=None,
+               condense_cycles=False):
+    """Plan this shard's share of the planning units.
+
+    checkout: check out the revision to plan first.  Pass False when the caller has already
+              checked it out.
+
+    Returns a JSON-compatible dictionary with the commit sha (resolved, so that shards that
+    planned HEAD at different commits don't agree), the total number of units and the plan of
+    each unit this shard planned, by unit index.
+    """
+    if checkout:
+        with checkout_git_rev(stop_rev or git_rev, path, git_rev=git_rev, stop_rev=stop_rev):
+            return plan_shard(path, shard, n_shards, packages=packages,
+                              filter_dirty=filter_dirty, git_rev=git_rev, stop_rev=stop_rev,
+                              steps=steps, test=test, max_downstream=max_downstream,
+                              checkout=False, semantic_changes=semantic_changes,
+                              impact=impact, budget=budget, costs=costs,
+                              condense_cycles=condense_cycles)
+    units = planning_units(path, test=test)
+    plan_kwargs = _plan_kwargs(packages=packages, filter_dirty=filter_dirty, git_rev=git_rev,
+                               stop_rev=stop_rev, steps=steps, test=test,
+                               max_downstream=max_downstream,
+                               semantic_changes=semantic_changes, impact=impact,
+                               budget=budget, costs=costs, condense_cycles=condense_cycles,
+                               n_units=len(units))
+    plans = {}
+    indexes = {}
+    for index, (run, platform) in enumerate(units):
+        if index % n_shards == shard:
+            plans[str(index)] = _plan_platform(path, run, platform, indexes=indexes,
+                                               **plan_kwargs)
+    return {'commit_sha': resolve_rev(path, stop_rev or git_rev), 'n_units': len(units),
+            'plans': plans}
+
+
+def write_shard(partial, filename):
+    with io.open(filename, 'w', encoding='utf-8') as f:
+        f.write(u"{0}".format(json.dumps(partial, sort_keys=True)))
+
+
+def read_shard(filename):
+    with io.open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def merge_shards(partials):
+    """Merge the partial plans of all shards into a job graph (see execute.compute_job_graph)"""
+    if not partials:
+        raise ValueError("No partial plans to merge")
+    commit_shas = set(partial['commit_sha'] for partial in partials)
+    n_units = set(partial['n_units'] for partial in partials)
+    if len(commit_shas) > 1 or len(n_units) > 1:
+        raise ValueError("Partial plans disagree on commit or number of planning units: "
+                         "commits {0}, units {1}".format(sorted(commit_shas), sorted(n_units)))
+    plans = {}
+    for partial in partials:
+        for index, plan in partial['plans'].items():
+            if int(index) in plans:
+                raise ValueError("Planning unit {0} was planned more than once".format(index))
+            plans[int(index)] = plan
+    missing = set(range(n_units.pop())) - set(plans)
+    if missing:
+        raise ValueError("Planning units {0} were not planned by any shard".format(
+            sorted(missing)))
+    return jobs_from_plans([plans[index] for index in sorted(plans)], commit_shas.pop())
+
+
+def _plan_shard_star(args):
+    path, shard, n_shards, kwargs = args
+    return plan_shard(path, shard, n_shards, **kwargs)
+
+
+def plan_shards_locally(path, n_shards, git_rev='HEAD', stop_rev=None, **kwargs):
+    """Stand-in for a set of worker hosts: plan every shard in its own local process, then
+    merge the results as the coordinator would."""
+    partials = []
+    kwargs.update(git_rev=git_rev, stop_rev=stop_rev, checkout=False)
+    # the shards share one working copy here, so check out once rather than in each shard
+    with checkout_git_rev(stop_rev or git_rev, path, git_rev=git_rev, stop_rev=stop_rev):
+        with ProcessPoolExecutor(max_workers=n_shards) as pool:
+            args = [(path, shard, n_shards, kwargs) for shard in range(n_shards)]
+            for partial in pool.map(_plan_shard_star, args):
+                # round trip through JSON, like the files workers hand to the coordinator
+                partials.append(json.loads(json.dumps(partial)))
+    return merge_shards(partials)
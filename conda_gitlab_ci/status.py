@@ -0,0 +1,160 @@
+"""Live view of a dispatch, driven by the native dispatcher's own events.
+
+The StatusBoard keeps the state of every job (queued, submitted, pending, running, success,
+failed, skipped, cancelled) and counts per worker label.  Every interval seconds it prints a
+one-line summary with an ETA and, optionally, rewrites a JSON status file that other tools can
+tail.  Events only update counters, so following thousands of jobs costs next to nothing.
+
+The ETA is the longest chain of remaining work through the job graph, using historical
+durations (see history.DurationHistory) where there are any.
+"""
+from __future__ import print_function, division
+import datetime
+import json
+import sys
+import threading
+import time
+
+import networkx as nx
+
+from .metrics import atomic_write
+
+QUEUED = 'queued'
+STATES = (QUEUED, 'submitted', 'pending', 'running', 'success', 'failed', 'skipped',
+          'cancelled')
+FINISHED = ('success', 'failed', 'skipped', 'cancelled')
+# when nothing has run before, assume jobs take this long
+DEFAULT_DURATION = 600
+
+
+class StatusBoard(object):
+    def __init__(self, jobs, path=None, interval=5, history=None, stream=sys.stdout):
+        self.jobs = jobs
+        self.path = path
+        self.interval = interval
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+        self.history = history
+        self.states = {}
+        self.labels = {}
+        # worker label -> {state: number of jobs}
+        self.counts = {}
+        # job key -> when it started running
+        self.started = {}
+        self.durations = {}
+        self.jobs_added(jobs, jobs.nodes())
+
+    def jobs_added(self, jobs, keys):
+        """Start following more jobs, e.g. as a streamed plan grows (see scheduler.Dispatcher)"""
+        history = self.history
+        default = history.mean(DEFAULT_DURATION) if history else DEFAULT_DURATION
+        with self._lock:
+            self.jobs = jobs
+            for key in keys:
+                if key in self.states:
+                    continue
+                label = str(jobs.node[key].get('worker_label', ''))
+                self.labels[key] = label
+                self.states[key] = QUEUED
+                counts = self.counts.setdefault(label, {})
+                counts[QUEUED] = counts.get(QUEUED, 0) + 1
+                self.durations[key] = (history.estimate(key, jobs.node[key].get('package'),
+                                                        default)
+                                       if history else default)
+            self.tails = self._tails()
+
+    def _tails(self):
+        """For each job, its duration plus the longest chain of jobs that wait on it"""
+        tails = {}
+        # jobs come before the jobs they depend on in this order
+        for key in nx.topological_sort(self.jobs):
+            after = [tails[dependent] for dependent in self.jobs.predecessors(key)]
+            tails[key] = self.durations[key] + max(after or [0])
+        return tails
+
+    def job_routed(self, key, label):
+        """A job was sent to another of its worker labels than the one it was planned for
+        (see scheduler.Dispatcher)"""
+        with self._lock:
+            old = self.labels.get(key)
+            if old is None or old == label:
+                return
+            state = self.states[key]
+            self.counts[old][state] -= 1
+            counts = self.counts.setdefault(label, {})
+            counts[state] = counts.get(state, 0) + 1
+            self.labels[key] = label
+
+    def job_event(self, key, state):
+        with self._lock:
+            old = self.states.get(key)
+            if old == state or old in FINISHED:
+                return
+            self.states[key] = state
+            counts = self.counts[self.labels[key]]
+            counts[old] -= 1
+            counts[state] = counts.get(state, 0) + 1
+            if state == 'running':
+                self.started[key] = time.time()
+
+    def eta(self):
+        """Seconds until every job is expected to be finished"""
+        now = time.time()
+        remaining = [0]
+        with self._lock:
+            for key, state in self.states.items():
+                if state in FINISHED:
+                    continue
+                tail = self.tails[key]
+                if key in self.started:
+                    duration = self.durations[key]
+                    tail -= duration - max(duration - (now - self.started[key]), 0)
+                remaining.append(tail)
+        return max(remaining)
+
+    def totals(self):
+        totals = {}
+        with self._lock:
+            for counts in self.counts.values():
+                for state, n in counts.items():
+                    totals[state] = totals.get(state, 0) + n
+        return totals
+
+    def summary(self):
+        totals = self.totals()
+        eta = datetime.timedelta(seconds=int(self.eta()))
+        return "{0}; ETA {1}".format(", ".join("{0} {1}".format(totals.get(state, 0), state)
+                                               for state in STATES), eta)
+
+    def snapshot(self):
+        eta = self.eta()
+        totals = self.totals()
+        with self._lock:
+            return {'time': time.time(),
+                    'eta_seconds': eta,
+                    'counts': totals,
+                    'labels': {label: dict(counts) for label, counts in self.counts.items()},
+                    'jobs': {key: {'state': state, 'worker_label': self.labels[key]}
+                             for key, state in self.states.items()}}
+
+    def write(self):
+        print(self.summary(), file=self.stream)
+        if self.path:
+            atomic_write(self.path, json.dumps(self.snapshot(), sort_keys=True))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.write()
@@ -4,10 +4,21 @@ import six
 
 import requests
 
+from . import metrics
 
-def _get_url_from_env_vars(url_type, commit_sha=None):
-    ci_urls = {"trigger": "/api/v3/projects/{id}/trigger/builds",
-               "status": "/api/v3/projects/{id}/repository/commits/{sha}/statuses"}
+# the statuses of a pipeline or job that has finished.  Any other (created, pending, running,
+#    waiting_for_resource, preparing, scheduled, manual...) means it may yet run.
+FINISHED = ('success', 'failed', 'canceled', 'skipped')
+
+def _get_url_from_env_vars(url_type, build_id=None, pipeline_id=None):
+    # v4 of the API, which gitlab 9.0 and newer have; child pipelines (see pipeline.py) need
+    #    gitlab 12.9 anyway.  A trigger starts a pipeline, so what is submitted, checked on and
+    #    canceled is a pipeline.  Its jobs are only needed for their logs.
+    ci_urls = {"trigger": "/api/v4/projects/{id}/trigger/pipeline",
+               "pipeline": "/api/v4/projects/{id}/pipelines/{pipeline_id}",
+               "cancel": "/api/v4/projects/{id}/pipelines/{pipeline_id}/cancel",
+               "pipeline_jobs": "/api/v4/projects/{id}/pipelines/{pipeline_id}/jobs",
+               "trace": "/api/v4/projects/{id}/jobs/{build_id}/trace"}
     # These CI variables are set by gitlab during a build.
     base_url = os.getenv("CI_PROJECT_URL")
     if not base_url:
@@ -15,70 +26,133 @@ def _get_url_from_env_vars(url_type, commit_sha=None):
                          "variable and try again.")
     url = six.moves.urllib.parse.urlsplit(base_url)
     project_id = os.getenv("CI_PROJECT_ID")
-    if not commit_sha:
-        commit_sha = os.getenv("CI_BUILD_REF")
     if not project_id:
         raise ValueError("Did not get value for CI_PROJECT_ID.  "
                             "You must provide ci_submit_url arg if not "
                             "running under a gitlab ci build.")
-    if not commit_sha:
-        raise ValueError("Did not get value for CI_BUILD_REF.  "
-                            "You must provide ci_submit_url arg if not "
-                            "running under a gitlab ci build.")
-    location = ci_urls[url_type].format(id=project_id, sha=commit_sha)
+    location = ci_urls[url_type].format(id=project_id, build_id=build_id,
+                                        pipeline_id=pipeline_id)
     ci_url = six.moves.urllib.parse.urlunsplit((url.scheme, url.hostname, location,
                                   "", ""))
     return ci_url
 
 
+def _with_private_token(url):
+    return six.moves.urllib.parse.urljoin(url, '?private_token=' + _get_private_token())
+
+
+def _request(endpoint, method, url, **kwargs):
+    """Make an API request, counting it (and whether it failed) in the dispatch metrics"""
+    try:
+        response = method(url, **kwargs)
+    except requests.exceptions.RequestException:
+        metrics.registry.api_call(endpoint, ok=False)
+        raise
+    metrics.registry.api_call(endpoint, ok=response.ok)
+    return response
+
+
+def _get_trigger_token():
+    ci_submit_token = os.getenv('TRIGGER_TOKEN')
+    if not ci_submit_token:
+        raise ValueError("Did not get value for TRIGGER_TOKEN.  "
+                         "You must provide ci_submit_url arg if not "
+                         "running under a gitlab ci build.  Also, you must"
+                         "set the TRIGGER_TOKEN secret environment "
+                         "variable for your project.")
+    return ci_submit_token
+
+
 def submit_job(configuration, repo_ref, ci_submit_url=None, ci_submit_token=None, **kwargs):
-    """returns job id for later checking on status"""
-    if 'BUILD_RECIPE' not in configuration['variables']:
+    """Trigger a pipeline that builds one configuration.  Returns the pipeline's id, which the
+    other calls here take as build_id, for later checking on status."""
+    if not set(configuration['variables']) & {'BUILD_RECIPE', 'CGCI_FUSED'}:
         return
     if not ci_submit_url:
         ci_submit_url = _get_url_from_env_vars('trigger')
 
     if not ci_submit_token:
-        ci_submit_token = os.getenv('TRIGGER_TOKEN')
-        if not ci_submit_token:
-            raise ValueError("Did not get value for TRIGGER_TOKEN.  "
-                             "You must provide ci_submit_url arg if not "
-                             "running under a gitlab ci build.  Also, you must"
-                             "set the TRIGGER_TOKEN secret environment "
-                             "variable for your project.")
+        ci_submit_token = _get_trigger_token()
     configuration.update({
         'token': ci_submit_token,
         'ref': repo_ref,
     })
 
-    response = requests.post(ci_submit_url, json=configuration)
+    response = _request('trigger', requests.post, ci_submit_url, json=configuration)
     assert response.ok, "Failed to submit job.  Error message was: %s" % response.text
     return response.json()['id']
 
 
-def check_job_status(build_id, commit_sha=None, ci_status_url=None, **kwargs):
-    """
-    Queries status of build.  Note that build_id and repo_ref are strongly tied.
-       If a build_id does not exist for a given repo_ref, then you'll get an
-       empty list back.
-
-    returns one of:
-      - success
-      - pending
-      - running
-      - failed
-    """
-    if not commit_sha:
-        commit_sha = os.getenv("CI_BUILD_REF")
-    if not ci_status_url:
-        ci_status_url = _get_url_from_env_vars('status', commit_sha)
+def submit_pipeline(variables, repo_ref, ci_submit_url=None, ci_submit_token=None, **kwargs):
+    """Trigger one pipeline with these variables.  Returns its id for later checking on
+    status."""
+    if not ci_submit_url:
+        ci_submit_url = _get_url_from_env_vars('trigger')
+    if not ci_submit_token:
+        ci_submit_token = _get_trigger_token()
+    payload = {'token': ci_submit_token, 'ref': repo_ref, 'variables': variables}
+    response = _request('trigger', requests.post, ci_submit_url, json=payload)
+    assert response.ok, "Failed to submit pipeline.  Error message was: %s" % response.text
+    return response.json()['id']
+
+
+def _get_private_token():
     # need a token to use API.  This should be set using private variables.
     private_token = os.getenv("GITLAB_PRIVATE_TOKEN")
     if not private_token:
         raise ValueError("Did not get value for GITLAB_PRIVATE_TOKEN.  "
                         "You must set the GITLAB_PRIVATE_TOKEN secret environment "
                         "variable for your project.")
-    ci_status_url = six.moves.urllib.parse.urljoin(ci_status_url, '?private_token=' + private_token)
-    response = requests.get(ci_status_url).json()
-    status = [build['status'] for build in response if int(build['id']) == build_id][0]
-    return status
+    return private_token
+
+
+def check_job_status(build_id, commit_sha=None, ci_status_url=None, **kwargs):
+    """
+    Queries the status of what submit_job triggered: the pipeline with id build_id.  commit_sha
+       is not needed to find it, and is only taken for the backends' sake.
+
+    returns one of gitlab's pipeline statuses:
+      - created, waiting_for_resource, preparing, pending, running, scheduled or manual, while
+        it is not done
+      - success, failed, canceled or skipped once it is
+    """
+    if not ci_status_url:
+        ci_status_url = _get_url_from_env_vars('pipeline', pipeline_id=build_id)
+    response = _request('status', requests.get, _with_private_token(ci_status_url))
+    assert response.ok, "Failed to get job status.  Error message was: %s" % response.text
+    return response.json()['status']
+
+
+def check_pipeline_status(pipeline_id, ci_pipeline_url=None, **kwargs):
+    """Queries the status of a whole pipeline: created, pending, running, success, failed,
+    canceled or skipped."""
+    if not ci_pipeline_url:
+        ci_pipeline_url = _get_url_from_env_vars('pipeline', pipeline_id=pipeline_id)
+    return _request('pipeline', requests.get,
+                    _with_private_token(ci_pipeline_url)).json()['status']
+
+
+def get_job_trace(build_id, ci_jobs_url=None, **kwargs):
+    """The logs of the jobs of the pipeline submit_job triggered as build_id, as text, one
+    after the other"""
+    if not ci_jobs_url:
+        ci_jobs_url = _get_url_from_env_vars('pipeline_jobs', pipeline_id=build_id)
+    response = _request('trace', requests.get, _with_private_token(ci_jobs_url))
+    assert response.ok, "Failed to list pipeline jobs.  Error message was: %s" % response.text
+    traces = []
+    for job in sorted(response.json(), key=lambda job: job['id']):
+        response = _request('trace', requests.get, _with_private_token(
+            _get_url_from_env_vars('trace', build_id=job['id'])))
+        assert response.ok, "Failed to get job trace.  Error message was: %s" % response.text
+        traces.append(response.text)
+    return "\n".join(traces)
+
+
+def cancel_job(build_id, ci_cancel_url=None, **kwargs):
+    """Ask gitlab to stop the pipeline submit_job triggered as build_id.  Returns the new
+    status."""
+    if not ci_cancel_url:
+        ci_cancel_url = _get_url_from_env_vars('cancel', pipeline_id=build_id)
+    response = _request('cancel', requests.post, _with_private_token(ci_cancel_url))
+    assert response.ok, "Failed to cancel job.  Error message was: %s" % response.text
+    return response.json()['status']
@@ -0,0 +1,79 @@
+import pickle
+
+import networkx as nx
+
+from conda_gitlab_ci import execute, scheduler
+from conda_gitlab_ci.backends import SimulatedBackend
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def configuration(label='linux'):
+    return {'variables': {'BUILD_RECIPE': 'a', 'TARGET_PLATFORM': (label, )}}
+
+
+def test_simulated_queueing():
+    clock = Clock()
+    backend = SimulatedBackend(runners={'linux': 2}, duration=10, duration_sigma=0,
+                               clock=clock)
+    ids = [backend.submit(configuration(), 'abc') for _ in range(3)]
+    osx = backend.submit(configuration('osx'), 'abc')
+    assert [backend.status(build_id) for build_id in ids] == ['running', 'running', 'pending']
+    # other labels have their own runners
+    assert backend.status(osx) == 'running'
+    clock.now = 10
+    assert [backend.status(build_id) for build_id in ids] == ['success', 'success', 'running']
+    assert backend.builds[ids[2]]['started'] == 10
+    clock.now = 20
+    assert backend.status(ids[2]) == 'success'
+    assert backend.utilization()['linux'] == 0.75
+
+
+def test_simulated_failures_and_durations():
+    backend = SimulatedBackend(failure_rate=1.0, duration=10, duration_sigma=0.5, seed=1)
+    build_id = backend.submit(configuration(), 'abc')
+    assert backend.builds[build_id]['fails']
+    durations = [backend._duration() for _ in range(2000)]
+    assert 9 < sum(durations) / len(durations) < 11
+    assert len(set(durations)) > 1
+
+
+def test_simulated_cancel_frees_runner():
+    clock = Clock()
+    backend = SimulatedBackend(default_runners=1, duration=10, duration_sigma=0, clock=clock)
+    first, second, third = [backend.submit(configuration(), 'abc') for _ in range(3)]
+    clock.now = 5
+    assert backend.cancel(third) == 'canceled'
+    assert backend.cancel(first) == 'canceled'
+    assert backend.status(second) == 'running'
+    assert backend.builds[second]['started'] == 5
+    clock.now = 15
+    assert backend.cancel(second) == 'success'
+
+
+def test_simulated_pickles_to_same_instance():
+    backend = SimulatedBackend()
+    assert pickle.loads(pickle.dumps(backend)) is backend
+
+
+def test_job_with_backend():
+    backend = SimulatedBackend(duration=0, duration_sigma=0)
+    statuses = []
+    execute._job(configuration(), [], commit_sha='abc', backend=backend, sleep_interval=0,
+                 notify=lambda status, build_id: statuses.append(status))
+    assert statuses == ['submitted', 'success']
+
+
+def test_dispatcher_cancels_through_backend():
+    jobs = nx.DiGraph()
+    for key in 'ab':
+        jobs.add_node(key, configuration=configuration(), commit_sha='abc')
+    backend = SimulatedBackend(failure_rate=0.0, duration=60, duration_sigma=0)
+    dispatcher = scheduler.Dispatcher(jobs, backend=backend)
+    assert dispatcher.cancel_function == backend.cancel
@@ -1,7 +1,11 @@
 import os
 
+import pytest
+
 from conda_gitlab_ci import build_matrix as bm
 
+from .utils import testing_workdir
+
 test_data_dir = os.path.join(os.path.dirname(__file__), 'data')
 
 
@@ -32,18 +36,108 @@ def test_expand_build_matrix():
     assert len(configurations) == 4
 
 
+def test_sparse_product_exclude():
+    variables = {'CONDA_PY': ('2.7', '3.5', '3.6'), 'CONDA_NPY': ('1.10', '1.11')}
+    rules = {'exclude': [{'CONDA_PY': '2.7', 'CONDA_NPY': '1.11'},
+                         {'CONDA_PY': ['3.5', '3.6'], 'CONDA_NPY': '1.10'},
+                         # not in this matrix, so it doesn't apply
+                         {'CONDA_R': '3.3'}],
+             'include': [], 'zip': []}
+    version_sets = list(bm.sparse_product(variables, rules))
+    assert sorted((v['CONDA_PY'], v['CONDA_NPY']) for v in version_sets) == [
+        ('2.7', '1.10'), ('3.5', '1.11'), ('3.6', '1.11')]
+
+
+def test_sparse_product_zip_and_include():
+    variables = {'CONDA_PY': ('2.7', '3.5'), 'CONDA_NPY': ('1.10', '1.11'),
+                 'CONDA_PERL': ('5.20', )}
+    rules = {'exclude': [{'CONDA_PY': '2.7'}],
+             'include': [{'CONDA_PY': '3.6', 'CONDA_NPY': '1.12'},
+                         # already in the matrix
+                         {'CONDA_PY': '3.5', 'CONDA_NPY': '1.11'}],
+             'zip': [['CONDA_PY', 'CONDA_NPY']]}
+    version_sets = list(bm.sparse_product(variables, rules))
+    assert sorted((v['CONDA_PY'], v['CONDA_NPY'], v['CONDA_PERL']) for v in version_sets) == [
+        ('3.5', '1.11', '5.20'), ('3.6', '1.12', '5.20')]
+    assert bm.matrix_size(variables) == 4
+
+
+def test_sparse_product_is_lazy():
+    # a product of 10 ** 12 version sets, almost all of it excluded by the first variable
+    variables = {'V{0:02d}'.format(i): tuple(str(n) for n in range(10)) for i in range(12)}
+    rules = {'exclude': [{'V00': [str(n) for n in range(1, 10)]}], 'include': [], 'zip': []}
+    version_sets = bm.sparse_product(variables, rules)
+    assert next(version_sets) == {name: '0' for name in variables}
+    assert bm.matrix_size(variables) == 10 ** 12
+
+
+def test_zip_needs_same_lengths():
+    with pytest.raises(ValueError):
+        list(bm.sparse_product({'CONDA_PY': ('2.7', '3.5'), 'CONDA_NPY': ('1.11', )},
+                               {'exclude': [], 'include': [],
+                                'zip': [['CONDA_PY', 'CONDA_NPY']]}))
+
+
+def test_split_versions_recipe_overrides():
+    data = {'CONDA_PY': ['2.7', '3.5'], 'CONDA_NPY': '1.11',
+            'exclude': [{'CONDA_PY': '2.7'}],
+            'recipes': {'frank': {'CONDA_PY': ['3.5', '3.6'],
+                                  'exclude': [{'CONDA_PY': '3.6'}]}}}
+    variables, rules = bm.split_versions(data)
+    assert variables == {'CONDA_PY': ('2.7', '3.5'), 'CONDA_NPY': ('1.11', )}
+    assert rules == {'exclude': [{'CONDA_PY': '2.7'}], 'include': [], 'zip': []}
+    variables, rules = bm.split_versions(data, 'frank')
+    assert variables['CONDA_PY'] == ('3.5', '3.6')
+    assert rules['exclude'] == [{'CONDA_PY': '2.7'}, {'CONDA_PY': '3.6'}]
+
+
+def test_expand_build_matrix_counts(testing_workdir):
+    with open('versions.yml', 'w') as f:
+        f.write('CONDA_PY: ["2.7", "3.5"]\nCONDA_NPY: ["1.10", "1.11"]\n'
+                'exclude:\n  - {CONDA_PY: "2.7", CONDA_NPY: "1.11"}\n')
+    counts = {}
+    configurations = bm.expand_build_matrix('not_a_recipe', testing_workdir, label='linux',
+                                            counts=counts)
+    assert len(configurations) == 3
+    assert counts == {'matrix': 4, 'planned': 3, 'excluded': 1}
+    assert configurations[0]['variables']['TARGET_PLATFORM'] == ('linux', )
+
+
+def test_expand_build_matrix_counts_exclusions_despite_inclusions(testing_workdir):
+    # like the README's example: an exclusion, and an inclusion outside of the matrix
+    with open('versions.yml', 'w') as f:
+        f.write('CONDA_PY: ["2.7", "3.5"]\nCONDA_NPY: ["1.10", "1.11"]\n'
+                'exclude:\n  - {CONDA_PY: "2.7", CONDA_NPY: "1.11"}\n'
+                'include:\n  - {CONDA_PY: "3.6", CONDA_NPY: "1.11"}\n')
+    counts = {}
+    configurations = bm.expand_build_matrix('not_a_recipe', testing_workdir, label='linux',
+                                            counts=counts)
+    assert len(configurations) == 4
+    # the inclusion doesn't cancel out the exclusion
+    assert counts == {'matrix': 4, 'planned': 4, 'excluded': 1}
+
+
+def test_worker_labels():
+    assert bm.worker_labels({'worker_label': 'linux-64'}) == ['linux-64']
+    assert bm.worker_labels({'worker_label': ('linux-64', 'linux-64-spot')}) == ['linux-64',
+                                                                               'linux-64-spot']
+
+
 def test_load_platforms():
     platforms = bm.load_platforms(os.path.join(test_data_dir, 'build_platforms.d'))
     assert len(platforms) == 3
     assert 'worker_label' in platforms[0]
     assert 'platform' in platforms[0]
     assert 'arch' in platforms[0]
+    # loaded once, and shared
+    assert bm.load_platforms(os.path.join(test_data_dir, 'build_platforms.d'))[0] is platforms[0]
 
 
 def test_set_conda_env_vars():
     env_dict = {"TEST_VAR": "value",
                 "NONE_VAR": None,
                 "LIST_VAR": ["value"],
+                "TUPLE_VAR": ("value", ),
                 "PREVIOUS_VAR": "something else"}
     os.environ['PREVIOUS_VAR'] = 'something'
     with bm.set_conda_env_vars(env_dict):
@@ -53,10 +147,12 @@ def test_set_conda_env_vars():
         assert os.environ['NONE_VAR'] == ''
         assert 'LIST_VAR' in os.environ
         assert os.environ['LIST_VAR'] == 'value'
+        assert os.environ['TUPLE_VAR'] == 'value'
         assert 'PREVIOUS_VAR' in os.environ
         assert os.environ['PREVIOUS_VAR'] == 'something else'
     assert 'TEST_VAR' not in os.environ
     assert 'NONE_VAR' not in os.environ
     assert 'LIST_VAR' not in os.environ
+    assert 'TUPLE_VAR' not in os.environ
     assert 'PREVIOUS_VAR' in os.environ
     assert os.environ['PREVIOUS_VAR'] == 'something'
@@ -22,7 +22,23 @@ def test_default_args(mocker):
     cli.get_dask_outputs.assert_called_with(test_data_dir, filter_dirty=True,
                                             git_rev='HEAD', stop_rev=None,
                                             packages=[], steps=0, visualize='',
-                                            test=False, max_downstream=5)
+                                            test=False, max_downstream=5, processes=1,
+                                            semantic_changes=False, impact=False, budget=None,
+                                            costs=None, low_memory=False,
+                                            condense_cycles=False)
+
+
+def test_budget_plans_with_package_costs(mocker):
+    args = [test_data_dir, '--steps', '-1', '--budget', '90']
+    mocker.patch.object(cli, 'get_dask_outputs')
+    mocker.patch.object(cli, 'DurationHistory')
+    mocker.patch.object(cli, 'progress')
+    mocker.patch('conda_gitlab_ci.cli.LocalCluster')
+    mocker.patch('conda_gitlab_ci.cli.Client')
+    cli.DurationHistory.return_value.package_means.return_value = {'a': 60.0}
+    cli.build_cli(args)
+    assert cli.get_dask_outputs.call_args[1]['budget'] == 90
+    assert cli.get_dask_outputs.call_args[1]['costs'] == {'a': 60.0}
 
 
 def test_visualize_generates_output_file(mocker, testing_workdir):
@@ -41,3 +57,111 @@ def test_argparse_input(mocker):
     # calling with no arguments goes to look at sys.argv, which is our arguments to py.test.
     with pytest.raises(SystemExit):
         cli.build_cli()
+
+
+def test_native_scheduler(mocker):
+    args = [test_data_dir, '--scheduler', 'native']
+    mocker.patch.object(cli, 'compute_job_graph')
+    mocker.patch.object(cli, 'Dispatcher')
+    mocker.patch.object(cli, 'StatusBoard')
+    mocker.patch.object(cli, 'DurationHistory')
+    cli.Dispatcher.return_value.run.return_value = {'a': 'success', 'b': 'failed'}
+    cli.Dispatcher.return_value.runner_hours_saved.return_value = None
+    assert cli.build_cli(args) == 1
+    cli.compute_job_graph.assert_called_with(test_data_dir, filter_dirty=True,
+                                             git_rev='HEAD', stop_rev=None,
+                                             packages=[], steps=0,
+                                             test=False, max_downstream=5, processes=1,
+                                             semantic_changes=False, impact=False, budget=None,
+                                             costs=None, low_memory=False,
+                                             condense_cycles=False)
+    cli.Dispatcher.assert_called_with(cli.compute_job_graph.return_value, threads=50,
+                                      fail_fast=False, journal=mocker.ANY, resume=False,
+                                      listeners=[cli.StatusBoard.return_value],
+                                      history=cli.DurationHistory.return_value,
+                                      result_cache=None)
+    assert cli.Dispatcher.call_args[1]['journal'].path == '.cgci_journal'
+    cli.DurationHistory.assert_called_with('.cgci_history.json')
+
+
+@pytest.mark.parametrize("flags", (['--fail-fast'], ['--resume'], ['--pipelined'],
+                                   ['--result-cache', 'results.json'],
+                                   ['--fuse-tests', '600'],
+                                   ['--scheduler', 'native', '--pipelined', '--fuse-tests', '60']))
+def test_native_only_flags_require_native_scheduler(flags):
+    with pytest.raises(ValueError):
+        cli.build_cli([test_data_dir] + flags)
+
+
+def test_pipelined(mocker):
+    args = [test_data_dir, '--scheduler', 'native', '--pipelined']
+    mocker.patch.object(cli, 'compute_job_graph')
+    mocker.patch.object(cli, 'stream_job_graph')
+    mocker.patch.object(cli, 'Dispatcher')
+    mocker.patch.object(cli, 'StatusBoard')
+    mocker.patch.object(cli, 'DurationHistory')
+    cli.Dispatcher.return_value.run.return_value = {'a': 'success'}
+    cli.Dispatcher.return_value.runner_hours_saved.return_value = None
+    assert cli.build_cli(args) == 0
+    assert not cli.compute_job_graph.called
+    cli.stream_job_graph.assert_called_with(test_data_dir, filter_dirty=True,
+                                            git_rev='HEAD', stop_rev=None,
+                                            packages=[], steps=0,
+                                            test=False, max_downstream=5, processes=1,
+                                            semantic_changes=False, impact=False, budget=None,
+                                            costs=None, low_memory=False,
+                                            condense_cycles=False)
+    # dispatch starts from an empty graph, and takes jobs from the stream
+    assert not len(cli.Dispatcher.call_args[0][0])
+    cli.Dispatcher.return_value.run.assert_called_with(
+        more_jobs=cli.stream_job_graph.return_value)
+
+
+def test_plan_only_prints_summary(mocker):
+    args = [test_data_dir, '--plan']
+    mocker.patch.object(cli, 'compute_job_graph')
+    mocker.patch.object(cli, 'summarize_plan', return_value="3 jobs")
+    mocker.patch.object(cli, 'Dispatcher')
+    mocker.patch.object(cli, 'get_dask_outputs')
+    assert cli.build_cli(args) == 0
+    cli.summarize_plan.assert_called_with(cli.compute_job_graph.return_value)
+    assert not cli.Dispatcher.called
+    assert not cli.get_dask_outputs.called
+
+
+def test_batch_pipeline(mocker):
+    args = [test_data_dir, '--batch-pipeline']
+    mocker.patch.object(cli, 'compute_job_graph')
+    mocker.patch.object(cli, 'dispatch_pipeline')
+    mocker.patch.object(cli, 'Dispatcher')
+    cli.dispatch_pipeline.return_value = 'success'
+    assert cli.build_cli(args) == 0
+    cli.dispatch_pipeline.assert_called_with(cli.compute_job_graph.return_value,
+                                             path='cgci_pipeline.yml')
+    assert not cli.Dispatcher.called
+    cli.dispatch_pipeline.return_value = 'failed'
+    assert cli.build_cli(args) == 1
+
+
+def test_plan_shard_writes_plan(mocker):
+    args = [test_data_dir, '--plan-shard', '1/3', '--plan-output', 'out.json']
+    mocker.patch.object(cli, 'plan_shard')
+    mocker.patch.object(cli, 'write_shard')
+    assert cli.build_cli(args) == 0
+    assert cli.plan_shard.call_args[0] == (test_data_dir, 1, 3)
+    cli.write_shard.assert_called_with(cli.plan_shard.return_value, 'out.json')
+
+
+def test_merge_plans_skips_planning(mocker):
+    args = [test_data_dir, '--merge-plans', 'a.json', 'b.json', '--scheduler', 'native']
+    mocker.patch.object(cli, 'read_shard')
+    mocker.patch.object(cli, 'merge_shards')
+    mocker.patch.object(cli, 'compute_job_graph')
+    mocker.patch.object(cli, 'Dispatcher')
+    mocker.patch.object(cli, 'StatusBoard')
+    mocker.patch.object(cli, 'DurationHistory')
+    cli.Dispatcher.return_value.run.return_value = {'a': 'success'}
+    cli.Dispatcher.return_value.runner_hours_saved.return_value = None
+    assert cli.build_cli(args) == 0
+    assert not cli.compute_job_graph.called
+    assert cli.Dispatcher.call_args[0] == (cli.merge_shards.return_value, )
@@ -1,5 +1,7 @@
 import os
+import subprocess
 
+import networkx as nx
 import pytest
 from pytest_mock import mocker
 
@@ -25,6 +27,27 @@ def test_get_run_test_deps(testing_metadata):
             {'run_requirement': "1.0", 'test_requirement': ""})
 
 
+def test_parse_requirement():
+    parse = conda_gitlab_ci.compute_build_graph.parse_requirement
+    assert parse('numpy') == ('numpy', '')
+    assert parse('numpy  1.11') == ('numpy', '1.11')
+    # build strings are kept as part of the constraint
+    assert parse('numpy 1.11 py27_0') == ('numpy', '1.11 py27_0')
+    assert parse('numpy 1.11 py27_0') is parse('numpy 1.11 py27_0')
+
+
+def test_deps_to_version_dict():
+    deps = ['python 2.7*', 'numpy 1.11 py27_0', 'zlib']
+    assert conda_gitlab_ci.compute_build_graph._deps_to_version_dict(deps) == {
+        'python': '2.7*', 'numpy': '1.11 py27_0', 'zlib': ''}
+
+
+def test_match_spec_cached():
+    match_spec = conda_gitlab_ci.compute_build_graph._match_spec
+    assert match_spec('numpy', '1.11 py27_0') is match_spec('numpy', '1.11 py27_0')
+    assert match_spec('numpy', '1.11') is not match_spec('numpy', '1.11 py27_0')
+
+
 def test_construct_graph():
     g = conda_gitlab_ci.compute_build_graph.construct_graph(graph_data_dir, 'some_os', 'somearch',
                                                             folders=('b'))
@@ -67,6 +90,37 @@ def test_platform_specific_graph():
     assert set(g.edges()) == set([('a', 'd'), ('a', 'c'), ('b', 'c'), ('c', 'd')])
 
 
+def test_variant_requirements():
+    recipe = os.path.join(test_data_dir, 'variant_dependencies')
+    requirements = conda_gitlab_ci.compute_build_graph.variant_requirements
+    assert requirements(recipe, 'linux', 64, {'CONDA_PY': '2.7'}) == set(['python', 'futures'])
+    assert requirements(recipe, 'linux', 64, {'CONDA_PY': '3.5'}) == set(['python', 'typing'])
+
+
+def test_variant_requirements_cached(mocker):
+    def render(recipe_dir, platform, bits):
+        pkg = mocker.Mock()
+        # requirements that depend on the python the recipe is rendered with
+        py = os.environ.get('CONDA_PY')
+        pkg.get_value.side_effect = lambda path: (['python', 'futures' if py == '2.7' else
+                                                   'typing'] if path == 'requirements/build'
+                                                  else [])
+        return pkg, None, None
+
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph.api, 'render', side_effect=render)
+    mocker.patch.dict(conda_gitlab_ci.compute_build_graph._RENDERED, clear=True)
+    requirements = conda_gitlab_ci.compute_build_graph.variant_requirements
+    for _ in range(2):
+        assert requirements('/recipes/a', 'linux', 64, {'CONDA_PY': '2.7'},
+                            key='tree1') == set(['python', 'futures'])
+        assert requirements('/recipes/a', 'linux', 64, {'CONDA_PY': '3.5'},
+                            key='tree1') == set(['python', 'typing'])
+    # once for each set of variables
+    assert conda_gitlab_ci.compute_build_graph.api.render.call_count == 2
+    requirements('/recipes/a', 'linux', 64, {'CONDA_PY': '2.7'}, key='tree2')
+    assert conda_gitlab_ci.compute_build_graph.api.render.call_count == 3
+
+
 def test_run_test_graph():
     g = conda_gitlab_ci.compute_build_graph.construct_graph(graph_data_dir, 'some_os', 'somearch',
                                                             folders=('d'), deps_type='run_test')
@@ -101,6 +155,91 @@ def test_git_changed_recipes_rev_range(testing_git_repo):
             ['test_dir_1', 'test_dir_2'])
 
 
+def _fake_rendered_build_inputs(recipe_dir, platform, bits):
+    # stands in for rendering: comments and blank lines don't make it into the metadata
+    with open(os.path.join(recipe_dir, 'meta.yaml')) as f:
+        return [line.rstrip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def test_git_changed_recipes_semantic(mocker, testing_git_repo):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph, '_rendered_build_inputs',
+                        side_effect=_fake_rendered_build_inputs)
+    # a comment in one recipe, a README in another, a build script in the third
+    with open(os.path.join('test_dir_1', 'meta.yaml'), 'a') as f:
+        f.write('# just a comment\n')
+    with open(os.path.join('test_dir_2', 'README.md'), 'w') as f:
+        f.write('docs')
+    with open(os.path.join('test_dir_3', 'build.sh'), 'w') as f:
+        f.write('make install')
+    subprocess.check_call(['git', 'add', '.'])
+    subprocess.check_call(['git', 'commit', '-m', 'commit 5'])
+    changed = conda_gitlab_ci.compute_build_graph.git_changed_recipes
+    assert sorted(changed('HEAD')) == ['test_dir_1', 'test_dir_2', 'test_dir_3']
+    assert changed('HEAD', semantic=True) == ['test_dir_3']
+
+    # a real change to the recipe
+    with open(os.path.join('test_dir_1', 'meta.yaml'), 'a') as f:
+        f.write('build:\n  number: 1\n')
+    subprocess.check_call(['git', 'commit', '-am', 'commit 6'])
+    assert changed('HEAD', semantic=True) == ['test_dir_1']
+    # a range that adds a recipe: nothing to compare it to
+    assert changed('HEAD~5', 'HEAD~3', semantic=True) == ['test_dir_1', 'test_dir_2']
+
+
+def test_render_cached_by_tree_hash(mocker):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph.api, 'render',
+                        side_effect=lambda *args, **kwargs: (object(), None, None))
+    mocker.patch.dict(conda_gitlab_ci.compute_build_graph._RENDERED, clear=True)
+    render = conda_gitlab_ci.compute_build_graph._render
+    first = render('/recipes/a', 'linux', 64, key='tree1')
+    assert render('/recipes/a', 'linux', 64, key='tree1') is first
+    # another platform, changed contents, or no way to tell: rendered again
+    assert render('/recipes/a', 'win', 64, key='tree1') is not first
+    assert render('/recipes/a', 'linux', 64, key='tree2') is not first
+    assert render('/recipes/a', 'linux', 64) is not render('/recipes/a', 'linux', 64)
+    assert conda_gitlab_ci.compute_build_graph.api.render.call_count == 5
+
+
+def test_forget_renderings(mocker):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph.api, 'render',
+                        side_effect=lambda *args, **kwargs: (object(), None, None))
+    mocker.patch.dict(conda_gitlab_ci.compute_build_graph._RENDERED, clear=True)
+    render = conda_gitlab_ci.compute_build_graph._render
+    linux = render('/recipes/a', 'linux', 64, key='tree1')
+    win = render('/recipes/a', 'win', 64, key='tree1')
+    conda_gitlab_ci.compute_build_graph.forget_renderings('linux', 64)
+    assert render('/recipes/a', 'linux', 64, key='tree1') is not linux
+    assert render('/recipes/a', 'win', 64, key='tree1') is win
+    conda_gitlab_ci.compute_build_graph.forget_renderings()
+    assert not conda_gitlab_ci.compute_build_graph._RENDERED
+
+
+def test_input_hashes():
+    def graph(a_key='tree-a', b_key='tree-b'):
+        # c depends on b depends on a; d comes from the package index
+        g = nx.DiGraph()
+        for node, key in (('a', a_key), ('b', b_key), ('c', 'tree-c')):
+            g.add_node(node, recipe='/recipes/' + node, content_key=key)
+        g.add_node('d', meta={'version': '1.0'})
+        g.add_edges_from([('b', 'a'), ('c', 'b'), ('c', 'd')])
+        return g
+
+    input_hashes = conda_gitlab_ci.compute_build_graph.input_hashes
+    hashes = input_hashes(graph())
+    assert hashes == input_hashes(graph())
+    # a change to a reaches everything that depends on it
+    changed = input_hashes(graph(a_key='tree-a2'))
+    assert all(changed[node] != hashes[node] for node in 'abc')
+    assert changed['d'] == hashes['d']
+    changed = input_hashes(graph(b_key='tree-b2'))
+    assert changed['a'] == hashes['a']
+    assert changed['c'] != hashes['c']
+    # uncommitted changes to b: b and c can't be cached
+    unknown = input_hashes(graph(b_key=None))
+    assert unknown['a'] == hashes['a']
+    assert unknown['b'] is None and unknown['c'] is None
+
+
 def test_upstream_dependencies_needing_build(mocker, testing_graph, testing_conda_resolve):
     mocker.patch.object(conda_gitlab_ci.compute_build_graph, '_installable')
     conda_gitlab_ci.compute_build_graph._installable.return_value = False
@@ -112,6 +251,21 @@ def test_upstream_dependencies_needing_build(mocker, testing_graph, testing_cond
                                                                         'b': build_dict}
 
 
+def test_upstream_dependencies_checked_once(mocker, testing_graph, testing_conda_resolve):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph, '_installable')
+    conda_gitlab_ci.compute_build_graph._installable.return_value = True
+    # c and d both depend on a now
+    testing_graph.add_edge('d', 'a')
+    for node in ('c', 'd'):
+        testing_graph.node[node]['build'] = True
+    conda_gitlab_ci.compute_build_graph.upstream_dependencies_needing_build(
+        testing_graph, testing_conda_resolve)
+    calls = conda_gitlab_ci.compute_build_graph._installable.call_args_list
+    assert sorted(call[0][0] for call in calls) == ['a', 'b', 'c']
+    filters = set(id(call[1]['filter']) for call in calls)
+    assert len(filters) == 1
+
+
 def test_buildable(monkeypatch):
     monkeypatch.chdir(test_data_dir)
     assert conda_gitlab_ci.compute_build_graph._buildable('somepackage', "")
@@ -120,6 +274,28 @@ def test_buildable(monkeypatch):
     assert not conda_gitlab_ci.compute_build_graph._buildable('not_a_package', "5.2.9")
 
 
+def test_buildable_looks_up_recipe_by_name(testing_git_repo, mocker):
+    index = conda_gitlab_ci.compute_build_graph.recipe_index(testing_git_repo)
+    index.record_name('test_dir_1', 'one')
+    index.record_name('test_dir_2', 'two')
+    metadata = mocker.Mock()
+    metadata.name.return_value = 'two'
+    metadata.version.return_value = '1.0'
+    metadata.build_number.return_value = 0
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph.api, 'render',
+                        return_value=(metadata, None, None))
+    mocker.patch.object(index, 'update')
+    buildable = conda_gitlab_ci.compute_build_graph._buildable
+    assert buildable('two', '1.0', index=index)
+    # only the recipe that makes the package is rendered
+    conda_gitlab_ci.compute_build_graph.api.render.assert_called_once_with(
+        os.path.join(testing_git_repo, 'test_dir_2'))
+    assert not buildable('three', index=index)
+    assert conda_gitlab_ci.compute_build_graph.api.render.call_count == 1
+    # the index construct_graph brought up to date is used as it is, without asking git again
+    assert not index.update.called
+
+
 def test_installable(testing_conda_resolve):
     assert conda_gitlab_ci.compute_build_graph._installable('a', "920", testing_conda_resolve)
     assert not conda_gitlab_ci.compute_build_graph._installable('a', "921", testing_conda_resolve)
@@ -168,6 +344,94 @@ def test_expand_run_all_steps_down_with_max(mocker, testing_graph, testing_conda
     assert dirty == {'b': build_dict, 'c': build_dict}
 
 
+def test_expand_run_impact(mocker):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph, 'upstream_dependencies_needing_build')
+    g = nx.DiGraph()
+    g.add_node('a', build=True, recipe='/recipes/a',
+               meta={'version': '2.0', 'build': 0, 'build_depends': {}, 'run_test_depends': {}})
+    # b takes any a; c takes a 2.0 or newer; d pins an older a, and e only depends on d
+    for node, constraint in (('b', ''), ('c', '>=2.0'), ('d', '1.*'), ('e', None)):
+        depends = {'a': constraint} if constraint is not None else {'d': ''}
+        g.add_node(node, build=False, recipe='/recipes/' + node,
+                   meta={'version': '1.0', 'build': 0, 'build_depends': depends,
+                         'run_test_depends': {}})
+    g.add_edges_from([('b', 'a'), ('c', 'a'), ('d', 'a'), ('e', 'd')])
+    dirty = conda_gitlab_ci.compute_build_graph.expand_run(g, None, 'build', steps=-1,
+                                                           max_downstream=-1, impact=True)
+    assert set(dirty) == set(['a', 'b', 'c'])
+
+
+def test_expand_run_impact_uses_requirements_of_run(mocker):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph, 'upstream_dependencies_needing_build')
+
+    def graph(run):
+        g = nx.DiGraph()
+        g.add_node('a', recipe='/recipes/a',
+                   meta={'version': '2.0', 'build': 0, 'build_depends': {},
+                         'run_test_depends': {}}, **{run: True})
+        # b builds with an old a, but runs and is tested with any a
+        g.add_node('b', recipe='/recipes/b',
+                   meta={'version': '1.0', 'build': 0, 'build_depends': {'a': '1.*'},
+                         'run_test_depends': {'a': ''}})
+        g.add_edge('b', 'a')
+        return g
+    expand_run = conda_gitlab_ci.compute_build_graph.expand_run
+    assert set(expand_run(graph('build'), None, 'build', steps=-1, max_downstream=-1,
+                          impact=True)) == set(['a'])
+    assert set(expand_run(graph('test'), None, 'test', steps=-1, max_downstream=-1,
+                          impact=True)) == set(['a', 'b'])
+    # the same with a budget
+    assert set(expand_run(graph('build'), None, 'build', steps=-1, impact=True,
+                          budget=60)) == set(['a'])
+    assert set(expand_run(graph('test'), None, 'test', steps=-1, impact=True,
+                          budget=60)) == set(['a', 'b'])
+
+
+def test_expand_run_budget(mocker):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph, 'upstream_dependencies_needing_build')
+    g = nx.DiGraph()
+    g.add_node('a', build=True)
+    for node in 'bcde':
+        g.add_node(node, build=False)
+    # b, c and d depend on a; e depends on b, so b covers the most
+    g.add_edges_from([('b', 'a'), ('c', 'a'), ('d', 'a'), ('e', 'b')])
+    costs = {'b': 600, 'c': 60, 'd': 900, 'e': 60}
+    dirty = conda_gitlab_ci.compute_build_graph.expand_run(g, None, 'build', steps=1,
+                                                           budget=12, costs=costs)
+    # c is cheapest for its coverage, then b; d doesn't fit in what is left, and e is 2 steps
+    assert set(dirty) == set(['a', 'b', 'c'])
+
+
+def test_select_within_budget_counts_each_configuration():
+    g = nx.DiGraph()
+    g.add_edges_from([('b', 'a'), ('c', 'a')])
+    select = conda_gitlab_ci.compute_build_graph.select_within_budget
+    # b's jobs take a minute, but it has 8 python/numpy variants: 8 minutes in all
+    assert select(g, ['b', 'c'], 5, costs={'b': 60, 'c': 120}) == ['b', 'c']
+    assert select(g, ['b', 'c'], 5, costs={'b': 60, 'c': 120}, job_counts={'b': 8}) == ['c']
+
+
+def test_expand_run_budget_counts_jobs(mocker):
+    mocker.patch.object(conda_gitlab_ci.compute_build_graph, 'upstream_dependencies_needing_build')
+    g = nx.DiGraph()
+    g.add_node('a', build=True)
+    g.add_node('b', build=False)
+    g.add_edge('b', 'a')
+    dirty = conda_gitlab_ci.compute_build_graph.expand_run(
+        g, None, 'build', steps=1, budget=5, costs={'b': 60},
+        job_count=lambda package: {'b': 8}[package])
+    assert set(dirty) == set(['a'])
+
+
+def test_select_within_budget_defaults_to_mean_cost():
+    g = nx.DiGraph()
+    g.add_edges_from([('b', 'a'), ('c', 'a'), ('d', 'a')])
+    select = conda_gitlab_ci.compute_build_graph.select_within_budget
+    # d has no history, so is expected to take the mean of b and c: 5 minutes
+    assert select(g, ['b', 'c', 'd'], 7, costs={'b': 120, 'c': 480}) == ['b', 'd']
+    assert select(g, ['b', 'c', 'd'], 0) == []
+
+
 def test_expand_raises_when_neither_installable_or_buildable(mocker, testing_graph,
                                                              testing_conda_resolve):
     mocker.patch.object(conda_gitlab_ci.compute_build_graph, '_installable')
@@ -203,11 +467,61 @@ def test_order_build_no_filter(testing_graph):
         conda_gitlab_ci.compute_build_graph.order_build(testing_graph, filter_dirty=False)
 
 
+def test_order_build_condense_cycles(testing_graph):
+    order_build = conda_gitlab_ci.compute_build_graph.order_build
+    acyclic_requirements = conda_gitlab_ci.compute_build_graph.acyclic_requirements
+    # a, b and c require each other in a cycle
+    testing_graph.add_edge('a', 'c')
+    with pytest.raises(ValueError):
+        order_build(testing_graph, filter_dirty=False)
+    g, order = order_build(testing_graph, filter_dirty=False, condense_cycles=True)
+    assert order == ['a', 'b', 'c', 'd', 'e']
+    assert g.graph['cycles']['b'] == ['a', 'b', 'c']
+    assert 'cycles' not in testing_graph.graph
+    # the cycle is done one package after the other; d still waits on c as usual
+    assert [acyclic_requirements(g, node, list(g.successors(node))) for node in order] == [
+        [], ['a'], ['b'], ['c'], ['d']]
+
+
+def test_acyclic_requirements_wait_on_whole_cycle(testing_graph):
+    acyclic_requirements = conda_gitlab_ci.compute_build_graph.acyclic_requirements
+    # a, b and c require each other in a cycle, and f requires only a, its first package
+    testing_graph.add_edge('a', 'c')
+    testing_graph.add_node('f')
+    testing_graph.add_edge('f', 'a')
+    g, order = conda_gitlab_ci.compute_build_graph.order_build(testing_graph,
+                                                               filter_dirty=False,
+                                                               condense_cycles=True)
+    assert g.graph['cycles']['a'] == ['a', 'b', 'c']
+    # f waits until c, the last of the cycle, is done
+    assert acyclic_requirements(g, 'f', ['a']) == ['a', 'c']
+    assert order.index('f') > order.index('c')
+
+
 def test_order_build(testing_graph):
     g, order = conda_gitlab_ci.compute_build_graph.order_build(testing_graph)
     assert order == ['b']
 
 
+def test_input_hashes_with_cycle():
+    def graph(a_key='tree-a'):
+        # a and b require each other; c depends on b
+        g = nx.DiGraph()
+        for node, key in (('a', a_key), ('b', 'tree-b'), ('c', 'tree-c')):
+            g.add_node(node, recipe='/recipes/' + node, content_key=key)
+        g.add_edges_from([('a', 'b'), ('b', 'a'), ('c', 'b')])
+        return g
+
+    input_hashes = conda_gitlab_ci.compute_build_graph.input_hashes
+    hashes = input_hashes(graph())
+    assert hashes == input_hashes(graph())
+    assert hashes['a'] != hashes['b']
+    # a change to either package of the cycle changes both, and what depends on them
+    changed = input_hashes(graph(a_key='tree-a2'))
+    assert all(changed[node] != hashes[node] for node in 'abc')
+    assert set(input_hashes(graph(a_key=None)).values()) == set([None])
+
+
 def test_get_base_folders(testing_workdir):
     make_recipe('some_recipe')
     os.makedirs('not_a_recipe')
@@ -0,0 +1,42 @@
+import os
+import pickle
+
+import pytest
+
+from conda_gitlab_ci import config
+
+from .utils import testing_workdir
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_load_yaml_frozen(testing_workdir):
+    write('versions.yml', 'CONDA_PY:\n  - "2.7"\n  - "3.5"\n')
+    data = config.load_yaml('versions.yml')
+    assert data == {'CONDA_PY': ('2.7', '3.5')}
+    with pytest.raises(TypeError):
+        data['CONDA_NPY'] = ('1.11', )
+    with pytest.raises(TypeError):
+        data.update(CONDA_NPY=('1.11', ))
+    assert pickle.loads(pickle.dumps(data)) == data
+    assert isinstance(pickle.loads(pickle.dumps(data)), config.FrozenDict)
+
+
+def test_load_yaml_cached(testing_workdir, mocker):
+    write('versions.yml', 'CONDA_PY:\n  - "2.7"\n')
+    mocker.spy(config.yaml, 'load')
+    first = config.load_yaml('versions.yml')
+    assert config.load_yaml(os.path.abspath('versions.yml')) is first
+    # touched, but the same contents: not parsed again
+    stat = os.stat('versions.yml')
+    os.utime('versions.yml', (stat.st_atime, stat.st_mtime + 10))
+    assert config.load_yaml('versions.yml') is first
+    assert config.yaml.load.call_count == 1
+
+    write('versions.yml', 'CONDA_PY:\n  - "3.5"\n')
+    os.utime('versions.yml', (stat.st_atime, stat.st_mtime + 20))
+    assert config.load_yaml('versions.yml') == {'CONDA_PY': ('3.5', )}
+    assert config.yaml.load.call_count == 2
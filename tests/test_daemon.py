@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+from pytest_mock import mocker
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen, Request
+
+from conda_gitlab_ci import build_matrix, compute_build_graph, daemon, execute
+from conda_gitlab_ci.git_history import resolve_rev
+from .utils import make_jobs, test_data_dir, testing_git_repo, testing_workdir
+
+
+def job(configuration, dependencies, commit_sha=None, **kwargs):
+    return commit_sha
+
+
+def wait_until_done(service, dispatch_id):
+    for _ in range(100):
+        status = service.status(dispatch_id)
+        if status['state'] != 'running':
+            return status
+        time.sleep(0.05)
+    raise AssertionError("dispatch did not finish")
+
+
+def test_dispatch(mocker):
+    mocker.patch.object(daemon, 'compute_job_graph', return_value=make_jobs(nodes=['a', 'b']))
+    service = daemon.PlanningService('.', job_function=job)
+    status = service.dispatch({'git_rev': 'abc', 'packages': ['a']})
+    assert status['id'] == '1'
+    assert status['jobs'] == 2
+    status = wait_until_done(service, '1')
+    assert status['state'] == 'done'
+    assert status['statuses'] == {'a': 'success', 'b': 'success'}
+    kwargs = daemon.compute_job_graph.call_args[1]
+    assert kwargs['git_rev'] == 'abc'
+    assert kwargs['packages'] == ['a']
+    # packages were given: only those are built
+    assert kwargs['filter_dirty']
+    assert kwargs['indexes'] is service.indexes
+    assert service.status('2') is None
+
+
+def test_indexes_kept_between_requests(mocker):
+    mocker.patch.object(daemon, 'compute_job_graph', return_value=make_jobs())
+    mocker.patch.object(daemon, 'get_index', return_value={})
+    mocker.patch.object(daemon, 'Resolve', return_value='new resolve')
+    service = daemon.PlanningService('.', index_ttl=60, job_function=job)
+    service.plan(dict(daemon.REQUEST_FIELDS))
+    service.indexes['linux-64'] = 'resolve'
+    service.plan(dict(daemon.REQUEST_FIELDS))
+    assert service.indexes == {'linux-64': 'resolve'}
+    assert not daemon.get_index.called
+    # too old: loaded again, and replaced only once it is loaded
+    service._indexes_loaded['linux-64'] -= 61
+    service.plan(dict(daemon.REQUEST_FIELDS))
+    assert service.indexes == {'linux-64': 'new resolve'}
+    daemon.get_index.assert_called_once_with(platform='linux-64')
+    assert daemon.compute_job_graph.call_args[1]['indexes'] is service.indexes
+
+
+class FakeMetadata(object):
+    """Just enough of a rendered recipe for planning"""
+    def __init__(self, recipe_dir, requirements):
+        self._name = os.path.basename(recipe_dir)
+        self.meta = {'package': {'name': self._name, 'version': '1.0'},
+                     'requirements': {'build': requirements.get(self._name, []),
+                                      'run': ['python']}}
+
+    def name(self):
+        return self._name
+
+    def skip(self):
+        return False
+
+    def get_value(self, field, default=None):
+        section, key = field.split('/')
+        return self.meta.get(section, {}).get(key, default)
+
+
+def test_second_request_renders_nothing(mocker, testing_git_repo):
+    for run in ('build', 'test'):
+        os.makedirs(run + '_platforms.d')
+        with open(os.path.join(run + '_platforms.d', 'linux.yml'), 'w') as f:
+            f.write('platform: linux\narch: 64\nworker_label: linux\n')
+    shutil.copy(os.path.join(test_data_dir, 'versions.yml'), 'versions.yml')
+    subprocess.check_call(['git', 'add', 'build_platforms.d', 'test_platforms.d',
+                           'versions.yml'])
+    subprocess.check_call(['git', 'commit', '-m', 'platforms'])
+    requirements = {'test_dir_2': ['test_dir_1'], 'test_dir_3': ['test_dir_2']}
+
+    def render(recipe_dir, **kwargs):
+        return FakeMetadata(recipe_dir, requirements), None, None
+    mocker.patch.object(compute_build_graph.api, 'render', side_effect=render)
+    mocker.patch.object(build_matrix, 'render', side_effect=render)
+    mocker.patch.object(execute, 'get_index', return_value={})
+    mocker.patch.object(execute, 'Resolve')
+    service = daemon.PlanningService(testing_git_repo, job_function=job)
+    request = dict(daemon.REQUEST_FIELDS, packages=['test_dir_2'])
+    jobs = service.plan(request)
+    # a build of test_dir_2 for each python
+    assert len(jobs) == 2
+    assert compute_build_graph.api.render.called
+    assert build_matrix.render.called
+    compute_build_graph.api.render.reset_mock()
+    build_matrix.render.reset_mock()
+    assert sorted(service.plan(request).nodes()) == sorted(jobs.nodes())
+    assert not compute_build_graph.api.render.called
+    assert not build_matrix.render.called
+
+
+def test_fetch_plans_the_remote_branches(mocker, testing_git_repo):
+    branch = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD']).decode().strip()
+    subprocess.check_call(['git', 'clone', '-q', testing_git_repo, 'clone'])
+    # a new commit on the remote, which the clone's own branch won't have
+    with open('sample_file', 'w') as f:
+        f.write('new')
+    subprocess.check_call(['git', 'commit', '-qam', 'new'])
+    sha = subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    mocker.patch.object(daemon, 'compute_job_graph', return_value=make_jobs())
+    service = daemon.PlanningService('clone', fetch='origin', job_function=job)
+    service.plan(dict(daemon.REQUEST_FIELDS, git_rev=branch + '~1', stop_rev=branch))
+    kwargs = daemon.compute_job_graph.call_args[1]
+    assert kwargs['git_rev'] == 'origin/{0}~1'.format(branch)
+    assert kwargs['stop_rev'] == 'origin/' + branch
+    assert resolve_rev('clone', kwargs['stop_rev']) == sha
+    # SHAs, and the working copy's HEAD, are planned as they are
+    service.plan(dict(daemon.REQUEST_FIELDS, git_rev=sha))
+    assert daemon.compute_job_graph.call_args[1]['git_rev'] == sha
+    service.plan(dict(daemon.REQUEST_FIELDS))
+    assert daemon.compute_job_graph.call_args[1]['git_rev'] == 'HEAD'
+
+
+def test_unknown_request_fields(mocker):
+    mocker.patch.object(daemon, 'compute_job_graph')
+    service = daemon.PlanningService('.', job_function=job)
+    with pytest.raises(ValueError):
+        service.dispatch({'git_revision': 'abc'})
+    assert not daemon.compute_job_graph.called
+
+
+def test_http_api(mocker):
+    mocker.patch.object(daemon, 'compute_job_graph', return_value=make_jobs(nodes=['a']))
+    server = daemon.DaemonServer(('127.0.0.1', 0),
+                                 daemon.PlanningService('.', job_function=job))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    try:
+        response = urlopen(Request(url + '/dispatches', data=b'{"git_rev": "abc"}'))
+        assert response.getcode() == 202
+        assert json.loads(response.read().decode('utf-8'))['id'] == '1'
+        wait_until_done(server.service, '1')
+        status = json.loads(urlopen(url + '/dispatches/1').read().decode('utf-8'))
+        assert status['statuses'] == {'a': 'success'}
+        assert len(json.loads(urlopen(url + '/dispatches').read().decode('utf-8'))) == 1
+        assert b'# TYPE cgci_jobs_submitted_total counter' in urlopen(url + '/metrics').read()
+        with pytest.raises(HTTPError) as e:
+            urlopen(Request(url + '/dispatches', data=b'{"nope": 1}'))
+        assert e.value.code == 400
+        with pytest.raises(HTTPError) as e:
+            urlopen(url + '/dispatches/2')
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,9 +1,11 @@
+import os
 import time
 
 from conda_gitlab_ci import execute
 import conda_gitlab_ci
 
 from distributed import LocalCluster, Client, progress
+import networkx as nx
 import pytest
 from pytest_mock import mocker
 
@@ -36,6 +38,53 @@ def test_job(mocker):
         ret = execute._job('something', None, commit_sha='abc')
 
 
+def test_job_notifies_status_changes(mocker):
+    mocker.patch.object(execute, 'submit_job')
+    mocker.patch.object(execute, 'check_job_status')
+    execute.submit_job.return_value = 7
+    execute.check_job_status.side_effect = ['pending', 'running', 'running', 'success']
+    notify = mocker.Mock()
+    execute._job('something', None, commit_sha='abc', sleep_interval=0, notify=notify)
+    assert notify.call_args_list == [mocker.call('submitted', 7), mocker.call('pending', 7),
+                                     mocker.call('running', 7), mocker.call('success', 7)]
+
+
+def test_job_waits_on_every_unfinished_status(mocker):
+    mocker.patch.object(execute, 'submit_job')
+    mocker.patch.object(execute, 'check_job_status')
+    mocker.patch.object(execute, 'sleep')
+    waiting = ['created', 'waiting_for_resource', 'preparing', 'scheduled', 'manual', 'pending']
+    execute.check_job_status.side_effect = waiting + ['running', 'success']
+    execute._job('something', None, commit_sha='abc', run_timeout=1)
+    # a sleep between each check; only running counts towards the timeout
+    assert execute.sleep.call_count == len(waiting) + 1
+
+
+def test_job_records_metrics(mocker):
+    mocker.patch.object(execute, 'submit_job')
+    mocker.patch.object(execute, 'check_job_status')
+    execute.check_job_status.side_effect = ['pending', 'running', 'success']
+    execute.metrics.registry.reset()
+    configuration = {'variables': {'TARGET_PLATFORM': ('linux', )}}
+    execute._job(configuration, None, commit_sha='abc', sleep_interval=0,
+                 ready_time=time.time())
+    snapshot = execute.metrics.registry.snapshot()
+    assert snapshot['jobs_submitted_by_label'] == {'linux': 1}
+    assert snapshot['ready_to_trigger_seconds']['count'] == 1
+    assert ([(x['state'], x['count']) for x in snapshot['state_seconds']] ==
+            [('pending', 1), ('running', 1)])
+    assert snapshot['jobs_finished'] == [{'worker_label': 'linux', 'status': 'success',
+                                          'count': 1}]
+
+
+def test_job_canceled(mocker):
+    mocker.patch.object(execute, 'submit_job')
+    mocker.patch.object(execute, 'check_job_status')
+    execute.check_job_status.return_value = 'canceled'
+    with pytest.raises(Exception):
+        execute._job('something', None, commit_sha='abc')
+
+
 def test_job_passthrough():
     ret = execute._job({'something': 123}, None, passthrough=True)
     assert ret == {'something': 123}
@@ -72,3 +121,384 @@ def test_get_dask_outputs(mocker, testing_graph, testing_conda_resolve):
     execute.delayed = lambda x, pure: x
     conda_gitlab_ci.compute_build_graph._installable.return_value = True
     execute.get_dask_outputs(test_data_dir)
+
+
+def _job_data(run, test_mode, recipe='a'):
+    return dict(configuration={'variables': {'BUILD_RECIPE': recipe, 'CONDA_PY': '2.7',
+                                             'TEST_MODE': test_mode}},
+                commit_sha='abc', run=run, package=recipe, worker_label='label')
+
+
+def test_coalesce_jobs_test_run_covered_by_tested_build():
+    jobs = nx.DiGraph()
+    jobs.add_node('build_a', **_job_data('build', '--test'))
+    jobs.add_node('test_a', **_job_data('test', '--no-test'))
+    jobs.add_node('test_b', **_job_data('test', '--no-test', recipe='b'))
+    jobs.add_edge('test_a', 'build_a')
+    jobs.add_edge('test_b', 'test_a')
+    assert execute.coalesce_jobs(jobs) == 1
+    assert set(jobs.nodes()) == set(['build_a', 'test_b'])
+    assert jobs.edges() == [('test_b', 'build_a')]
+
+
+def test_coalesce_jobs_keeps_dependencies_of_removed_job():
+    jobs = nx.DiGraph()
+    jobs.add_node('build_a', **_job_data('build', '--test'))
+    jobs.add_node('test_a', **_job_data('test', '--no-test'))
+    # test_a also needs c (e.g. a test requirement) and d, which itself waits for build_a
+    jobs.add_node('build_c', **_job_data('build', '--no-test', recipe='c'))
+    jobs.add_node('build_d', **_job_data('build', '--no-test', recipe='d'))
+    jobs.add_edges_from([('test_a', 'build_a'), ('test_a', 'build_c'), ('test_a', 'build_d'),
+                         ('build_d', 'build_a')])
+    assert execute.coalesce_jobs(jobs) == 1
+    assert sorted(jobs.edges()) == [('build_a', 'build_c'), ('build_d', 'build_a')]
+
+
+def test_coalesce_jobs_keeps_test_run_of_untested_build():
+    jobs = nx.DiGraph()
+    jobs.add_node('build_a', **_job_data('build', '--no-test'))
+    jobs.add_node('test_a', **_job_data('test', '--test'))
+    jobs.add_edge('test_a', 'build_a')
+    assert execute.coalesce_jobs(jobs) == 0
+    assert set(jobs.nodes()) == set(['build_a', 'test_a'])
+
+
+def test_merge_plans_counts_duplicates():
+    def job(key, package_key, dependencies=()):
+        return {'key': key, 'package_key': package_key, 'dependencies': list(dependencies),
+                'configuration': {'variables': {}}, 'run': 'build', 'package': package_key,
+                'worker_label': 'label'}
+    plans = [[job('build_a_label', 'build_a_label'),
+              job('build_b_label', 'build_b_label', ['build_a_label'])],
+             # second platform with the same worker label
+             [job('build_a_label', 'build_a_label')]]
+    plans[0][0]['matrix_eliminated'] = 2
+    plans[1][0]['matrix_eliminated'] = 2
+    jobs, duplicates = execute._merge_plans(plans, 'abc')
+    assert duplicates == 1
+    # the duplicate's configurations are the same ones, so are only counted once
+    assert jobs.graph['eliminated'] == 2
+    assert jobs.edges() == [('build_b_label', 'build_a_label')]
+    assert jobs.node['build_a_label']['commit_sha'] == 'abc'
+
+
+def test_summarize_plan():
+    jobs = nx.DiGraph()
+    jobs.add_node('build_a_linux', **dict(_job_data('build', '--no-test'), worker_label='linux'))
+    jobs.add_node('build_a_osx', **dict(_job_data('build', '--no-test'), worker_label='osx'))
+    jobs.add_node('test_a_osx', **dict(_job_data('test', '--test'), worker_label='osx'))
+    jobs.graph.update(eliminated=4, coalesced=1)
+    assert execute.summarize_plan(jobs).splitlines() == [
+        "3 jobs",
+        "  by run: 2 build, 1 test",
+        "  by worker label: 1 linux, 2 osx",
+        "4 configurations left out by versions.yml rules, 1 redundant jobs coalesced"]
+
+
+def _variant_job(package, dependencies=(), run='build', **variables):
+    package_key = '{0}_{1}_label'.format(run, package)
+    configuration = {'variables': dict(variables, BUILD_RECIPE=package, TEST_MODE='--no-test')}
+    return {'key': execute._configuration_key(package_key, configuration),
+            'package_key': package_key, 'dependencies': list(dependencies),
+            'configuration': configuration, 'run': run, 'package': package,
+            'worker_label': 'label'}
+
+
+def test_merge_plans_matches_variants():
+    plan = [_variant_job('a', CONDA_PY='2.7', CONDA_NPY='1.10'),
+            _variant_job('a', CONDA_PY='2.7', CONDA_NPY='1.11'),
+            _variant_job('a', CONDA_PY='3.5', CONDA_NPY='1.11'),
+            _variant_job('b', ['build_a_label'], CONDA_PY='2.7'),
+            _variant_job('b', ['build_a_label'], CONDA_PY='3.5'),
+            # no build of a for this python: wait on all of them
+            _variant_job('b', ['build_a_label'], CONDA_PY='3.6')]
+    jobs, _ = execute._merge_plans([plan], 'abc')
+    assert set(jobs.successors('build_b_label_CONDA_PY-2.7')) == set([
+        'build_a_label_CONDA_NPY-1.10_CONDA_PY-2.7', 'build_a_label_CONDA_NPY-1.11_CONDA_PY-2.7'])
+    assert jobs.successors('build_b_label_CONDA_PY-3.5') == [
+        'build_a_label_CONDA_NPY-1.11_CONDA_PY-3.5']
+    assert len(jobs.successors('build_b_label_CONDA_PY-3.6')) == 3
+
+
+def test_merge_plans_dependency_planned_later():
+    plan = [_variant_job('b', ['build_a_label'], CONDA_PY='2.7'),
+            _variant_job('a', CONDA_PY='2.7')]
+    jobs, _ = execute._merge_plans([plan], 'abc')
+    assert jobs.edges() == [('build_b_label_CONDA_PY-2.7', 'build_a_label_CONDA_PY-2.7')]
+
+
+def test_merge_plans_merges_dependencies_of_duplicates():
+    plans = [[_variant_job('a', CONDA_PY='2.7'),
+              _variant_job('c', ['build_a_label'], CONDA_PY='2.7')],
+             # the same job on another platform with this worker label needs b too
+             [_variant_job('b', CONDA_PY='2.7'),
+              _variant_job('c', ['build_a_label', 'build_b_label'], CONDA_PY='2.7')]]
+    jobs, duplicates = execute._merge_plans(plans, 'abc')
+    assert duplicates == 1
+    assert sorted(jobs.successors('build_c_label_CONDA_PY-2.7')) == [
+        'build_a_label_CONDA_PY-2.7', 'build_b_label_CONDA_PY-2.7']
+
+
+def test_jobs_from_plans_rejects_cycles():
+    plan = [_variant_job('a', ['build_b_label'], CONDA_PY='2.7'),
+            _variant_job('b', ['build_a_label'], CONDA_PY='2.7')]
+    with pytest.raises(ValueError):
+        execute.jobs_from_plans([plan], 'abc')
+
+
+def test_stream_job_graph(mocker):
+    mocker.patch.object(execute, 'checkout_git_rev')
+    # the revision resolves to a sha once the clone has it
+    execute.checkout_git_rev.return_value.__enter__.return_value = 'abc'
+    mocker.patch.object(execute, 'planning_units',
+                        return_value=[('build', 'linux'), ('build', 'osx')])
+    mocker.patch.object(execute, '_plan_platform',
+                        side_effect=lambda path, run, platform, **kwargs:
+                        [_variant_job('a_' + platform, CONDA_PY='2.7')])
+    graphs = list(execute.stream_job_graph('.', git_rev='HEAD'))
+    assert [sorted(graph.nodes()) for graph in graphs] == [
+        ['build_a_linux_label_CONDA_PY-2.7'],
+        ['build_a_linux_label_CONDA_PY-2.7', 'build_a_osx_label_CONDA_PY-2.7']]
+    assert graphs[-1].node['build_a_osx_label_CONDA_PY-2.7']['commit_sha'] == 'abc'
+    jobs = execute.compute_job_graph('.', git_rev='HEAD')
+    assert sorted(jobs.nodes()) == sorted(graphs[-1].nodes())
+
+
+def test_stream_job_graph_low_memory(mocker):
+    linux = {'platform': 'linux', 'arch': 64, 'worker_label': 'linux'}
+    osx = {'platform': 'osx', 'arch': 64, 'worker_label': 'osx'}
+    mocker.patch.object(execute, 'checkout_git_rev')
+    mocker.patch.object(execute, 'planning_units',
+                        return_value=[('build', linux), ('build', osx), ('test', linux),
+                                      ('test', osx)])
+
+    def plan_platform(path, run, platform, indexes=None, **kwargs):
+        key = execute._index_key(platform)
+        indexes.setdefault(key, object())
+        loaded.append(sorted(indexes))
+        return [_variant_job('a_' + platform['worker_label'], run=run, CONDA_PY='2.7')]
+
+    loaded = []
+    mocker.patch.object(execute, '_plan_platform', side_effect=plan_platform)
+    mocker.patch.object(execute, 'forget_renderings')
+    graphs = list(execute.stream_job_graph('.', git_rev='abc', low_memory=True))
+    # only the complete graph, planned one platform at a time
+    assert len(graphs) == 1
+    assert [call[0][2] for call in execute._plan_platform.call_args_list] == [linux, linux,
+                                                                                 osx, osx]
+    assert loaded == [['linux-64'], ['linux-64'], ['osx-64'], ['osx-64']]
+    assert execute.forget_renderings.call_args_list == [mocker.call('linux', 64),
+                                                        mocker.call('osx', 64)]
+    assert sorted(graphs[0].nodes()) == sorted(
+        execute.compute_job_graph('.', git_rev='abc').nodes())
+
+
+def test_merge_plans_shares_strings():
+    plans = [[_variant_job('a', CONDA_PY=''.join(['2', '.7']))],
+             [_variant_job('b', CONDA_PY=''.join(['2', '.7']))]]
+    jobs, _ = execute._merge_plans(plans, 'abc')
+    a, b = (jobs.node['build_{0}_label_CONDA_PY-2.7'.format(name)] for name in 'ab')
+    assert a['configuration']['variables']['CONDA_PY'] is b['configuration']['variables'][
+        'CONDA_PY']
+    assert a['worker_label'] is b['worker_label']
+
+
+def _synthetic_graph(n_recipes, platform, bits):
+    """A package graph of n_recipes recipes, each carrying about as much metadata as a
+    rendered recipe.  Most depend on one of the first 50."""
+    graph = nx.DiGraph()
+    for i in range(n_recipes):
+        name = 'recipe{0}'.format(i)
+        graph.add_node(name, meta={'requirements': ['dep{0} >=1.{1}'.format(j, i)
+                                                    for j in range(10)],
+                                   'about': 'x' * 200, 'platform': platform, 'bits': bits},
+                       dirty=True)
+        if i >= 50:
+            graph.add_edge(name, 'recipe{0}'.format(i % 50))
+    return graph
+
+
+@pytest.mark.parametrize('low_memory', (False, True))
+def test_low_memory_planning_peak(mocker, low_memory):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    n_recipes = 5000
+    index_bytes = 100 * 1024 * 1024
+    platforms = [{'platform': name, 'arch': 64, 'worker_label': name}
+                 for name in ('linux', 'osx', 'win')]
+    mocker.patch.object(execute, 'checkout_git_rev')
+    mocker.patch.object(execute, 'planning_units',
+                        return_value=[(run, platform) for run in ('build', 'test')
+                                      for platform in platforms])
+    # plain functions rather than mocks, which would hold on to the graphs they are called with
+    mocker.patch.object(execute, 'get_index', new=lambda platform: None)
+    # a loaded index is the largest thing planning holds on to
+    mocker.patch.object(execute, 'Resolve', new=lambda index: bytearray(index_bytes))
+    mocker.patch.object(execute, 'construct_graph',
+                        new=lambda path, platform, bits, **kwargs:
+                        _synthetic_graph(n_recipes, platform, bits))
+    mocker.patch.object(execute, 'expand_run', new=lambda graph, **kwargs: None)
+    mocker.patch.object(execute, 'input_hashes', new=lambda graph: {})
+    mocker.patch.object(execute, 'order_build',
+                        new=lambda graph, **kwargs: (graph, graph.nodes()))
+    mocker.patch.object(execute, 'expand_build_matrix',
+                        new=lambda node, path, label, counts=None, key=None: [
+                            {'variables': {'BUILD_RECIPE': node, 'TARGET_PLATFORM': label,
+                                           'CONDA_PY': '3.6'}}])
+    tracemalloc.start()
+    try:
+        jobs = execute.compute_job_graph('.', git_rev='abc', low_memory=low_memory)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # test runs are covered by the build runs, which don't skip testing
+    assert len(jobs) == len(platforms) * n_recipes
+    if low_memory:
+        # one index at a time, and the graph and jobs of what is being planned
+        assert peak < index_bytes + 96 * 1024 * 1024
+    else:
+        # every platform's index is kept until planning is done
+        assert peak > len(platforms) * index_bytes
+
+
+def test_plan_platform_variant_dependencies(mocker):
+    graph = nx.DiGraph()
+    graph.add_node('a')
+    graph.add_node('b', recipe='/recipes/b')
+    graph.add_node('c')
+    graph.add_edges_from([('b', 'a'), ('b', 'c')])
+    mocker.patch.object(execute, 'Resolve')
+    mocker.patch.object(execute, 'get_index')
+    mocker.patch.object(execute, 'construct_graph', return_value=graph)
+    mocker.patch.object(execute, 'expand_run')
+    mocker.patch.object(execute, 'order_build', return_value=(graph, ['a', 'c', 'b']))
+    mocker.patch.object(execute, 'expand_build_matrix',
+                        side_effect=lambda node, path, label, counts=None, key=None: [
+                            {'variables': {'BUILD_RECIPE': node, 'CONDA_PY': py}}
+                            for py in ('2.7', '3.5')])
+    # b only needs c on python 2.7
+    mocker.patch.object(execute, 'variant_requirements',
+                        side_effect=lambda recipe, platform, bits, variables, deps_type, key:
+                        set(['a', 'c']) if variables['CONDA_PY'] == '2.7' else set(['a']))
+    platform = {'platform': 'linux', 'arch': 64, 'worker_label': 'label'}
+    plan = execute._plan_platform('.', 'build', platform)
+    dependencies = {job['key']: sorted(job['dependencies']) for job in plan}
+    assert dependencies['build_b_label_CONDA_PY-2.7'] == ['build_a_label', 'build_c_label']
+    assert dependencies['build_b_label_CONDA_PY-3.5'] == ['build_a_label']
+    # no recipe here: the graph's edges are used as they are
+    assert dependencies['build_a_label_CONDA_PY-2.7'] == []
+    execute.variant_requirements.assert_called_with('/recipes/b', 'linux', 64,
+                                                    {'CONDA_PY': '3.5'}, deps_type='build',
+                                                    key=None)
+    # a budget is charged for each configuration a package runs
+    assert execute.expand_run.call_args[1]['job_count']('b') == 2
+
+
+def test_plan_platform_reports_variant_only_dependencies(mocker, capsys):
+    graph = nx.DiGraph()
+    graph.add_node('a')
+    graph.add_node('b', recipe='/recipes/b')
+    graph.add_edge('b', 'a')
+    # the repository has a recipe for d, which only b's python 2.7 variant requires
+    graph.graph['recipe_index'] = mocker.Mock()
+    graph.graph['recipe_index'].folder_of.side_effect = {'d': 'd_recipe'}.get
+    mocker.patch.object(execute, 'Resolve')
+    mocker.patch.object(execute, 'get_index')
+    mocker.patch.object(execute, 'construct_graph', return_value=graph)
+    mocker.patch.object(execute, 'expand_run')
+    mocker.patch.object(execute, 'order_build', return_value=(graph, ['a', 'b']))
+    mocker.patch.object(execute, 'expand_build_matrix',
+                        side_effect=lambda node, path, label, counts=None, key=None: [
+                            {'variables': {'BUILD_RECIPE': node, 'CONDA_PY': py}}
+                            for py in ('2.7', '3.5')])
+    mocker.patch.object(execute, 'variant_requirements',
+                        side_effect=lambda recipe, platform, bits, variables, deps_type, key:
+                        set(['a', 'd', 'futures']) if variables['CONDA_PY'] == '2.7'
+                        else set(['a']))
+    platform = {'platform': 'linux', 'arch': 64, 'worker_label': 'label'}
+    plan = execute._plan_platform('.', 'build', platform)
+    # d is not planned, and so not waited for
+    assert {job['key']: job['dependencies'] for job in plan}['build_b_label_CONDA_PY-2.7'] == [
+        'build_a_label']
+    assert "b: d only needed with CONDA_PY=2.7; not planned" in capsys.readouterr()[0]
+
+
+def test_plan_platform_counts_packages_left_out_entirely(mocker):
+    graph = nx.DiGraph()
+    graph.add_node('a', build=True)
+    graph.add_node('b', build=True)
+    mocker.patch.object(execute, 'Resolve')
+    mocker.patch.object(execute, 'get_index')
+    mocker.patch.object(execute, 'construct_graph', return_value=graph)
+    mocker.patch.object(execute, 'expand_run')
+
+    def expand_build_matrix(node, path, label, counts=None, key=None):
+        # versions.yml excludes every configuration of b, and one of a's two
+        configurations = ([{'variables': {'BUILD_RECIPE': node, 'CONDA_PY': '3.5'}}]
+                          if node == 'a' else [])
+        counts.update(matrix=2, planned=len(configurations),
+                      excluded=2 - len(configurations))
+        return configurations
+    mocker.patch.object(execute, 'expand_build_matrix', side_effect=expand_build_matrix)
+    platform = {'platform': 'linux', 'arch': 64, 'worker_label': 'label'}
+    plan = execute._plan_platform('.', 'build', platform)
+    jobs = execute.jobs_from_plans([plan, plan], 'abc')
+    assert jobs.nodes() == ['build_a_label_CONDA_PY-3.5']
+    # counted once, though both plans have them
+    assert jobs.graph['eliminated'] == 3
+
+
+def test_plan_platform_dependency_cycle(mocker):
+    # a and b require each other; c requires b
+    graph = nx.DiGraph()
+    for node in 'abc':
+        graph.add_node(node, build=True)
+    graph.add_edges_from([('a', 'b'), ('b', 'a'), ('c', 'b')])
+    mocker.patch.object(execute, 'Resolve')
+    mocker.patch.object(execute, 'get_index')
+    mocker.patch.object(execute, 'construct_graph', return_value=graph)
+    mocker.patch.object(execute, 'expand_run')
+    mocker.patch.object(execute, 'expand_build_matrix',
+                        side_effect=lambda node, path, label, counts=None, key=None: [
+                            {'variables': {'BUILD_RECIPE': node}}])
+    platform = {'platform': 'linux', 'arch': 64, 'worker_label': 'label'}
+    with pytest.raises(ValueError):
+        execute._plan_platform('.', 'build', platform)
+    plan = execute._plan_platform('.', 'build', platform, condense_cycles=True)
+    assert {job['key']: job['dependencies'] for job in plan} == {
+        'build_a_label': [], 'build_b_label': ['build_a_label'], 'build_c_label': ['build_b_label']}
+    jobs = execute.jobs_from_plans([plan], 'abc')
+    assert sorted(jobs.edges()) == [('build_b_label', 'build_a_label'),
+                                    ('build_c_label', 'build_b_label')]
+
+
+def test_input_hash():
+    configuration = {'variables': {'BUILD_RECIPE': 'a', 'CONDA_PY': '2.7'}}
+    input_hash = execute._input_hash('abc', 'build', 'linux', configuration)
+    assert input_hash == execute._input_hash('abc', 'build', 'linux', configuration)
+    assert input_hash != execute._input_hash('abd', 'build', 'linux', configuration)
+    assert input_hash != execute._input_hash('abc', 'test', 'linux', configuration)
+    assert input_hash != execute._input_hash('abc', 'build', 'linux',
+                                             {'variables': {'BUILD_RECIPE': 'a',
+                                                            'CONDA_PY': '3.5'}})
+    assert execute._input_hash(None, 'build', 'linux', configuration) is None
+
+
+def test_input_hash_independent_of_clone_location():
+    def configuration(root):
+        return {'variables': {'BUILD_RECIPE': os.path.join(root, 'recipes', 'a'),
+                              'CONDA_PY': '3.5', 'TEST_MODE': '--no-test'}}
+    input_hash = execute._input_hash('tree-a', 'build', 'linux', configuration('/ci/clone1'),
+                                     '/ci/clone1')
+    assert input_hash == execute._input_hash('tree-a', 'build', 'linux',
+                                             configuration('/home/ci/clone2'), '/home/ci/clone2')
+    assert input_hash != execute._input_hash('tree-a', 'build', 'linux',
+                                             configuration('/ci/clone1'), '/ci')
+
+
+def test_configuration_key():
+    configuration = {'variables': {'BUILD_RECIPE': 'a', 'CONDA_PY': '2.7', 'CONDA_NPY': '1.11',
+                                   'TEST_MODE': '--no-test', 'TARGET_PLATFORM': ('label', )}}
+    assert (execute._configuration_key('build_a_label', configuration) ==
+            'build_a_label_CONDA_NPY-1.11_CONDA_PY-2.7')
+    assert (execute._configuration_key('build_a_label', {'variables': {'BUILD_RECIPE': 'a'}}) ==
+            'build_a_label')
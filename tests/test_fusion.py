@@ -0,0 +1,74 @@
+import json
+import sys
+
+from conda_gitlab_ci import fusion
+from conda_gitlab_ci.history import DurationHistory
+
+from .utils import make_jobs
+
+
+def make_fusable_jobs():
+    # build_a is depended on by the tests of a, b, c and d; test_d is depended on by test_e
+    jobs = make_jobs([('test_a', 'build_a'), ('test_b', 'build_a'), ('test_c', 'build_a'),
+                      ('test_d', 'build_a'), ('test_e', 'test_d')], worker_label='linux')
+    for key in jobs.nodes():
+        run, package = key.split('_')
+        data = jobs.node[key]
+        data.update(run=run, package=package)
+        data['configuration']['variables']['BUILD_RECIPE'] = package
+        if run == 'test':
+            data['input_hash'] = package + '-inputs'
+            data['configuration']['variables'].update(TARGET_PLATFORM=('linux', ),
+                                                      TEST_MODE='--test')
+    return jobs
+
+
+def make_history(durations):
+    history = DurationHistory()
+    for package, seconds in durations.items():
+        history.record('test_' + package, package, seconds)
+    return history
+
+
+def test_fuse_jobs():
+    jobs = make_fusable_jobs()
+    # a, b and c are short.  d is short, but test_e depends on it; e has no history
+    history = make_history({'a': 30, 'b': 40, 'c': 200, 'd': 20})
+    assert fusion.fuse_jobs(jobs, history, target=100) == 2
+    key = fusion.fused_key(['test_a', 'test_b'])
+    assert sorted(jobs.nodes()) == sorted(['build_a', key, 'test_c', 'test_d', 'test_e'])
+    data = jobs.node[key]
+    assert [member['key'] for member in data['fused']] == ['test_a', 'test_b']
+    assert data['worker_label'] == 'linux'
+    assert jobs.successors(key) == ['build_a']
+    variables = data['configuration']['variables']
+    assert 'BUILD_RECIPE' not in variables
+    assert [configuration['CGCI_JOB'] for configuration in
+            json.loads(variables[fusion.FUSED_VARIABLE])] == ['test_a', 'test_b']
+    assert data['input_hash']
+
+
+def test_fuse_jobs_packs_to_target():
+    jobs = make_fusable_jobs()
+    jobs.remove_edge('test_e', 'test_d')
+    history = make_history({'a': 60, 'b': 50, 'c': 40, 'd': 30, 'e': 20})
+    assert fusion.fuse_jobs(jobs, history, target=100) == 5
+    bins = sorted(sorted(member['key'] for member in jobs.node[key]['fused'])
+                  for key in jobs.nodes() if jobs.node[key].get('fused'))
+    # first-fit decreasing: a+c, b+d+e
+    assert bins == [['test_a', 'test_c'], ['test_b', 'test_d', 'test_e']]
+
+
+def test_parse_results():
+    trace = "Running test_a\n...\nCGCI_RESULT test_a success\nCGCI_RESULT test_b failed\r\n"
+    assert fusion.parse_results(trace) == {'test_a': 'success', 'test_b': 'failed'}
+    assert fusion.parse_results(None) == {}
+
+
+def test_run_fused(capsys):
+    configurations = [{'CGCI_JOB': 'test_a', 'EXIT': '0'}, {'CGCI_JOB': 'test_b', 'EXIT': 1}]
+    script = '{0} -c "import os, sys; sys.exit(int(os.environ[\'EXIT\']))"'.format(
+        sys.executable)
+    assert fusion.run_fused(configurations, script=script, environ={}) == 1
+    assert fusion.parse_results(capsys.readouterr()[0]) == {'test_a': 'success',
+                                                            'test_b': 'failed'}
@@ -0,0 +1,67 @@
+import os
+import subprocess
+
+import pytest
+
+from conda_gitlab_ci import git_history
+
+from .utils import testing_workdir
+
+
+def make_upstream(n_commits):
+    """A repository with one commit per recipe folder, and a shallow clone of it"""
+    subprocess.check_call(['git', 'init', '-q', 'upstream'])
+    for i in range(n_commits):
+        os.makedirs(os.path.join('upstream', 'recipe{0}'.format(i)))
+        with open(os.path.join('upstream', 'recipe{0}'.format(i), 'meta.yaml'), 'w') as f:
+            f.write('package:\n   name: recipe{0}\n'.format(i))
+        subprocess.check_call(['git', 'add', '.'], cwd='upstream')
+        subprocess.check_call(['git', 'commit', '-q', '-m', 'commit {0}'.format(i)],
+                              cwd='upstream')
+    # file:// so that --depth applies to a local clone
+    subprocess.check_call(['git', 'clone', '-q', '--depth', '1',
+                           'file://' + os.path.abspath('upstream'), 'clone'])
+    return os.path.abspath('clone')
+
+
+def test_missing_revs(testing_workdir):
+    clone = make_upstream(3)
+    assert git_history.clone_state(clone) == (True, False)
+    assert git_history.missing_revs(clone, ['HEAD', 'HEAD^', 'nonsense']) == ['HEAD^',
+                                                                            'nonsense']
+
+
+def test_ensure_history_deepens_shallow_clone(testing_workdir, monkeypatch):
+    monkeypatch.setattr(git_history, 'DEEPEN_STEP', 2)
+    clone = make_upstream(8)
+    git_history.ensure_history(clone, 'HEAD')
+    assert not git_history.missing_revs(clone, ['HEAD^'])
+    git_history.ensure_history(clone, 'HEAD~5', 'HEAD')
+    assert not git_history.missing_revs(clone, ['HEAD~5'])
+    # the first commit has no parent to diff against, and that's fine
+    git_history.ensure_history(clone, 'HEAD~7')
+    assert not git_history.clone_state(clone)[0]
+    with pytest.raises(ValueError):
+        git_history.ensure_history(clone, 'HEAD~8', 'HEAD')
+
+
+def test_resolve_rev(testing_workdir):
+    clone = make_upstream(1)
+    sha = git_history.run_git(['rev-parse', 'HEAD'], 'upstream').strip()
+    assert git_history.resolve_rev(clone, 'HEAD') == sha
+    with pytest.raises(subprocess.CalledProcessError):
+        git_history.resolve_rev(clone, 'nonsense')
+
+
+def test_ensure_history_fetches_commits_by_sha(testing_workdir):
+    clone = make_upstream(2)
+    subprocess.check_call(['git', 'checkout', '-q', '-b', 'topic'], cwd='upstream')
+    with open(os.path.join('upstream', 'recipe0', 'build.sh'), 'w') as f:
+        f.write('make')
+    subprocess.check_call(['git', 'add', '.'], cwd='upstream')
+    subprocess.check_call(['git', 'commit', '-q', '-m', 'topic'], cwd='upstream')
+    sha = git_history.run_git(['rev-parse', 'HEAD'], 'upstream').strip()
+    subprocess.check_call(['git', 'config', 'uploadpack.allowAnySHA1InWant', 'true'],
+                          cwd='upstream')
+    git_history.ensure_history(clone, 'HEAD', sha)
+    assert not git_history.missing_revs(clone, ['HEAD', sha])
@@ -0,0 +1,32 @@
+from conda_gitlab_ci.history import DurationHistory
+
+from .utils import testing_workdir
+
+
+def test_record_and_estimate(testing_workdir):
+    history = DurationHistory('history.json')
+    history.record('build_a_linux', 'a', 10.0)
+    history.record('build_a_linux', 'a', 20.0)
+    history.record('build_a_osx', 'a', 60.0)
+    assert history.job('build_a_linux') == 15.0
+    assert history.package('a') == 30.0
+    assert history.estimate('build_a_linux', 'a') == 15.0
+    assert history.estimate('test_a_linux', 'a') == 30.0
+    assert history.estimate('build_b_linux', 'b', default=5) == 5
+    assert history.mean() == 30.0
+    assert history.package_means() == {'a': 30.0}
+
+
+def test_save_and_load(testing_workdir):
+    history = DurationHistory('history.json')
+    history.record('build_a_linux', 'a', 10.0)
+    history.save()
+    assert DurationHistory('history.json').job('build_a_linux') == 10.0
+
+
+def test_empty_history():
+    history = DurationHistory()
+    assert history.job('build_a_linux') is None
+    assert history.mean(default=600) == 600
+    # no path: nothing to save to
+    history.save()
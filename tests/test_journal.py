@@ -0,0 +1,46 @@
+import os
+
+from conda_gitlab_ci.journal import Journal
+
+from .utils import testing_workdir
+
+
+def test_record_and_load(testing_workdir):
+    journal = Journal('journal')
+    journal.record('build_a_label', 'abc', 1, 'submitted')
+    journal.record('build_b_label', 'abc', 2, 'submitted')
+    journal.record('build_a_label', 'abc', 1, 'success')
+    journal.record('build_a_label', 'def', 3, 'submitted')
+    entries = journal.load()
+    assert entries[('build_a_label', 'abc')]['status'] == 'success'
+    assert entries[('build_b_label', 'abc')] == {'key': 'build_b_label', 'commit_sha': 'abc',
+                                                 'build_id': 2, 'status': 'submitted'}
+    assert entries[('build_a_label', 'def')]['build_id'] == 3
+
+
+def test_prune(testing_workdir):
+    journal = Journal('journal')
+    journal.record('build_a_label', 'abc', 1, 'submitted')
+    journal.record('build_a_label', 'abc', 1, 'success')
+    journal.record('build_a_label', 'def', 3, 'success')
+    journal.prune(set(['abc']))
+    with open('journal') as f:
+        assert len(f.readlines()) == 1
+    assert journal.load() == {('build_a_label', 'abc'): {'key': 'build_a_label',
+                                                         'commit_sha': 'abc', 'build_id': 1,
+                                                         'status': 'success'}}
+    Journal('missing').prune(set(['abc']))
+    assert not os.path.exists('missing')
+
+
+def test_load_missing_journal(testing_workdir):
+    assert Journal('journal').load() == {}
+
+
+def test_load_ignores_partial_line(testing_workdir):
+    journal = Journal('journal')
+    journal.record('build_a_label', 'abc', 1, 'submitted')
+    with open('journal', 'a') as f:
+        f.write('{"key": "build_a_la')
+    assert os.path.isfile('journal')
+    assert list(journal.load()) == [('build_a_label', 'abc')]
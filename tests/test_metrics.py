@@ -0,0 +1,73 @@
+import json
+import os
+import time
+
+from conda_gitlab_ci import metrics
+
+from .utils import testing_workdir
+
+
+def test_job_label():
+    assert metrics.job_label({'variables': {'TARGET_PLATFORM': ('linux', )}}) == 'linux'
+    assert metrics.job_label({'variables': {'TARGET_PLATFORM': 'osx'}}) == 'osx'
+    assert metrics.job_label({'variables': {}}) == ''
+
+
+def test_snapshot():
+    m = metrics.Metrics()
+    m.job_submitted('linux', ready_time=time.time() - 2)
+    m.job_submitted('linux')
+    m.job_submitted('osx')
+    m.job_state('linux', 'pending', 3.0)
+    m.job_state('linux', 'pending', 1.0)
+    m.job_finished('linux', 'success')
+    m.api_call('trigger')
+    m.api_call('trigger', ok=False)
+    snapshot = m.snapshot()
+    assert snapshot['jobs_submitted'] == 3
+    assert snapshot['jobs_submitted_by_label'] == {'linux': 2, 'osx': 1}
+    assert snapshot['jobs_finished'] == [{'worker_label': 'linux', 'status': 'success',
+                                          'count': 1}]
+    assert snapshot['ready_to_trigger_seconds']['count'] == 1
+    assert snapshot['ready_to_trigger_seconds']['sum'] >= 2
+    assert snapshot['state_seconds'] == [{'worker_label': 'linux', 'state': 'pending',
+                                          'count': 2, 'sum': 4.0, 'mean': 2.0}]
+    assert snapshot['api'] == {'trigger': {'requests': 2, 'errors': 1, 'error_rate': 0.5}}
+
+
+def test_time_to_first_trigger():
+    m = metrics.Metrics()
+    assert m.snapshot()['time_to_first_trigger_seconds'] is None
+    assert 'cgci_time_to_first_trigger_seconds' not in m.prometheus()
+    m.start_time -= 5
+    m.job_submitted('linux')
+    m.job_submitted('linux')
+    assert 5 <= m.snapshot()['time_to_first_trigger_seconds'] < 6
+    assert 'cgci_time_to_first_trigger_seconds 5' in m.prometheus()
+
+
+def test_prometheus():
+    m = metrics.Metrics()
+    m.job_submitted('linux')
+    m.job_state('linux', 'running', 5.0)
+    m.api_call('status', ok=False)
+    text = m.prometheus()
+    assert 'cgci_jobs_submitted_total{worker_label="linux"} 1\n' in text
+    assert 'cgci_job_state_seconds_sum{state="running",worker_label="linux"} 5.0\n' in text
+    assert 'cgci_job_state_seconds_count{state="running",worker_label="linux"} 1\n' in text
+    assert 'cgci_api_errors_total{endpoint="status"} 1\n' in text
+    assert '# TYPE cgci_ready_to_trigger_seconds summary\n' in text
+
+
+def test_metrics_writer(testing_workdir):
+    m = metrics.Metrics()
+    m.job_submitted('linux')
+    with metrics.MetricsWriter('metrics.json', interval=0.01, metrics=m):
+        time.sleep(0.05)
+    with open('metrics.json') as f:
+        assert json.load(f)['jobs_submitted'] == 1
+    with metrics.MetricsWriter('metrics.prom', interval=60, metrics=m):
+        pass
+    with open('metrics.prom') as f:
+        assert 'cgci_jobs_submitted_total{worker_label="linux"} 1' in f.read()
+    assert not os.path.exists('metrics.prom.tmp')
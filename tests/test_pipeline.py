@@ -0,0 +1,70 @@
+import networkx as nx
+import responses
+import yaml
+
+from conda_gitlab_ci import pipeline
+
+from .test_trigger_gitlab import set_ci_environ_vars
+from .utils import make_jobs, testing_workdir
+
+
+def make_pipeline_jobs():
+    # c depends on a and b; b depends on a
+    return make_jobs([('b', 'a'), ('c', 'a'), ('c', 'b')],
+                     variables={'CONDA_PY': '2.7', 'TARGET_PLATFORM': ('linux-64', )},
+                     commit_sha='123abc', worker_label='linux-64')
+
+
+def test_child_pipeline():
+    definition = pipeline.child_pipeline(make_pipeline_jobs())
+    assert definition['stages'] == ['level-0', 'level-1', 'level-2']
+    assert definition['a'] == {'stage': 'level-0',
+                               'script': [pipeline.BUILD_SCRIPT],
+                               'tags': ['linux-64'],
+                               'variables': {'BUILD_RECIPE': 'a', 'CONDA_PY': '2.7',
+                                             'TARGET_PLATFORM': 'linux-64'}}
+    assert definition['b']['stage'] == 'level-1'
+    assert definition['b']['needs'] == ['a']
+    assert definition['c']['stage'] == 'level-2'
+    assert definition['c']['needs'] == ['a', 'b']
+
+
+def test_child_pipeline_too_many_needs(monkeypatch):
+    monkeypatch.setattr(pipeline, 'MAX_NEEDS', 1)
+    definition = pipeline.child_pipeline(make_pipeline_jobs())
+    # stage order still runs c after both of its dependencies
+    assert 'needs' not in definition['c']
+    assert definition['b']['needs'] == ['a']
+
+
+def test_encode_pipeline_round_trip():
+    text = pipeline.pipeline_yaml(make_pipeline_jobs())
+    encoded = pipeline.encode_pipeline(text)
+    assert len(encoded) < len(text)
+    assert pipeline.decode_pipeline(encoded) == text
+    assert yaml.safe_load(text) == pipeline.child_pipeline(make_pipeline_jobs())
+
+
+@responses.activate
+def test_dispatch_pipeline(set_ci_environ_vars, testing_workdir):
+    responses.add(responses.POST,
+                  'http://some.test.ci.com/api/v4/projects/2/trigger/pipeline',
+                  status=201, json={'id': 7})
+    for status in ('pending', 'running', 'failed'):
+        responses.add(responses.GET,
+                      'http://some.test.ci.com/api/v4/projects/2/pipelines/7',
+                      status=200, json={'id': 7, 'status': status})
+    jobs = make_pipeline_jobs()
+    assert pipeline.dispatch_pipeline(jobs, path='pipeline.yml', sleep_interval=0) == 'failed'
+    # one trigger for all of the jobs, then polling the one pipeline
+    assert len(responses.calls) == 4
+    payload = yaml.safe_load(responses.calls[0].request.body)
+    assert payload['ref'] == '123abc'
+    text = pipeline.decode_pipeline(payload['variables'][pipeline.PIPELINE_VARIABLE])
+    with open('pipeline.yml') as f:
+        assert f.read() == text
+    assert set(yaml.safe_load(text)) == set(['a', 'b', 'c', 'stages'])
+
+
+def test_dispatch_pipeline_nothing_to_do():
+    assert pipeline.dispatch_pipeline(nx.DiGraph()) == 'success'
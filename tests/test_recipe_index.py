@@ -0,0 +1,73 @@
+import os
+import subprocess
+
+from conda_gitlab_ci import recipe_index
+
+from .utils import testing_workdir, testing_git_repo, make_recipe
+
+
+def examined(index, mocker):
+    """Update the index, returning the folders that were searched for a recipe"""
+    mocker.spy(recipe_index, 'find_recipe')
+    index.update()
+    folders = sorted(os.path.basename(call[0][0])
+                     for call in recipe_index.find_recipe.call_args_list)
+    mocker.stopall()
+    return folders
+
+
+def test_recipe_index(testing_git_repo, mocker):
+    index = recipe_index.RecipeIndex(testing_git_repo)
+    assert examined(index, mocker) == ['not_a_recipe', 'test_dir_1', 'test_dir_2', 'test_dir_3']
+    assert index.recipe_dirs() == ['test_dir_1', 'test_dir_2', 'test_dir_3']
+    assert index.folders['test_dir_1']['recipe'] == os.path.join('test_dir_1', 'meta.yaml')
+    assert os.path.dirname(index.path) == os.path.join(testing_git_repo, '.git')
+
+    # unchanged folders are not searched again; not_a_recipe isn't committed
+    assert examined(index, mocker) == ['not_a_recipe']
+
+    # changed in the working copy, then committed
+    with open(os.path.join('test_dir_2', 'meta.yaml'), 'a') as f:
+        f.write('# changed\n')
+    assert examined(index, mocker) == ['not_a_recipe', 'test_dir_2']
+    subprocess.check_call(['git', 'commit', '-am', 'change test_dir_2'])
+    assert examined(index, mocker) == ['not_a_recipe', 'test_dir_2']
+    assert examined(index, mocker) == ['not_a_recipe']
+
+    subprocess.check_call(['git', 'rm', '-rq', 'test_dir_3'])
+    subprocess.check_call(['git', 'commit', '-m', 'remove test_dir_3'])
+    index.update()
+    assert index.recipe_dirs() == ['test_dir_1', 'test_dir_2']
+
+
+def test_recipe_index_persists(testing_git_repo, mocker):
+    index = recipe_index.RecipeIndex(testing_git_repo).update()
+    index.record_name('test_dir_1', 'frank')
+    index.save()
+    index = recipe_index.RecipeIndex(testing_git_repo)
+    assert index.folders['test_dir_1']['name'] == 'frank'
+    assert index.folder_of('frank') == 'test_dir_1'
+    assert index.folder_of('test_dir_2') is None
+    assert examined(index, mocker) == ['not_a_recipe']
+    # a changed recipe may make a different package
+    with open(os.path.join('test_dir_1', 'meta.yaml'), 'a') as f:
+        f.write('# changed\n')
+    index.update()
+    assert index.folders['test_dir_1']['name'] is None
+    # lookups follow the changes
+    assert index.folder_of('frank') is None
+    index.record_name('test_dir_2', 'frank')
+    assert index.folder_of('frank') == 'test_dir_2'
+
+
+def test_recipe_index_outside_git(testing_workdir, mocker):
+    os.makedirs('recipes')
+    os.chdir('recipes')
+    make_recipe('some_recipe')
+    os.makedirs('not_a_recipe')
+    index = recipe_index.RecipeIndex('.')
+    assert index.path is None
+    assert examined(index, mocker) == ['not_a_recipe', 'some_recipe']
+    assert examined(index, mocker) == ['not_a_recipe', 'some_recipe']
+    assert index.recipe_dirs() == ['some_recipe']
+    assert not os.path.exists('.cgci_recipe_index.json')
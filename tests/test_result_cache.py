@@ -0,0 +1,27 @@
+from conda_gitlab_ci.result_cache import ResultCache
+
+from .utils import testing_workdir
+
+
+def test_record_save_and_load(testing_workdir):
+    cache = ResultCache('results.json')
+    cache.record('hash1', 'build_a_linux', 'abc')
+    # found again for a later commit: still the commit it first succeeded for
+    cache.record('hash1', 'build_a_linux', 'def')
+    # unknown inputs are never cached
+    cache.record(None, 'build_b_linux', 'abc')
+    cache.save()
+    cache = ResultCache('results.json')
+    assert 'hash1' in cache
+    assert None not in cache
+    assert cache.get('hash1')['commit_sha'] == 'abc'
+    assert cache.get('hash2') is None
+
+
+def test_oldest_dropped(testing_workdir):
+    cache = ResultCache('results.json', max_entries=2)
+    for input_hash in ('hash1', 'hash2', 'hash3'):
+        cache.record(input_hash, 'key', 'abc')
+    cache.results['hash1']['time'] = 0
+    cache.save()
+    assert sorted(ResultCache('results.json').results) == ['hash2', 'hash3']
@@ -0,0 +1,32 @@
+from conda_gitlab_ci.routing import LabelRouter
+
+
+def test_choose_spreads_over_labels_without_history():
+    router = LabelRouter()
+    assert [router.choose(['a', 'b']) for _ in range(4)] == ['a', 'b', 'a', 'b']
+    assert router.pending == {'a': 2, 'b': 2}
+
+
+def test_choose_prefers_shorter_waits():
+    router = LabelRouter(smoothing=0.5)
+    for label, waited in (('a', 100), ('b', 10)):
+        router.submitted(label)
+        router.started(label, waited)
+    assert router.pending == {'a': 0, 'b': 0}
+    # b's queue is ten times faster, so it takes jobs until it is ten times as deep
+    assert [router.choose(['a', 'b']) for _ in range(11)] == ['b'] * 9 + ['a', 'b']
+    router.started('b', 30)
+    assert router.waits['b'] == 20
+    # ending without running says nothing about the wait
+    router.started('a')
+    assert router.waits['a'] == 100
+    assert router.pending == {'a': 0, 'b': 9}
+
+
+def test_unseen_label_assumed_as_busy_as_the_others():
+    router = LabelRouter()
+    router.submitted('a')
+    router.started('a', 60)
+    router.submitted('a')
+    # c has never been used: expected to wait as long as a does, with nothing pending
+    assert router.choose(['a', 'c']) == 'c'
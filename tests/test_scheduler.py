@@ -0,0 +1,296 @@
+import threading
+
+import networkx as nx
+import pytest
+
+from conda_gitlab_ci import scheduler
+from conda_gitlab_ci.history import DurationHistory
+from conda_gitlab_ci.journal import Journal
+from conda_gitlab_ci.result_cache import ResultCache
+
+from .utils import make_jobs, testing_workdir
+
+
+class RecordingJob(object):
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, configuration, dependencies, commit_sha=None, **kwargs):
+        recipe = configuration['variables']['BUILD_RECIPE']
+        with self.lock:
+            self.calls.append(recipe)
+        if recipe in self.fail:
+            raise Exception("Build failed", (configuration, commit_sha))
+        return commit_sha
+
+
+def test_run_job_graph_respects_dependencies():
+    # d depends on c depends on b depends on a
+    jobs = make_jobs([('b', 'a'), ('c', 'b'), ('d', 'c')])
+    job = RecordingJob()
+    statuses = scheduler.run_job_graph(jobs, threads=4, job_function=job)
+    assert job.calls == ['a', 'b', 'c', 'd']
+    assert statuses == {key: scheduler.SUCCESS for key in 'abcd'}
+
+
+def test_run_job_graph_skips_dependents_of_failure():
+    jobs = make_jobs([('b', 'a'), ('c', 'b'), ('d', 'c')], nodes=['e'])
+    job = RecordingJob(fail=('b', ))
+    statuses = scheduler.run_job_graph(jobs, threads=4, job_function=job)
+    assert sorted(job.calls) == ['a', 'b', 'e']
+    assert statuses == {'a': scheduler.SUCCESS, 'b': scheduler.FAILED,
+                        'c': scheduler.SKIPPED, 'd': scheduler.SKIPPED,
+                        'e': scheduler.SUCCESS}
+
+
+def test_fail_fast_cancels_in_flight_builds():
+    # a fails while b is running on gitlab; c waits on b
+    jobs = make_jobs([('c', 'b')], nodes=['a'])
+    b_submitted = threading.Event()
+    b_cancelled = threading.Event()
+
+    def job(configuration, dependencies, commit_sha=None, notify=None, **kwargs):
+        recipe = configuration['variables']['BUILD_RECIPE']
+        if recipe == 'a':
+            b_submitted.wait(5)
+            raise Exception("Build failed", (configuration, commit_sha))
+        notify('submitted', 7)
+        b_submitted.set()
+        b_cancelled.wait(5)
+        raise Exception("Build canceled", (configuration, commit_sha))
+
+    cancelled = []
+
+    def cancel(build_id, **kwargs):
+        cancelled.append(build_id)
+        b_cancelled.set()
+
+    statuses = scheduler.run_job_graph(jobs, threads=2, job_function=job, fail_fast=True,
+                                       cancel_function=cancel)
+    assert cancelled == [7]
+    assert statuses == {'a': scheduler.FAILED, 'b': scheduler.CANCELLED, 'c': scheduler.SKIPPED}
+
+
+def test_journal_records_submissions_and_results(testing_workdir):
+    jobs = make_jobs([('b', 'a')])
+
+    def job(configuration, dependencies, commit_sha=None, notify=None, **kwargs):
+        notify('submitted', configuration['variables']['BUILD_RECIPE'] + '-id')
+        return commit_sha
+
+    journal = Journal('journal')
+    scheduler.run_job_graph(jobs, job_function=job, journal=journal)
+    assert journal.load() == {
+        ('a', 'abc'): {'key': 'a', 'commit_sha': 'abc', 'build_id': 'a-id', 'status': 'success'},
+        ('b', 'abc'): {'key': 'b', 'commit_sha': 'abc', 'build_id': 'b-id', 'status': 'success'}}
+
+
+def test_resume_skips_successes_and_reattaches(testing_workdir):
+    # c depends on b depends on a
+    jobs = make_jobs([('b', 'a'), ('c', 'b')], nodes=['d'])
+    journal = Journal('journal')
+    journal.record('a', 'abc', 1, 'success')
+    journal.record('b', 'abc', 2, 'running')
+    # different commit: does not count
+    journal.record('d', 'def', 4, 'success')
+
+    calls = {}
+
+    def job(configuration, dependencies, commit_sha=None, build_id=None, **kwargs):
+        calls[configuration['variables']['BUILD_RECIPE']] = build_id
+        return commit_sha
+
+    statuses = scheduler.run_job_graph(jobs, job_function=job, journal=journal, resume=True)
+    assert calls == {'b': 2, 'c': None, 'd': None}
+    assert statuses == {key: scheduler.SUCCESS for key in 'abcd'}
+    # once done, the journal only keeps this commit's jobs
+    assert sorted(journal.load()) == [(key, 'abc') for key in 'abcd']
+
+
+class RecordingListener(object):
+    def __init__(self):
+        self.events = []
+
+    def job_event(self, key, state):
+        self.events.append((key, state))
+
+
+def test_listeners_and_history():
+    jobs = make_jobs([('b', 'a')])
+    for key in 'ab':
+        jobs.node[key]['package'] = key
+
+    def job(configuration, dependencies, commit_sha=None, notify=None, **kwargs):
+        recipe = configuration['variables']['BUILD_RECIPE']
+        notify('submitted', 1)
+        notify('running', 1)
+        if recipe == 'a':
+            raise Exception("Build failed", (configuration, commit_sha))
+        return commit_sha
+
+    listener = RecordingListener()
+    history = DurationHistory()
+    scheduler.run_job_graph(jobs, job_function=job, listeners=[listener], history=history)
+    assert listener.events == [('a', 'submitted'), ('a', 'running'), ('a', 'failed'),
+                               ('b', 'skipped')]
+
+    listener = RecordingListener()
+    jobs.remove_node('a')
+    scheduler.run_job_graph(jobs, job_function=job, listeners=[listener], history=history)
+    assert listener.events == [('b', 'submitted'), ('b', 'running'), ('b', 'success')]
+    assert history.job('b') is not None
+    assert history.package('b') is not None
+
+
+def test_more_jobs_dispatched_while_planning():
+    # a is planned first; b (waiting on a) and c (waiting on the failed f) come later
+    first = make_jobs([], nodes=['a', 'f'])
+    a_submitted = threading.Event()
+
+    def more_jobs():
+        yield first
+        # planning the rest takes until a has been dispatched
+        assert a_submitted.wait(5)
+        yield make_jobs([('b', 'a'), ('c', 'f')])
+
+    job = RecordingJob(fail=('f', ))
+
+    def job_function(configuration, dependencies, commit_sha=None, **kwargs):
+        if configuration['variables']['BUILD_RECIPE'] == 'a':
+            a_submitted.set()
+        return job(configuration, dependencies, commit_sha=commit_sha)
+
+    dispatcher = scheduler.Dispatcher(nx.DiGraph(), threads=2, job_function=job_function)
+    statuses = dispatcher.run(more_jobs=more_jobs())
+    assert sorted(job.calls) == ['a', 'b', 'f']
+    assert statuses == {'a': scheduler.SUCCESS, 'b': scheduler.SUCCESS,
+                        'c': scheduler.SKIPPED, 'f': scheduler.FAILED}
+    assert sorted(dispatcher.jobs.edges()) == [('b', 'a'), ('c', 'f')]
+
+
+def test_more_jobs_add_dependencies_to_waiting_jobs():
+    # a waits on slow; planning more finds that a also needs c, e.g. because a test run was
+    #    coalesced onto a
+    released = threading.Event()
+
+    def more_jobs():
+        yield make_jobs([('a', 'slow')])
+        yield make_jobs([('a', 'slow'), ('a', 'c')])
+        released.set()
+
+    job = RecordingJob()
+
+    def job_function(configuration, dependencies, commit_sha=None, **kwargs):
+        if configuration['variables']['BUILD_RECIPE'] == 'slow':
+            assert released.wait(5)
+        return job(configuration, dependencies, commit_sha=commit_sha)
+
+    dispatcher = scheduler.Dispatcher(nx.DiGraph(), threads=2, job_function=job_function)
+    statuses = dispatcher.run(more_jobs=more_jobs())
+    assert statuses == {key: scheduler.SUCCESS for key in ('a', 'c', 'slow')}
+    assert job.calls.index('c') < job.calls.index('a')
+    assert sorted(dispatcher.jobs.successors('a')) == ['c', 'slow']
+
+
+def test_planning_error_raised_after_dispatch():
+    def more_jobs():
+        yield make_jobs([], nodes=['a'])
+        raise ValueError("Cycles detected in job graph")
+
+    job = RecordingJob()
+    dispatcher = scheduler.Dispatcher(nx.DiGraph(), job_function=job)
+    with pytest.raises(ValueError):
+        dispatcher.run(more_jobs=more_jobs())
+    # jobs planned before the error still ran
+    assert job.calls == ['a']
+
+
+def test_result_cache_skips_unchanged_inputs():
+    # a's inputs succeeded before, for another commit; b's never did, and c's are unknown
+    jobs = make_jobs([('b', 'a')], nodes=['c'])
+    for key in 'abc':
+        jobs.node[key]['input_hash'] = None if key == 'c' else key + '-inputs'
+    cache = ResultCache()
+    cache.record('a-inputs', 'a', 'older')
+    job = RecordingJob()
+    statuses = scheduler.run_job_graph(jobs, job_function=job, result_cache=cache)
+    assert sorted(job.calls) == ['b', 'c']
+    assert statuses == {key: scheduler.SUCCESS for key in 'abc'}
+    assert 'b-inputs' in cache
+    assert cache.get('a-inputs')['commit_sha'] == 'older'
+
+
+def test_fused_job_resolved_per_configuration():
+    jobs = make_jobs([])
+    members = [{'key': key, 'package': key, 'input_hash': key + '-inputs',
+                'configuration': {'variables': {'BUILD_RECIPE': key}}} for key in 'ab']
+    jobs.add_node('fused', configuration={'variables': {'BUILD_RECIPE': 'fused'}},
+                  commit_sha='abc', fused=members)
+
+    def job(configuration, dependencies, commit_sha=None, notify=None, **kwargs):
+        notify('submitted', 3)
+        raise Exception("Build failed", (configuration, commit_sha))
+
+    traces = []
+
+    def trace(build_id, **kwargs):
+        traces.append(build_id)
+        return "CGCI_RESULT a success\nCGCI_RESULT b failed\n"
+
+    cache = ResultCache()
+    dispatcher = scheduler.Dispatcher(jobs, job_function=job, trace_function=trace,
+                                      result_cache=cache)
+    assert dispatcher.run() == {'a': scheduler.SUCCESS, 'b': scheduler.FAILED}
+    assert dispatcher.status('fused') == scheduler.FAILED
+    assert traces == [3]
+    assert 'a-inputs' in cache and 'b-inputs' not in cache
+
+
+def test_jobs_routed_to_least_busy_label():
+    jobs = make_jobs([], nodes=['a', 'b', 'c'])
+    for key in 'abc':
+        jobs.node[key]['configuration']['variables']['TARGET_PLATFORM'] = ('linux', )
+        jobs.node[key]['worker_labels'] = ['linux', 'linux-spot']
+    # linux is slow to pick jobs up, and a job is already pending there
+    router = scheduler.LabelRouter()
+    for label, waited in (('linux', 300), ('linux-spot', 10)):
+        router.submitted(label)
+        router.started(label, waited)
+    router.submitted('linux')
+    submitted = []
+
+    def job(configuration, dependencies, commit_sha=None, notify=None, **kwargs):
+        submitted.append(configuration['variables']['TARGET_PLATFORM'])
+        notify('submitted', 1)
+        return commit_sha
+
+    dispatcher = scheduler.Dispatcher(jobs, threads=1, job_function=job, router=router)
+    dispatcher.run()
+    assert submitted == [('linux-spot', )] * 3
+    assert dispatcher.labels == {key: 'linux-spot' for key in 'abc'}
+    # the plan itself is left alone, and finished jobs are no longer pending
+    assert jobs.node['a']['configuration']['variables']['TARGET_PLATFORM'] == ('linux', )
+    assert router.pending == {'linux': 1, 'linux-spot': 0}
+
+
+def test_runner_hours_saved():
+    dispatcher = scheduler.Dispatcher(make_jobs([], nodes=['a', 'b', 'c']))
+    dispatcher.statuses = {'a': scheduler.SUCCESS, 'b': scheduler.SKIPPED,
+                           'c': scheduler.CANCELLED}
+    dispatcher.times = {'a': {'running': 0, 'finished': 7200},
+                        'c': {'running': 0, 'finished': 3600}}
+    assert dispatcher.runner_hours_saved() == 3.0
+
+
+def test_runner_hours_saved_needs_a_successful_job():
+    dispatcher = scheduler.Dispatcher(make_jobs([], nodes=['a']))
+    dispatcher.statuses = {'a': scheduler.SKIPPED}
+    assert dispatcher.runner_hours_saved() is None
+
+
+def test_summarize():
+    assert (scheduler.summarize({'a': 'success', 'b': 'failed', 'c': 'skipped',
+                                 'd': 'skipped'}) ==
+            "1 success, 1 failed, 2 skipped, 0 cancelled")
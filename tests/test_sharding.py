@@ -0,0 +1,82 @@
+import pytest
+from pytest_mock import mocker
+
+from conda_gitlab_ci import sharding
+
+from .utils import testing_workdir
+
+units = [('build', {'worker_label': 'linux'}), ('build', {'worker_label': 'osx'}),
+         ('test', {'worker_label': 'linux'})]
+
+
+def fake_plan(path, run, platform, **kwargs):
+    package_key = '{0}_a_{1}'.format(run, platform['worker_label'])
+    dependencies = [] if run == 'build' else ['build_a_{0}'.format(platform['worker_label'])]
+    return [{'key': package_key, 'package_key': package_key, 'dependencies': dependencies,
+             'configuration': {'variables': {'BUILD_RECIPE': 'a',
+                                             'TEST_MODE': '--{0}test'.format(
+                                                 'no-' if run == 'build' else '')}},
+             'run': run, 'package': 'a', 'worker_label': platform['worker_label']}]
+
+
+@pytest.fixture
+def fake_planning(mocker):
+    mocker.patch.object(sharding, 'planning_units')
+    mocker.patch.object(sharding, '_plan_platform')
+    mocker.patch.object(sharding, 'checkout_git_rev')
+    mocker.patch.object(sharding, 'resolve_rev', side_effect=lambda path, rev: rev)
+    sharding.planning_units.return_value = units
+    sharding._plan_platform.side_effect = fake_plan
+
+
+@pytest.mark.parametrize("value, expected", (("0/1", (0, 1)), ("2/3", (2, 3))))
+def test_parse_shard(value, expected):
+    assert sharding.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ("3/3", "-1/3", "1", "a/b"))
+def test_parse_shard_invalid(value):
+    with pytest.raises(ValueError):
+        sharding.parse_shard(value)
+
+
+def test_plan_shard(fake_planning):
+    partial = sharding.plan_shard('.', 0, 2, git_rev='abc')
+    assert partial['commit_sha'] == 'abc'
+    assert partial['n_units'] == 3
+    assert sorted(partial['plans']) == ['0', '2']
+
+
+def test_merge_shards(fake_planning, testing_workdir):
+    for shard in range(2):
+        sharding.write_shard(sharding.plan_shard('.', shard, 2, git_rev='abc'),
+                             'shard{0}.json'.format(shard))
+    jobs = sharding.merge_shards([sharding.read_shard('shard{0}.json'.format(shard))
+                                  for shard in range(2)])
+    assert set(jobs.nodes()) == set(['build_a_linux', 'build_a_osx', 'test_a_linux'])
+    assert jobs.edges() == [('test_a_linux', 'build_a_linux')]
+    assert jobs.node['test_a_linux']['commit_sha'] == 'abc'
+
+
+def test_merge_shards_missing_unit(fake_planning):
+    with pytest.raises(ValueError):
+        sharding.merge_shards([sharding.plan_shard('.', 0, 2)])
+
+
+def test_merge_shards_duplicate_unit(fake_planning):
+    partial = sharding.plan_shard('.', 0, 1)
+    with pytest.raises(ValueError):
+        sharding.merge_shards([partial, partial])
+
+
+def test_merge_shards_different_commits(fake_planning):
+    with pytest.raises(ValueError):
+        sharding.merge_shards([sharding.plan_shard('.', 0, 2, git_rev='abc'),
+                               sharding.plan_shard('.', 1, 2, git_rev='def')])
+
+
+def test_merge_shards_same_revision_different_commits(fake_planning):
+    # both shards planned HEAD, but HEAD had moved on by the time the second did
+    sharding.resolve_rev.side_effect = ['abc', 'def']
+    with pytest.raises(ValueError):
+        sharding.merge_shards([sharding.plan_shard('.', 0, 2), sharding.plan_shard('.', 1, 2)])
@@ -0,0 +1,81 @@
+import io
+import json
+import time
+
+import networkx as nx
+
+from conda_gitlab_ci.history import DurationHistory
+from conda_gitlab_ci.status import StatusBoard
+
+from .utils import testing_workdir
+
+
+def make_board(**kwargs):
+    # c depends on b depends on a; d stands alone
+    jobs = nx.DiGraph()
+    for key, label in (('a', 'linux'), ('b', 'linux'), ('c', 'osx'), ('d', 'osx')):
+        jobs.add_node(key, worker_label=label, package=key)
+    jobs.add_edges_from([('b', 'a'), ('c', 'b')])
+    history = DurationHistory()
+    for key, seconds in (('a', 100), ('b', 200), ('c', 300), ('d', 50)):
+        history.record(key, key, seconds)
+    return StatusBoard(jobs, history=history, stream=io.StringIO(), **kwargs)
+
+
+def test_counts_per_label():
+    board = make_board()
+    assert board.counts == {'linux': {'queued': 2}, 'osx': {'queued': 2}}
+    board.job_event('a', 'submitted')
+    board.job_event('a', 'running')
+    board.job_event('d', 'failed')
+    # finished jobs stay finished
+    board.job_event('d', 'running')
+    assert board.counts == {'linux': {'queued': 1, 'submitted': 0, 'running': 1},
+                            'osx': {'queued': 1, 'failed': 1}}
+    assert board.totals()['running'] == 1
+
+
+def test_job_routed():
+    board = make_board()
+    board.job_event('a', 'submitted')
+    board.job_routed('a', 'linux-spot')
+    board.job_routed('b', 'linux')
+    assert board.counts == {'linux': {'queued': 1, 'submitted': 0},
+                            'linux-spot': {'submitted': 1}, 'osx': {'queued': 2}}
+    assert board.snapshot()['jobs']['a']['worker_label'] == 'linux-spot'
+
+
+def test_eta_follows_longest_chain():
+    board = make_board()
+    # a -> b -> c is 600 seconds, d alone is 50
+    assert board.eta() == 600
+    board.job_event('a', 'success')
+    assert board.eta() == 500
+    board.job_event('b', 'running')
+    board.started['b'] = time.time() - 50
+    assert 440 < board.eta() <= 450
+
+
+def test_jobs_added():
+    board = make_board()
+    jobs = board.jobs.copy()
+    # e waits on c; known jobs are not counted again
+    jobs.add_node('e', worker_label='linux', package='e')
+    jobs.add_edge('e', 'c')
+    board.history.record('e', 'e', 100)
+    board.jobs_added(jobs, ['c', 'e'])
+    assert board.counts == {'linux': {'queued': 3}, 'osx': {'queued': 2}}
+    assert board.eta() == 700
+
+
+def test_status_file(testing_workdir):
+    with make_board(path='status.json', interval=60) as board:
+        board.job_event('a', 'pending')
+    with open('status.json') as f:
+        status = json.load(f)
+    assert status['jobs']['a'] == {'state': 'pending', 'worker_label': 'linux'}
+    assert status['counts']['queued'] == 3
+    assert status['labels']['osx'] == {'queued': 2}
+    assert status['eta_seconds'] == 600
+    assert '1 pending' in board.stream.getvalue()
+    assert 'ETA 0:10:00' in board.stream.getvalue()
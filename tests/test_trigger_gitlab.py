@@ -1,6 +1,8 @@
+import json
+
 import responses
 
-from conda_gitlab_ci import trigger_gitlab
+from conda_gitlab_ci import metrics, trigger_gitlab
 import pytest
 
 
@@ -14,29 +16,41 @@ def set_ci_environ_vars(monkeypatch):
     monkeypatch.setenv('CI_PROJECT_URL', "http://some.test.ci.com/somegroup/projectname")
 
 
+# what gitlab's v4 API answers, trimmed.  A trigger starts pipeline 1234, whose jobs have ids
+#    of their own.
+PIPELINE = {'id': 1234, 'sha': '123abc', 'ref': '123abc', 'status': 'created',
+            'web_url': 'http://some.test.ci.com/somegroup/projectname/pipelines/1234'}
+PIPELINE_JOBS = [{'id': 7001, 'name': 'run_fused', 'stage': 'test', 'status': 'failed',
+                  'pipeline': {'id': 1234, 'status': 'failed'}},
+                 {'id': 7000, 'name': 'build', 'stage': 'test', 'status': 'success',
+                  'pipeline': {'id': 1234, 'status': 'failed'}}]
+
+
 @responses.activate
 def test_check_job_status(set_ci_environ_vars, monkeypatch):
+    responses.add(responses.POST,
+                  'http://some.test.ci.com/api/v4/projects/2/trigger/pipeline',
+                  status=201, json=PIPELINE)
     responses.add(responses.GET,
-                  'http://some.test.ci.com/api/v3/projects/2/repository/commits/123abc/statuses',
-                  status=200,
-                  json=[{"id": 1, "status": "success"}, {"id": 2, "status": "failed"}],
-                  content_type='application/json')
-    assert trigger_gitlab.check_job_status(1, repo_ref='123abc') == 'success'
-    assert trigger_gitlab.check_job_status(2, repo_ref='123abc') == 'failed'
+                  'http://some.test.ci.com/api/v4/projects/2/pipelines/1234',
+                  status=200, json=dict(PIPELINE, status='waiting_for_resource'))
+    build_id = trigger_gitlab.submit_job({'variables': {'BUILD_RECIPE': 'frank'}}, '123abc')
+    assert trigger_gitlab.check_job_status(build_id, commit_sha='123abc') == \
+        'waiting_for_resource'
     monkeypatch.delenv('GITLAB_PRIVATE_TOKEN')
     with pytest.raises(ValueError):
-        trigger_gitlab.check_job_status(2, repo_ref='123abc')
+        trigger_gitlab.check_job_status(build_id)
 
 
 @responses.activate
 def test_submit_job(set_ci_environ_vars, monkeypatch):
     responses.add(responses.POST,
-                  'http://some.test.ci.com/api/v3/projects/2/trigger/builds',
+                  'http://some.test.ci.com/api/v4/projects/2/trigger/pipeline',
                   status=201,
-                  json={'id': 1, 'variables': {'BUILD_RECIPE': 'frank'}},
+                  json=PIPELINE,
                   )
     config = {'variables': {'BUILD_RECIPE': 'frank'}}
-    assert trigger_gitlab.submit_job(config, '123abc') == 1
+    assert trigger_gitlab.submit_job(config, '123abc') == 1234
     monkeypatch.delenv('TRIGGER_TOKEN')
     with pytest.raises(ValueError):
         trigger_gitlab.submit_job(config, '123abc')
@@ -49,14 +63,84 @@ def test_submit_job_with_no_recipe_is_noop():
 
 def test_url_from_env_vars(set_ci_environ_vars, monkeypatch):
     assert (trigger_gitlab._get_url_from_env_vars('trigger') ==
-            "http://some.test.ci.com/api/v3/projects/2/trigger/builds")
-    assert (trigger_gitlab._get_url_from_env_vars('status') ==
-            "http://some.test.ci.com/api/v3/projects/2/repository/commits/123abc/statuses")
+            "http://some.test.ci.com/api/v4/projects/2/trigger/pipeline")
+    assert (trigger_gitlab._get_url_from_env_vars('cancel', pipeline_id=1234) ==
+            "http://some.test.ci.com/api/v4/projects/2/pipelines/1234/cancel")
 
 
-@pytest.mark.parametrize("var", ('CI_PROJECT_URL', 'CI_PROJECT_ID', 'CI_BUILD_REF'))
+@pytest.mark.parametrize("var", ('CI_PROJECT_URL', 'CI_PROJECT_ID'))
 def test_url_from_env_vars_raises_missing_vars(set_ci_environ_vars, monkeypatch, var):
     with pytest.raises(ValueError):
         monkeypatch.delenv(var)
         trigger_gitlab._get_url_from_env_vars('trigger')
         monkeypatch.undo()
+
+
+@responses.activate
+def test_cancel_job(set_ci_environ_vars, monkeypatch):
+    responses.add(responses.POST,
+                  'http://some.test.ci.com/api/v4/projects/2/pipelines/1234/cancel',
+                  status=200,
+                  json=dict(PIPELINE, status='canceled'),
+                  )
+    assert trigger_gitlab.cancel_job(1234) == 'canceled'
+    monkeypatch.delenv('GITLAB_PRIVATE_TOKEN')
+    with pytest.raises(ValueError):
+        trigger_gitlab.cancel_job(1234)
+
+
+@responses.activate
+def test_get_job_trace(set_ci_environ_vars):
+    responses.add(responses.GET,
+                  'http://some.test.ci.com/api/v4/projects/2/pipelines/1234/jobs',
+                  status=200, json=PIPELINE_JOBS)
+    responses.add(responses.GET,
+                  'http://some.test.ci.com/api/v4/projects/2/jobs/7000/trace',
+                  status=200, body="skipped: no BUILD_RECIPE\n")
+    responses.add(responses.GET,
+                  'http://some.test.ci.com/api/v4/projects/2/jobs/7001/trace',
+                  status=200, body="CGCI_RESULT test_a success\n")
+    # the logs of every job of the pipeline
+    assert trigger_gitlab.get_job_trace(1234) == ("skipped: no BUILD_RECIPE\n\n"
+                                                  "CGCI_RESULT test_a success\n")
+
+
+@responses.activate
+def test_api_errors_are_counted(set_ci_environ_vars):
+    responses.add(responses.POST,
+                  'http://some.test.ci.com/api/v4/projects/2/trigger/pipeline',
+                  status=500,
+                  json={'message': 'oops'},
+                  )
+    metrics.registry.reset()
+    config = {'variables': {'BUILD_RECIPE': 'frank'}}
+    with pytest.raises(AssertionError):
+        trigger_gitlab.submit_job(config, '123abc')
+    assert metrics.registry.snapshot()['api'] == {'trigger': {'requests': 1, 'errors': 1,
+                                                              'error_rate': 1.0}}
+
+
+@responses.activate
+def test_submit_pipeline(set_ci_environ_vars, monkeypatch):
+    responses.add(responses.POST,
+                  'http://some.test.ci.com/api/v4/projects/2/trigger/pipeline',
+                  status=201,
+                  json={'id': 5},
+                  )
+    assert trigger_gitlab.submit_pipeline({'CGCI_PIPELINE': 'abc'}, '123abc') == 5
+    payload = json.loads(responses.calls[0].request.body)
+    assert payload == {'token': 'trigger_token_value', 'ref': '123abc',
+                       'variables': {'CGCI_PIPELINE': 'abc'}}
+    monkeypatch.delenv('TRIGGER_TOKEN')
+    with pytest.raises(ValueError):
+        trigger_gitlab.submit_pipeline({}, '123abc')
+
+
+@responses.activate
+def test_check_pipeline_status(set_ci_environ_vars):
+    responses.add(responses.GET,
+                  'http://some.test.ci.com/api/v4/projects/2/pipelines/5',
+                  status=200,
+                  json={'id': 5, 'status': 'running'},
+                  )
+    assert trigger_gitlab.check_pipeline_status(5) == 'running'
@@ -96,6 +96,22 @@ def testing_graph(request):
     return g
 
 
+def make_jobs(edges=(), nodes=(), variables=None, commit_sha='abc', **attrs):
+    """ Build a job graph with one job per key that builds the recipe of the same name
+
+    :param edges: (dependent, dependency) pairs; their keys become jobs too
+    :param nodes: keys of jobs with no edges
+    :param variables: extra configuration variables for every job
+    :param attrs: extra node attributes for every job, e.g. worker_label
+    """
+    jobs = nx.DiGraph()
+    for key in sorted(set(nodes) | set(n for edge in edges for n in edge)):
+        configuration = {'variables': dict(variables or {}, BUILD_RECIPE=key)}
+        jobs.add_node(key, configuration=configuration, commit_sha=commit_sha, **attrs)
+    jobs.add_edges_from(edges)
+    return jobs
+
+
 @pytest.fixture(scope='function')
 def testing_conda_resolve(request):
     index = {